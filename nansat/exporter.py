@@ -25,7 +25,9 @@ import numpy as np
 from netCDF4 import Dataset
 
 from nansat.vrt import VRT
+from nansat.nsr import NSR
 from nansat.node import Node
+from nansat.tools import GCP_DTYPE, GCP_VARIABLE, gcps_to_array
 
 from nansat.warnings import NansatFutureWarning
 from nansat.exceptions import NansatGDALError
@@ -50,12 +52,38 @@ class Exporter(object):
     DEFAULT_INSTITUTE = 'NERSC'
     DEFAULT_SOURCE = 'satellite remote sensing'
 
+    # name of the variable with GCPs in exported netCDF files
+    GCP_VARIABLE = GCP_VARIABLE
+
+    # methods which can be used in export_many
+    EXPORT_MANY_METHODS = ['export', 'export2thredds', 'export_append', 'write_figure',
+                           'write_geotiffimage']
+    # maximum width and height of figures written by export_many
+    QUICKLOOK_SIZE = 1000
+
+    # size of tiles in cloud optimised GeoTIFF
+    COG_TILE_SIZE = 256
+
+    # number of pixels in a block of rows written by export2thredds
+    THREDDS_BLOCK_SIZE = 4 * 1024 * 1024
+
+    # export profiles: driver and GDAL creation options
+    EXPORT_PROFILES = {
+        'netcdf4': ('netCDF', ['FORMAT=NC4', 'COMPRESS=DEFLATE', 'ZLEVEL=4', 'CHUNKING=YES']),
+        'gtiff_deflate': ('GTiff', ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256',
+                                    'COMPRESS=DEFLATE', 'ZLEVEL=6']),
+        'gtiff_zstd': ('GTiff', ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256',
+                                 'COMPRESS=ZSTD', 'ZSTD_LEVEL=9']),
+        'cog': ('COG', ['COMPRESS=DEFLATE', 'ZLEVEL=6']),
+    }
+
     UNWANTED_METADATA = ['dataType', 'SourceFilename', 'SourceBand', '_Unsigned', 'FillValue',
                                 'time', '_FillValue', 'type', 'scale', 'offset']
 
     def export(self, filename='', fileName='', bands=None, rm_metadata=None, rmMetadata=None,
                addGeoloc=None, add_geolocation=True,
-               addGCPs=None, driver='netCDF', bottomup=None, options=None, hardcopy=False):
+               addGCPs=None, driver='netCDF', bottomup=None, options=None, hardcopy=False,
+               profile=None, processes=1, overview_resampling='AVERAGE'):
         '''Export Nansat object into netCDF or GTiff file
 
         Parameters
@@ -71,7 +99,8 @@ class Exporter(object):
         add_geolocation : bool
             add geolocation array datasets to exported file?
         driver : str
-            Name of GDAL driver (format)
+            Name of GDAL driver (format). 'COG' creates a cloud optimised GeoTIFF: tiled GeoTIFF
+            with internal overviews and all IFDs at the beginning of the file.
         bottomup : bool
             False: Write swath-projected data with rows and columns
                    organized as in the original product.
@@ -82,6 +111,18 @@ class Exporter(object):
             See also http://www.gdal.org/frmt_netcdf.html
         hardcopy : bool
             Evaluate all bands just before export?
+        profile : str
+            name of export profile (see Exporter.EXPORT_PROFILES) which sets driver and
+            creation options: 'netcdf4' (netCDF4 with row chunks and DEFLATE compression),
+            'gtiff_deflate' or 'gtiff_zstd' (tiled GeoTIFF with DEFLATE or ZSTD compression
+            and predictor), 'cog' (cloud optimised GeoTIFF with DEFLATE compression).
+            Values in <options> override options of the profile.
+        processes : int
+            number of bands evaluated in parallel before export (and number of threads used
+            by GDAL for compression of GeoTIFF)
+        overview_resampling : str
+            resampling of overviews in COG ('AVERAGE' for continuous data, 'MODE' or
+            'NEAREST' for classes and flags)
 
         Modifies
         ---------
@@ -108,6 +149,12 @@ class Exporter(object):
         # export all bands into a GeoTiff
         >>> n.export(driver='GTiff')
 
+        # export all bands into a compressed netCDF4 file evaluating 4 bands in parallel
+        >>> n.export(netcdfile, profile='netcdf4', processes=4)
+
+        # export all bands into a compressed cloud optimised GeoTIFF with overviews
+        >>> n.export(tiffile, profile='cog')
+
         '''
         # trigger Nansat future warnings on deprecated features
         if fileName != '':
@@ -128,6 +175,8 @@ class Exporter(object):
             options = []
         if type(options) == str:
             options = [options]
+        if profile is not None:
+            driver, options = Exporter._get_profile_options(profile, options)
 
         # temporary VRT for exporting
         export_vrt = self.vrt.copy()
@@ -139,23 +188,91 @@ class Exporter(object):
         export_vrt.fix_global_metadata(rm_metadata)
 
         # if output filename is the same as input one
-        if self.filename == filename or hardcopy:
-            export_vrt.hardcopy_bands()
+        if self.filename == filename or hardcopy or processes > 1:
+            export_vrt.hardcopy_bands(processes)
 
-        if driver == 'GTiff':
+        if driver in ['GTiff', 'COG']:
             options, add_gcps = export_vrt.prepare_export_gtiff(options)
+            options = Exporter._set_gtiff_compression_options(export_vrt, options, processes)
         else:
             options, add_gcps = export_vrt.prepare_export_netcdf(options, bottomup)
 
         # Create output file using GDAL
-        dataset = gdal.GetDriverByName(driver).CreateCopy(filename, export_vrt.dataset, options=options)
-        del dataset
+        if driver == 'COG':
+            Exporter._export_cog(export_vrt.dataset, filename, options, overview_resampling)
+        else:
+            dataset = gdal.GetDriverByName(driver).CreateCopy(filename, export_vrt.dataset,
+                                                              options=options)
+            del dataset
         # add GCPs into netCDF file as separate float variables
         if add_gcps:
             Exporter._add_gcps(filename, export_vrt.dataset.GetGCPs(), bottomup)
 
         self.logger.debug('Export - OK!')
 
+    def export_many(self, targets, bands=None, processes=1):
+        """Write several outputs (files and figures) evaluating bands only once
+
+        Bands of a copy of the VRT are evaluated once (pixel functions, warping, etc.) into
+        scratch files in the temporary directory and all outputs are written from the
+        evaluated data. Figures are made from decimated reads of the evaluated data (see
+        Nansat.write_figure(max_size=...)). The scratch files are deleted afterwards.
+
+        Notes
+        -----
+        The temporary directory must have space for all evaluated bands (width * height *
+        item size of each band). Only the blocks being evaluated (see VRT.hardcopy_bands) and
+        the blocks being written are kept in memory.
+
+        Parameters
+        ----------
+        targets : list of dict
+            outputs. Each dict has key 'filename', optional key 'method' (one of
+            Exporter.EXPORT_MANY_METHODS, default 'export') and other keys with parameters of
+            the method. For 'write_figure', optional key 'max_size' sets maximum width and
+            height of the figure (default QUICKLOOK_SIZE).
+        bands : list
+            names or numbers of bands to evaluate. If None, all bands are evaluated.
+        processes : int
+            number of bands evaluated in parallel
+
+        Examples
+        --------
+        # write netCDF, GeoTIFF and quicklook
+        >>> n.export_many([{'filename': 'product.nc'},
+                           {'filename': 'product.tif', 'profile': 'gtiff_deflate'},
+                           {'filename': 'quicklook.png', 'method': 'write_figure',
+                            'bands': 'sigma0_HH', 'clim': 'hist', 'max_size': 800}])
+
+        """
+        for target in targets:
+            if target.get('method', 'export') not in self.EXPORT_MANY_METHODS:
+                raise ValueError('Unknown method %s. Use one of %s'
+                                 % (target['method'], self.EXPORT_MANY_METHODS))
+
+        # temporary Nansat object with evaluated bands
+        evaluated = self.__class__.__new__(self.__class__)
+        evaluated._init_empty(self.filename, self.logger.level)
+        evaluated.mapper = self.mapper
+        evaluated.vrt = self.vrt.copy()
+        if bands is not None:
+            evaluated.vrt.leave_few_bands(bands)
+        copied_band_vrts = dict(evaluated.vrt.band_vrts)
+        try:
+            evaluated.vrt.hardcopy_bands(processes, nomem=True)
+            for target in targets:
+                kwargs = dict(target)
+                method = kwargs.pop('method', 'export')
+                if method == 'write_figure':
+                    kwargs['max_size'] = kwargs.get('max_size', self.QUICKLOOK_SIZE)
+                getattr(evaluated, method)(**kwargs)
+        finally:
+            # delete scratch files of the evaluated bands (band VRTs of self are shared)
+            evaluated.vrt.dataset = None
+            for band_number, band_vrt in list(evaluated.vrt.band_vrts.items()):
+                if band_vrt is not copied_band_vrts.get(band_number):
+                    evaluated.vrt.band_vrts.pop(band_number)._remove_files()
+
     def export2thredds(self, filename, bands, metadata=None,
                         mask_name=None, maskName=None, rm_metadata=None, rmMetadata=None,
                         time=None, created=None, createdTime=None):
@@ -193,6 +310,8 @@ class Exporter(object):
         ----
         Nansat object (self) has to be projected (with valid GeoTransform and
         valid Spatial reference information) but not wth GCPs
+        Bands are read by blocks of rows (THREDDS_BLOCK_SIZE pixels), scaled and written
+        directly into the netCDF file (rows are written bottom-up).
 
         Examples
         --------
@@ -227,192 +346,504 @@ class Exporter(object):
         if len(self.vrt.dataset.GetGCPs()) > 0:
             raise ValueError('Cannot export dataset with GCPS for THREDDS!')
 
-        # Create temporary empty Nansat object with self domain
-        data = self.__class__.__new__(self.__class__)
-        data._init_from_domain(self)
-
-        # get mask (if exist)
-        if mask_name is not None:
-            mask = self[mask_name]
-
-        # add required bands to data
-        dstBands = {}
-        srcBands = [self.bands()[b]['name'] for b in self.bands()]
-        for iband in bands:
-            # skip non exiting bands
-            if iband not in srcBands:
-                self.logger.error('%s is not found' % str(iband))
-                continue
-
-            array = self[iband]
-
-            # catch None band error
-            if array is None:
-                raise NansatGDALError('%s is None' % str(iband))
-
-            # set type, scale and offset from input data or by default
-            dstBands[iband] = {}
-            dstBands[iband]['type'] = bands[iband].get('type',
-                                             array.dtype.str.replace('u', 'i'))
-            dstBands[iband]['scale'] = float(bands[iband].get('scale', 1.0))
-            dstBands[iband]['offset'] = float(bands[iband].get('offset', 0.0))
-            if '_FillValue' in bands[iband]:
-                dstBands[iband]['_FillValue'] = np.array(
-                                            [bands[iband]['_FillValue']],
-                                            dtype=dstBands[iband]['type'])[0]
-
-            # mask values with np.nan
-            if maskName is not None and iband != maskName:
-                array[mask != 64] = np.nan
+        if time is None:
+            time = self.time_coverage_start
+        self._export_thredds(filename, bands, time, metadata, mask_name, rm_metadata, created)
 
-            # add array to a temporary Nansat object
-            bandMetadata = self.get_metadata(band_id=iband)
-            data.add_band(array=array, parameters=bandMetadata)
-        self.logger.debug('Bands for export: %s' % str(dstBands))
+    def export_append(self, filename, bands=None, time=None, metadata=None, mask_name=None,
+                      rm_metadata=None, created=None):
+        """Append data at a new time into a netCDF file formatted as by export2thredds
 
-        global_metadata = Exporter._set_global_metadata(created, data, metadata)
+        On the first call the file is created with unlimited time dimension, on the following
+        calls only the new time slice of each band is written into the existing variables
+        (with their type, scale, offset and _FillValue). Nansat objects appended into one file
+        must have the same Domain. The time value is written after all bands, so a time slice
+        left by a failed append has no time and is overwritten by the next append.
 
-        # export temporary Nansat object to a temporary netCDF
-        fid, tmp_filename = tempfile.mkstemp(suffix='.nc')
-        os.close(fid)
-        data.export(tmp_filename, rm_metadata=rm_metadata)
-        del data
+        Parameters
+        ----------
+        filename : str
+            output file name
+        bands : dict
+            parameters for band creation (see export2thredds). If None, all bands are
+            exported without changing type and scaling.
+        time : datetime.datetime
+            time of the data. If None, time_coverage_start is used.
+        metadata : dict
+            global metadata to add (used only when the file is created)
+        mask_name: str
+            name of the mask band. Non-masked value is 64.
+        rm_metadata : list
+            unwanted metadata names which will be removed
+        created : datetime
+            date of creation (used only when the file is created)
 
-        self._post_proc_thredds(tmp_filename, filename, bands, dstBands, time, global_metadata)
+        Raises
+        ------
+        ValueError
+            if the dataset has GCPs, if grid or variables of the file are different or if
+            the file already contains data at this time.
 
-    def _create_dimensions(self, nc_inp, nc_out, time):
-        """Create space and time dimenstions in the destination file"""
-        # get time from Nansat object or from input datetime
+        Examples
+        --------
+        # build time series from daily files
+        >>> for filename in filenames:
+        >>>     n = Nansat(filename).reproject(d)
+        >>>     n.export_append('timeseries.nc', {'sst': {'type': '>i2', 'scale': 0.01}})
+
+        """
+        if bands is None:
+            bands = dict([(self.bands()[b]['name'], {}) for b in self.bands()])
+        if not isinstance(bands, dict):
+            raise ValueError('<bands> must be dict!')
+        if metadata is None:
+            metadata = {}
+        if len(self.vrt.dataset.GetGCPs()) > 0:
+            raise ValueError('Cannot export dataset with GCPS for THREDDS!')
         if time is None:
             time = self.time_coverage_start
 
-        # collect info on dimension names
-        dim_names = []
-        grid_mapping_name = None
-        for inp_var_name in nc_inp.variables:
-            inp_var = nc_inp.variables[inp_var_name]
-            dim_names += list(inp_var.dimensions)
-            # get grid_mapping_name
-            if hasattr(inp_var, 'grid_mapping_name'):
-                grid_mapping_name = inp_var.grid_mapping_name
-                grid_mapping_var_name = inp_var_name
-        dim_names = list(set(dim_names))
-
-        # collect info on dimension shapes
-        dim_shapes = {}
-        for dim_name in dim_names:
-            dim_var = nc_inp.variables[dim_name]
-            dim_shapes[dim_name] = dim_var.shape[0]
-
-        # create dimensions
-        for dim_name in dim_names:
-            nc_out.createDimension(dim_name, dim_shapes[dim_name])
+        if not os.path.exists(filename):
+            self._export_thredds(filename, bands, time, metadata, mask_name, rm_metadata,
+                                 created, unlimited=True)
+            return
+
+        export_bands, mask = self._get_thredds_bands(bands, mask_name)
+        nc_out = Dataset(filename, 'a')
+        try:
+            # check compatibility of the file before writing anything
+            dimensions = self._check_thredds_grid(nc_out)
+            for band_name in export_bands:
+                if band_name not in nc_out.variables:
+                    raise ValueError('Variable %s is not in %s' % (band_name, filename))
+                if nc_out.variables[band_name].dimensions != dimensions:
+                    raise ValueError('Variable %s in %s has wrong dimensions %s' % (
+                        band_name, filename, nc_out.variables[band_name].dimensions))
+            days = Exporter._get_thredds_time(time)
+            time_var = nc_out.variables['time']
+            times = time_var[:]
+            if np.any(times == days):
+                raise ValueError('%s already contains data at %s' % (filename, time))
+
+            # reuse a time slice left without time value by a failed append
+            empty_slices = np.flatnonzero(np.ma.getmaskarray(times))
+            if len(empty_slices) > 0:
+                time_index = int(empty_slices[0])
+            else:
+                time_index = len(time_var)
+            grid_mapping_name = None
+            for var_name in nc_out.variables:
+                if 'grid_mapping_name' in nc_out.variables[var_name].ncattrs():
+                    grid_mapping_name = var_name
+            for band_name in export_bands:
+                self._write_thredds_band(nc_out, band_name, bands[band_name], dimensions,
+                                         grid_mapping_name, mask, mask_name, rm_metadata,
+                                         time_index)
+            # time is written only when all bands are written
+            time_var[time_index] = days
+        finally:
+            nc_out.close()
+
+    def _get_thredds_bands(self, bands, mask_name=None):
+        """Get names of existing bands to export and mask band (or None)"""
+        # get mask band (if exist)
+        mask = None
+        if mask_name is not None:
+            mask = self.get_GDALRasterBand(mask_name)
+
+        # skip non exiting bands
+        src_bands = [self.bands()[b]['name'] for b in self.bands()]
+        for band_name in bands:
+            if band_name not in src_bands:
+                self.logger.error('%s is not found' % str(band_name))
+        export_bands = [band_name for band_name in bands if band_name in src_bands]
+        return export_bands, mask
+
+    def _export_thredds(self, filename, bands, time, metadata, mask_name=None, rm_metadata=None,
+                        created=None, unlimited=False):
+        """Create netCDF file for THREDDS and write all bands (see export2thredds)"""
+        export_bands, mask = self._get_thredds_bands(bands, mask_name)
+        global_metadata = Exporter._set_global_metadata(created, self, metadata)
+
+        nc_out = Dataset(filename, 'w')
+        try:
+            grid_mapping_name, dimensions = self._create_thredds_grid(nc_out, time, unlimited)
+            for band_name in export_bands:
+                self._write_thredds_band(nc_out, band_name, bands[band_name], dimensions,
+                                         grid_mapping_name, mask, mask_name, rm_metadata)
+
+            # add common and custom global attributes
+            nc_out.setncattr('Conventions', 'CF-1.5')
+            projection = str(self.vrt.get_projection())
+            nc_out.setncattr('NANSAT_Projection',
+                             projection.replace(',', '|').replace('"', '&'))
+            nc_out.setncattr('NANSAT_GeoTransform',
+                             str(self.vrt.dataset.GetGeoTransform()).replace(',', '|'))
+            nc_out.setncatts(global_metadata)
+        finally:
+            nc_out.close()
 
+    @staticmethod
+    def _get_thredds_time(time):
+        """Get value of the time variable (days since 1900-01-01)"""
+        td = time - datetime.datetime(1900, 1, 1)
+        return td.days + (float(td.seconds) / 60.0 / 60.0 / 24.0)
+
+    def _get_thredds_coordinates(self):
+        """Get names, values and attributes of coordinate variables (x/y or lon/lat)
+
+        Coordinates of pixel centers are computed from GeoTransform. Rows are written
+        bottom-up, so y (lat) coordinates increase.
+
+        Returns
+        -------
+        coordinates : list
+            [(y_name, y_values, y_attributes), (x_name, x_values, x_attributes)]
+
+        """
+        x_size = self.vrt.dataset.RasterXSize
+        y_size = self.vrt.dataset.RasterYSize
+        geo_transform = self.vrt.dataset.GetGeoTransform()
+        x = geo_transform[0] + (np.arange(x_size) + 0.5) * geo_transform[1]
+        y = geo_transform[3] + (np.arange(y_size)[::-1] + 0.5) * geo_transform[5]
+        if NSR(self.vrt.get_projection()).IsGeographic():
+            return [('lat', y.astype('>f4'), {'standard_name': 'latitude',
+                                              'long_name': 'latitude',
+                                              'units': 'degrees_north'}),
+                    ('lon', x.astype('>f4'), {'standard_name': 'longitude',
+                                              'long_name': 'longitude',
+                                              'units': 'degrees_east'})]
+        return [('y', np.floor(y).astype('>f4'), {'standard_name': 'projection_y_coordinate',
+                                                  'long_name': 'y coordinate of projection',
+                                                  'units': 'm', 'axis': 'Y'}),
+                ('x', np.floor(x).astype('>f4'), {'standard_name': 'projection_x_coordinate',
+                                                  'long_name': 'x coordinate of projection',
+                                                  'units': 'm', 'axis': 'X'})]
+
+    def _create_thredds_grid(self, nc_out, time, unlimited=False):
+        """Create time and space dimensions, coordinate and grid mapping variables
+
+        Parameters
+        ----------
+        nc_out : netCDF4.Dataset
+            opened output file
+        time : datetime.datetime
+            value of the time variable
+        unlimited : bool
+            create unlimited time dimension (for appending data with export_append)?
+
+        Returns
+        -------
+        grid_mapping_name : str
+            name of the grid mapping variable
+        dimensions : tuple
+            dimensions of the data variables (e.g. ('time', 'y', 'x'))
+
+        """
         # add time dimension
-        nc_out.createDimension('time', 1)
+        nc_out.createDimension('time', None if unlimited else 1)
         out_var = nc_out.createVariable('time', '>f8',  ('time', ))
         out_var.calendar = 'standard'
         out_var.long_name = 'time'
         out_var.standard_name = 'time'
         out_var.units = 'days since 1900-1-1 0:0:0 +0'
         out_var.axis = 'T'
-        # create value for time variable
-        td = time - datetime.datetime(1900, 1, 1)
-        days = td.days + (float(td.seconds) / 60.0 / 60.0 / 24.0)
         # add date
-        out_var[:] = days
+        out_var[0] = Exporter._get_thredds_time(time)
+
+        # add space dimensions and coordinates of pixel centers
+        coordinates = self._get_thredds_coordinates()
+        for var_name, values, attributes in coordinates:
+            nc_out.createDimension(var_name, len(values))
+            out_var = nc_out.createVariable(var_name, '>f4', (var_name, ))
+            out_var.setncatts(attributes)
+            out_var[:] = values
+
+        # add grid mapping variable
+        grid_mapping_name, var_type, attributes = self._get_thredds_grid_mapping()
+        if grid_mapping_name is not None:
+            out_var = nc_out.createVariable(grid_mapping_name, var_type, ())
+            out_var.setncatts(attributes)
+
+        return grid_mapping_name, ('time', coordinates[0][0], coordinates[1][0])
+
+    def _get_thredds_grid_mapping(self):
+        """Get grid mapping attributes generated by GDAL for a one-pixel dataset
+
+        Returns
+        -------
+        grid_mapping_name : str
+            name of the grid mapping variable (None if GDAL does not write it)
+        var_type : str
+            data type of the grid mapping variable
+        attributes : dict
+            attributes of the grid mapping variable
+
+        """
+        template = gdal.GetDriverByName(str('MEM')).Create(str(''), 1, 1, 1, gdal.GDT_Byte)
+        template.SetProjection(self.vrt.dataset.GetProjection())
+        template.SetGeoTransform(self.vrt.dataset.GetGeoTransform())
+        fid, tmp_filename = tempfile.mkstemp(suffix='.nc')
+        os.close(fid)
+        grid_mapping_name, var_type, attributes = None, None, {}
+        try:
+            dataset = gdal.GetDriverByName(str('netCDF')).CreateCopy(tmp_filename, template)
+            del dataset
+            nc_inp = Dataset(tmp_filename, 'r')
+            try:
+                for inp_var in nc_inp.variables.values():
+                    if hasattr(inp_var, 'grid_mapping_name'):
+                        grid_mapping_name = inp_var.grid_mapping_name
+                        var_type = inp_var.dtype.str
+                        attributes = dict([(str(key), inp_var.getncattr(key))
+                                           for key in inp_var.ncattrs()
+                                           if str(key) not in Exporter.UNWANTED_METADATA])
+            finally:
+                nc_inp.close()
+        finally:
+            os.remove(tmp_filename)
+
+        return grid_mapping_name, var_type, attributes
+
+    def _check_thredds_grid(self, nc_out):
+        """Check that time dimension is unlimited and grid of the file is equal to self
+
+        Both the coordinates and the attributes of the grid mapping variable (i.e. the
+        projection) are compared.
+
+        Returns
+        -------
+        dimensions : tuple
+            dimensions of the data variables (e.g. ('time', 'y', 'x'))
+
+        Raises
+        ------
+        ValueError
+            if the file has a different grid or fixed time dimension
+
+        """
+        if 'time' not in nc_out.dimensions or not nc_out.dimensions['time'].isunlimited():
+            raise ValueError('Cannot append to file without unlimited time dimension')
+        coordinates = self._get_thredds_coordinates()
+        for var_name, values, attributes in coordinates:
+            if (var_name not in nc_out.variables or
+                    nc_out.variables[var_name].shape != values.shape or
+                    not np.allclose(nc_out.variables[var_name][:], values)):
+                raise ValueError('Grid of the file is different (%s)' % var_name)
+
+        grid_mapping_name, var_type, attributes = self._get_thredds_grid_mapping()
+        if grid_mapping_name is not None:
+            if grid_mapping_name not in nc_out.variables:
+                raise ValueError('Grid mapping of the file is different (%s)'
+                                 % grid_mapping_name)
+            out_var = nc_out.variables[grid_mapping_name]
+            for key in attributes:
+                if (key not in out_var.ncattrs() or
+                        not Exporter._equal_ncattrs(out_var.getncattr(key), attributes[key])):
+                    raise ValueError('Grid mapping of the file is different (%s)' % key)
+        return ('time', coordinates[0][0], coordinates[1][0])
 
-        return grid_mapping_name, grid_mapping_var_name
+    @staticmethod
+    def _equal_ncattrs(value1, value2):
+        """Compare values of two netCDF attributes (numbers with tolerance)"""
+        value1, value2 = np.asarray(value1), np.asarray(value2)
+        if value1.dtype.kind in 'iuf' and value2.dtype.kind in 'iuf':
+            return value1.shape == value2.shape and np.allclose(value1, value2)
+        return value1.shape == value2.shape and np.all(value1 == value2)
 
-    def _post_proc_thredds(self, tmp_filename, out_filename, bands, band_metadata, time, global_metadata):
-        """Post processing of file for THREDDS (add time variable and metadata)"""
-        # open files for input and output
-        nc_inp = Dataset(tmp_filename, 'r')
-        nc_out = Dataset(out_filename, 'w')
+    def _write_thredds_band(self, nc_out, band_name, parameters, dimensions, grid_mapping_name,
+                            mask=None, mask_name=None, rm_metadata=None, time_index=0):
+        """Stream band into a netCDF variable by blocks of rows (with scaling and masking)
 
-        grid_mapping_name, grid_mapping_var_name = self._create_dimensions(nc_inp, nc_out, time)
+        If the variable exists, its type, scale, offset and _FillValue are used.
 
-        # recreate file
-        for inp_var_key in nc_inp.variables.keys():
-            inp_var = nc_inp.variables[inp_var_key]
-            if 'name' in inp_var.ncattrs():
-                inp_var_name = inp_var.getncattr('name')
-            else:
-                inp_var_name = inp_var.name
-            # create projection var
-            if inp_var_name == grid_mapping_var_name:
-                out_var = Exporter._copy_nc_var(inp_var, nc_out, grid_mapping_name,
-                                                inp_var.dtype.str, inp_var.dimensions)
-                continue
-
-            # create simple x/y variables
-            if inp_var_name in ['x', 'y', 'lon', 'lat']:
-                out_var = Exporter._copy_nc_var(inp_var, nc_out, inp_var_name,
-                                                '>f4', inp_var.dimensions)
-            # create data var
-            elif inp_var_name in band_metadata:
+        Parameters
+        ----------
+        nc_out : netCDF4.Dataset
+            opened output file
+        band_name : str
+            name of the band
+        parameters : dict
+            type, scale, offset, _FillValue and attributes of the variable (see export2thredds)
+        dimensions : tuple
+            dimensions of the variable
+        grid_mapping_name : str
+            name of the grid mapping variable
+        mask : gdal.Band
+            mask band. Non-masked value is 64.
+        mask_name : str
+            name of the mask band
+        rm_metadata : list
+            unwanted metadata names which will be removed
+        time_index : int
+            index of the time slice
+
+        """
+        x_size = self.vrt.dataset.RasterXSize
+        y_size = self.vrt.dataset.RasterYSize
+        rows = max(1, self.THREDDS_BLOCK_SIZE // x_size)
+        scale = float(parameters.get('scale', 1.0))
+        offset = float(parameters.get('offset', 0.0))
+        if rm_metadata is None:
+            rm_metadata = []
+
+        out_var = None
+        if band_name in nc_out.variables:
+            out_var = nc_out.variables[band_name]
+            out_var.set_auto_maskandscale(False)
+            var_type = out_var.dtype
+            attributes = dict([(key, out_var.getncattr(key)) for key in out_var.ncattrs()])
+            scale = float(attributes.get('scale_factor', 1.0))
+            offset = float(attributes.get('add_offset', 0.0))
+            fill_value = attributes.get('_FillValue', None)
+
+        for y_off in range(0, y_size, rows):
+            n_rows = min(rows, y_size - y_off)
+            data = self._get_band_data(band_name, y_off, n_rows)
+
+            # create variable when data type of the band is known
+            if out_var is None:
+                var_type = parameters.get('type', data.dtype.str.replace('u', 'i'))
                 fill_value = None
-                if '_FillValue' in inp_var.ncattrs():
-                    fill_value = inp_var._FillValue
-                if '_FillValue' in band_metadata[inp_var_name]:
-                    fill_value = band_metadata['_FillValue']
-                dimensions = ('time', ) + inp_var.dimensions
-                out_var = Exporter._copy_nc_var(inp_var, nc_out, inp_var_name,
-                                                band_metadata[inp_var_name]['type'],
-                                                dimensions, fill_value=fill_value)
-
-            # copy array from input data
-            data = inp_var[:]
-
-            # copy rounded data from x/y
-            if inp_var_name in ['x', 'y']:
-                out_var[:] = np.floor(data).astype('>f4')
-                # add axis=X or axis=Y
-                out_var.axis = {'x': 'X', 'y': 'Y'}[inp_var_name]
-
-            # copy data from lon/lat
-            if inp_var_name in ['lon', 'lat']:
-                out_var[:] = data.astype('>f4')
-
-            # copy data from variables in the list
-            if inp_var_name in band_metadata:
-                # add offset and scale attributes
-                scale = band_metadata[inp_var_name]['scale']
-                offset = band_metadata[inp_var_name]['offset']
+                if '_FillValue' in parameters:
+                    fill_value = np.array([parameters['_FillValue']], dtype=var_type)[0]
+                out_var = nc_out.createVariable(band_name, var_type, dimensions,
+                                                fill_value=fill_value)
+                band_metadata = self.get_metadata(band_id=band_name)
+                for key in band_metadata:
+                    if (key not in Exporter.UNWANTED_METADATA and key not in rm_metadata and
+                            not key.startswith('NETCDF_') and
+                            not key.startswith(VRT.STATISTICS_METADATA_PREFIX)):
+                        out_var.setncattr(str(key), band_metadata[key])
                 if not (offset == 0.0 and scale == 1.0):
                     out_var.setncattr('add_offset', offset)
                     out_var.setncattr('scale_factor', scale)
-                    data = (data - offset) / scale
+                # add custom attributes from input parameter bands
+                for key in parameters:
+                    if key not in Exporter.UNWANTED_METADATA:
+                        out_var.setncattr(key, parameters[key])
+                if grid_mapping_name is not None:
+                    out_var.setncattr('grid_mapping', grid_mapping_name)
+                # data is scaled here
+                out_var.set_auto_maskandscale(False)
 
-                out_var[:] = data.astype(band_metadata[inp_var_name]['type'])
+            # mask values with np.nan
+            if (mask is not None and band_name != mask_name and
+                    data.dtype.char in np.typecodes['AllFloat']):
+                data[mask.ReadAsArray(0, y_off, x_size, n_rows) != 64] = np.nan
+            if not (offset == 0.0 and scale == 1.0):
+                data = (data - offset) / scale
+            if fill_value is not None:
+                data[np.isnan(data)] = fill_value
+
+            # write rows bottom-up
+            out_var[time_index, y_size - y_off - n_rows:y_size - y_off] = \
+                data[::-1].astype(var_type)
 
-                # add custom attributes from input parameter bands
-                if inp_var_name in bands:
-                    for newAttr in bands[inp_var_name]:
-                        if newAttr not in Exporter.UNWANTED_METADATA:
-                            out_var.setncattr(newAttr, bands[inp_var_name][newAttr])
-                    # add grid_mapping info
-                    if grid_mapping_name is not None:
-                        out_var.setncattr('grid_mapping', grid_mapping_name)
+    @staticmethod
+    def _get_profile_options(profile, options):
+        """Get driver and creation options of export profile updated with <options>
 
-        # copy (some) global attributes
-        for globAttr in nc_inp.ncattrs():
-            if not(globAttr.strip().startswith('GDAL')):
-                nc_out.setncattr(globAttr, nc_inp.getncattr(globAttr))
+        Parameters
+        ----------
+        profile : str
+            name of the profile (key of Exporter.EXPORT_PROFILES)
+        options : list
+            GDAL creation options ['OPT1=VAL1', ...] which override options of the profile
 
-        # add common and custom global attributes
-        nc_out.setncatts(global_metadata)
+        Returns
+        -------
+        driver : str
+            name of GDAL driver
+        options : list
+            GDAL creation options
+
+        """
+        if profile not in Exporter.EXPORT_PROFILES:
+            raise ValueError('Unknown export profile %s. Use one of %s'
+                             % (profile, sorted(Exporter.EXPORT_PROFILES)))
+        driver, profile_options = Exporter.EXPORT_PROFILES[profile]
+        option_names = [option.split('=')[0].upper() for option in options]
+        options = [option for option in profile_options
+                   if option.split('=')[0].upper() not in option_names] + options
+        return driver, options
 
-        # write output file
-        nc_out.close()
+    @staticmethod
+    def _set_gtiff_compression_options(export_vrt, options, processes=1):
+        """Add predictor for compressed GeoTIFF and number of compression threads
+
+        Horizontal differencing (PREDICTOR=2) is used for integer data and floating point
+        prediction (PREDICTOR=3) for floating point data, if predictor is not set in <options>.
+
+        """
+        option_names = [option.split('=')[0].upper() for option in options]
+        if 'COMPRESS' not in option_names or export_vrt.dataset.RasterCount == 0:
+            return options
+        options = list(options)
+        if 'PREDICTOR' not in option_names:
+            data_type = export_vrt.dataset.GetRasterBand(1).DataType
+            if data_type in [gdal.GDT_Float32, gdal.GDT_Float64]:
+                options.append('PREDICTOR=3')
+            elif data_type in [gdal.GDT_Byte, gdal.GDT_UInt16, gdal.GDT_Int16,
+                               gdal.GDT_UInt32, gdal.GDT_Int32]:
+                options.append('PREDICTOR=2')
+        if processes > 1 and 'NUM_THREADS' not in option_names:
+            options.append('NUM_THREADS=%d' % processes)
+        return options
 
-        # close original files
-        nc_inp.close()
+    @staticmethod
+    def _get_overview_levels(x_size, y_size, tile_size=COG_TILE_SIZE):
+        """Get decimation factors of overviews (2, 4, 8, ...) until overview fits into a tile"""
+        levels = []
+        factor = 2
+        while max(x_size, y_size) > tile_size * factor // 2:
+            levels.append(factor)
+            factor *= 2
+        return levels
 
-        # Delete the temprary netCDF file
-        os.remove(tmp_filename)
+    @staticmethod
+    def _export_cog(dataset, filename, options, resampling='AVERAGE'):
+        """Export dataset into cloud optimised GeoTIFF
 
-        return 0
+        The dataset is first copied into a temporary tiled GeoTIFF, overviews are added to it
+        with GDAL (which reads the full resolution data once) and then the temporary file is
+        copied with COPY_SRC_OVERVIEWS=YES, so that all IFDs are written at the beginning of
+        the file followed by overviews and full resolution tiles. GCPs are copied.
+
+        Parameters
+        ----------
+        dataset : gdal.Dataset
+            dataset to export
+        filename : str
+            output file name
+        options : list
+            GDAL creation options of the GTiff driver (e.g. ['COMPRESS=DEFLATE'])
+        resampling : str
+            resampling of overviews ('AVERAGE', 'MODE', 'NEAREST', ...)
+
+        """
+        tile_options = ['TILED=YES', 'BLOCKXSIZE=%d' % Exporter.COG_TILE_SIZE,
+                        'BLOCKYSIZE=%d' % Exporter.COG_TILE_SIZE]
+        options = [option for option in options
+                   if option.split('=')[0].upper() not in ['TILED', 'BLOCKXSIZE', 'BLOCKYSIZE',
+                                                           'COPY_SRC_OVERVIEWS']]
+        driver = gdal.GetDriverByName(str('GTiff'))
+        fid, tmp_filename = tempfile.mkstemp(suffix='.tif',
+                                             dir=os.path.dirname(os.path.abspath(filename)))
+        os.close(fid)
+        try:
+            tmp_dataset = driver.CreateCopy(tmp_filename, dataset, options=tile_options)
+            levels = Exporter._get_overview_levels(dataset.RasterXSize, dataset.RasterYSize)
+            if levels:
+                tmp_dataset.BuildOverviews(str(resampling), levels)
+            tmp_dataset.FlushCache()
+            out_dataset = driver.CreateCopy(filename, tmp_dataset,
+                                            options=options + tile_options +
+                                            ['COPY_SRC_OVERVIEWS=YES'])
+            del out_dataset
+            del tmp_dataset
+        finally:
+            os.remove(tmp_filename)
 
     @staticmethod
     def _set_global_metadata(created, data, metadata):
@@ -436,31 +867,26 @@ class Exporter(object):
 
     @staticmethod
     def _add_gcps(filename, gcps, bottomup):
-        """Add 4 variables with gcps to the generated netCDF file"""
-        gcp_variables = ['GCPX', 'GCPY', 'GCPZ', 'GCPPixel', 'GCPLine', ]
-
+        """Add 2D variable with GCPs (one row per GCP) to the generated netCDF file"""
         # check if file exists
         if not os.path.exists(filename):
             warnings.warn('Cannot add GCPs! File %s doesn''t exist!' % filename)
 
-        # open output file for adding GCPs
-        ncFile = Dataset(filename, 'a')
-
         # get GCP values into single array from GCPs
-        gcp_values = np.zeros((5, len(gcps)))
-        for i, gcp in enumerate(gcps):
-            gcp_values[0, i] = gcp.GCPX
-            gcp_values[1, i] = gcp.GCPY
-            gcp_values[2, i] = gcp.GCPZ
-            gcp_values[3, i] = gcp.GCPPixel
-            gcp_values[4, i] = gcp.GCPLine
+        gcp_array = gcps_to_array(gcps)
 
+        # open output file for adding GCPs
+        ncFile = Dataset(filename, 'a')
         # make gcps dimensions
         ncFile.createDimension('gcps', len(gcps))
-        # make gcps variables and add data
-        for i, var in enumerate(gcp_variables):
-            var = ncFile.createVariable(var, 'f4', ('gcps',))
-            var[:] = gcp_values[i]
+        ncFile.createDimension('gcp_coordinates', len(GCP_DTYPE.names))
+        # make gcps variable and add data
+        var = ncFile.createVariable(Exporter.GCP_VARIABLE, 'f4', ('gcps', 'gcp_coordinates'))
+        var.long_name = 'ground control points'
+        var.gcp_coordinates = ' '.join(GCP_DTYPE.names)
+        var.comment = ('GCPX, GCPY, GCPZ: coordinates in GCP projection, '
+                       'GCPPixel, GCPLine: pixel and line coordinates in the image')
+        var[:] = gcp_array.view(np.float64).reshape(len(gcps), len(GCP_DTYPE.names))
 
         # write data, close file
         ncFile.close()
@@ -78,6 +78,8 @@ class Figure(object):
     transparency = None
 
     LEGEND_HEIGHT = 0.1
+    # number of pixels in a block of rows of a float band converted to palette indices at once
+    CONVERT_BLOCK_SIZE = 1024 * 1024
     CBAR_HEIGHTMIN = 5
     CBAR_HEIGHT = 0.15
     CBAR_WIDTH = 0.8
@@ -102,13 +104,16 @@ class Figure(object):
 
     # instance attributes
     array = None
-    def __init__(self, nparray, **kwargs):
+    image_array = None
+    def __init__(self, nparray, copy=True, **kwargs):
         ''' Set attributes
 
         Parameters
         -----------
         array : numpy array (2D or 3D)
             dataset from Nansat
+        copy : bool
+            True, copy the array. If False, the array is modified by process()
 
         cmin : number (int ot float) or [number, number, number]
             0, minimum value of varibale in the matrix to be shown
@@ -224,7 +229,10 @@ class Figure(object):
         '''
         # make a copy of nparray (otherwise a new reference to the same data is
         # created and the original input data is destroyed at process())
-        array = np.array(nparray)
+        if copy:
+            array = np.array(nparray)
+        else:
+            array = np.asarray(nparray)
 
         self.logger = add_logger('Nansat')
 
@@ -672,6 +680,89 @@ class Figure(object):
 
         self.array = self.array.astype(np.uint8)
 
+    def convert_to_image_array(self, **kwargs):
+        '''Clip, apply logarithm and convert self.array to palette indices in one pass per band
+
+        Result is written into a preallocated uint8 array (self.image_array) which also
+        has rows for the legend (if self.legend is True). Values of integer bands (up to 16
+        bits) are converted with a look-up table computed for all values of the type, float
+        bands are converted in place by blocks of rows (float64 blocks are cast to float32 as
+        in convert_palettesize()). Result is the same as of clip(), apply_logarithm() and
+        convert_palettesize().
+
+        Parameters
+        -----------
+        Any of Figure.__init__() parameters
+
+        Modifies
+        ---------
+        self.image_array : numpy array (uint8)
+        self.array : numpy array (uint8), view of self.image_array without the legend rows
+
+        '''
+        # modify default values
+        self._set_defaults(kwargs)
+
+        legend_height = 0
+        if self.legend:
+            legend_height = int(self.height * self.LEGEND_HEIGHT)
+        self.image_array = np.empty((self.array.shape[0], self.height + legend_height,
+                                     self.width), 'uint8')
+        self.image_array[:, self.height:, :] = 255
+
+        for iBand in range(self.array.shape[0]):
+            band = self.array[iBand, :, :]
+            out = self.image_array[iBand, :self.height, :]
+            if band.dtype.kind in 'iu' and band.dtype.itemsize <= 2:
+                # look-up table for all values of the type (indexed by unsigned view of values)
+                uint_type = 'uint%d' % (8 * band.dtype.itemsize)
+                values = np.arange(2 ** (8 * band.dtype.itemsize)).astype(uint_type)
+                lut = self._get_palette_indices(values.view(band.dtype), iBand)
+                np.take(lut, band.view(uint_type), out=out, mode='clip')
+            elif band.dtype.kind == 'f':
+                self._get_palette_indices_inplace(band, iBand, out)
+            else:
+                out[:] = self._get_palette_indices(band, iBand)
+
+        self.array = self.image_array[:, :self.height, :]
+
+    def _get_palette_indices(self, array, iBand):
+        '''Convert a copy of array to palette indices as clip(), apply_logarithm() and
+        convert_palettesize() do (with casting to the type of the array after each step)'''
+        array = np.array(array)
+        # if clipping integer matrix, make clipping ranges valid
+        if array.dtype in ['int8', 'uint8', 'int16', 'uint16']:
+            self.cmin[iBand] = np.ceil(self.cmin[iBand])
+        cmin, cmax = self.cmin[iBand], self.cmax[iBand]
+        array[:] = np.clip(array, min(cmin, cmax), max(cmin, cmax))
+        if self.logarithm:
+            array[:] = (np.power((array - cmin) / (cmax - cmin), (1.0 / self.gamma)) *
+                        (cmax - cmin) + cmin)
+        array[:] = (array.astype('float32') - cmin) * (self.numOfColor - 1) / (cmax - cmin)
+        return array.astype(np.uint8)
+
+    def _get_palette_indices_inplace(self, array, iBand, out):
+        '''Convert float array to palette indices as clip(), apply_logarithm() and
+        convert_palettesize() do. Array is modified in place by blocks of rows, each block is
+        converted to palette indices in float32 (as in convert_palettesize()) and written
+        into <out>.'''
+        cmin, cmax = self.cmin[iBand], self.cmax[iBand]
+        block_rows = max(1, self.CONVERT_BLOCK_SIZE // array.shape[1])
+        for row in range(0, array.shape[0], block_rows):
+            block = array[row:row + block_rows]
+            np.clip(block, min(cmin, cmax), max(cmin, cmax), out=block)
+            if self.logarithm:
+                block -= cmin
+                block /= (cmax - cmin)
+                np.power(block, (1.0 / self.gamma), out=block)
+                block *= (cmax - cmin)
+                block += cmin
+            work = block.astype('float32', copy=False)
+            work -= cmin
+            work *= (self.numOfColor - 1)
+            work /= (cmax - cmin)
+            out[row:row + block_rows] = work
+
     def create_legend(self, **kwargs):
         ''' self.legend is replaced from None to PIL image
 
@@ -791,7 +882,12 @@ class Figure(object):
         self._set_defaults(kwargs)
 
         # if legend is created, expand array with empty space below the data
-        if self.pilImgLegend is not None:
+        # (use rows preallocated in convert_to_image_array() if possible)
+        if (self.pilImgLegend is not None and self.image_array is not None and
+                self.array.base is self.image_array and
+                self.image_array.shape[1] == self.height + self.pilImgLegend.size[1]):
+            self.array = self.image_array
+        elif self.pilImgLegend is not None:
             appendArray = 255 * np.ones((self.array.shape[0],
                                          self.pilImgLegend.size[1],
                                          self.width), 'uint8')
@@ -815,9 +911,8 @@ class Figure(object):
         '''Do all common operations for preparation of a figure for saving
 
         #. Modify default values of parameters by the provided ones (if any)
-        #. Clip to min/max
-        #. Apply logarithm if required
-        #. Convert data to uint8
+        #. Clip to min/max, apply logarithm if required and convert data to uint8
+           (in one pass per band, see convert_to_image_array)
         #. Create palette
         #. Apply mask for colouring land, clouds, etc if required
         #. Create legend if required
@@ -848,15 +943,8 @@ class Figure(object):
         # we replace them with mask before creating PIL Image
         self.reprojMask = self.array[0, :, :] == 0
 
-        # clip values to min/max
-        self.clip()
-
-        # apply logarithm
-        if self.logarithm:
-            self.apply_logarithm()
-
-        # convert to uint8
-        self.convert_palettesize()
+        # clip values to min/max, apply logarithm and convert to uint8
+        self.convert_to_image_array()
 
         # create the paletter
         self._create_palette()
@@ -892,23 +980,12 @@ class Figure(object):
             Adds transparency to PIL image
 
         '''
-        self.pilImg = self.pilImg.convert('RGBA')
-        datas = self.pilImg.getdata()
-        newData = list()
-
-        for item in datas:
-            if (item[0] == self.transparency[0] and
-                    item[1] == self.transparency[1] and
-                    item[2] == self.transparency[2]):
-                newData.append((255, 255, 255, 0))
-            else:
-                newData.append(item)
-
-        self.pilImg.putdata(newData)
+        img = np.array(self.pilImg.convert('RGBA'))
+        transparent = np.all(img[:, :, :3] == np.array(self.transparency[:3]), axis=2)
+        img[transparent] = (255, 255, 255, 0)
 
         # The alphaMask is set in process() before clip() the Image
-        img = np.array(self.pilImg)
-        img[:, :, 3][self.reprojMask] = 0
+        img[:self.reprojMask.shape[0], :, 3][self.reprojMask] = 0
         self.pilImg = Image.fromarray(np.uint8(img))
 
     def save(self, fileName, **kwargs):
@@ -0,0 +1,303 @@
+# Name:         aapp.py
+# Purpose:      Reader of AAPP AVHRR level 1b and level 1c files shared by AAPP mappers
+# Authors:      Knut-Frode Dagestad
+# Licence:      This file is part of NANSAT. You can redistribute it or modify
+#               under the terms of GNU General Public License, v.3
+#               http://www.gnu.org/licenses/gpl-3.0.html
+
+# Description of file format:
+# http://research.metoffice.gov.uk/research/interproj/nwpsaf/aapp/NWPSAF-MF-UD-003_Formats.pdf
+#
+# AAPP files consist of one header record followed by one record per scanline. All records of a
+# file have the same length and all values are stored little-endian. The records are described
+# by NumPy structured dtypes below and read with np.memmap: fields of all scanlines (e.g.
+# geolocation or calibration coefficients) are therefore available as arrays without reading
+# the full file into memory.
+from __future__ import absolute_import, division
+
+import os
+import datetime
+
+import numpy as np
+
+from nansat.exceptions import WrongMapperError
+
+SATELLITE_IDS = {4: 'NOAA-15', 2: 'NOAA-16', 6: 'NOAA-17', 7: 'NOAA-18', 8: 'NOAA-19',
+                 11: 'Metop-B (Metop-1)', 12: 'Metop-A (Metop-2)',
+                 13: 'Metop-C (Metop-3)'}
+DATA_FORMATS = {1: 'LAC', 2: 'GAC', 3: 'HRPT'}
+
+# number of pixels per scanline and number of tie points of geolocation and angles
+AVHRR_PIXELS = 2048
+AVHRR_CHANNELS = 5
+TIE_POINTS = 51
+TIE_POINT_OFFSET = 25
+TIE_POINT_STEP = 40
+
+L1B_RECORD_LENGTH = 22016
+L1C_RECORD_LENGTH = 29808
+
+
+def _record_dtype(fields, itemsize):
+    """Create structured dtype from list of (name, format, offset)"""
+    return np.dtype({'names': [field[0] for field in fields],
+                     'formats': [field[1] for field in fields],
+                     'offsets': [field[2] for field in fields],
+                     'itemsize': itemsize})
+
+# header record of AVHRR level 1b
+L1B_HEADER_DTYPE = _record_dtype([
+    ('avh_h_satid', '<u2', 72),
+    ('avh_h_dataformat', '<u2', 76),
+    ('avh_h_startdatyr', '<u2', 84),
+    ('avh_h_startdatdy', '<u2', 86),
+    ('avh_h_startdattime', '<i4', 88),
+    ('avh_h_scnlin', '<u2', 128),
+    ('avh_h_calscnlin', '<u2', 130),
+    ('avh_h_misscnlin', '<u2', 132),
+    ('avh_h_irttcoef', ('<u2', (24,)), 202),
+    ('avh_h_albcnv', ('<i4', (6,)), 250),
+    ('avh_h_radtempcnv', ('<i4', (3, 3)), 280),
+], L1B_RECORD_LENGTH)
+
+# scanline record of AVHRR level 1b
+L1B_SCANLINE_DTYPE = _record_dtype([
+    ('avh_scnlin', '<u2', 0),
+    ('avh_scnlinyr', '<u2', 2),
+    ('avh_scnlindy', '<u2', 4),
+    ('avh_scnlintime', '<i4', 8),
+    ('avh_scnlinbit', '<u2', 12),
+    ('avh_qualind', '<u4', 24),
+    ('avh_scnlinqual', '<u4', 28),
+    ('avh_calqual', ('<u2', (3,)), 32),
+    # channel, set, coefficient (slope1, intercept1, slope2, intercept2, intersection)
+    ('avh_calvis', ('<i4', (3, 3, 5)), 48),
+    # channel, set, coefficient (stored "backwards": a2, a1, a0)
+    ('avh_calir', ('<i4', (3, 2, 3)), 228),
+    # power of 10 of the IR calibration coefficients
+    ('avh_filler2', ('<i4', (3,)), 300),
+    # solar zenith, satellite zenith and relative azimuth angles at tie points
+    ('avh_ang', ('<i2', (TIE_POINTS, 3)), 328),
+    # latitude and longitude at tie points
+    ('avh_pos', ('<i4', (TIE_POINTS, 2)), 640),
+    ('avh_pixels', ('<u2', (AVHRR_PIXELS, AVHRR_CHANNELS)), 1264),
+], L1B_RECORD_LENGTH)
+
+# header record of AVHRR level 1c
+L1C_HEADER_DTYPE = _record_dtype([
+    ('avh_h_satid', '<i4', 24),
+    ('avh_h_startdatyr', '<i4', 44),
+    ('avh_h_startdatdy', '<i4', 48),
+    ('avh_h_startdattime', '<i4', 52),
+    ('avh_h_scnlin', '<i4', 72),
+    ('avh_h_misscnlin', '<i4', 76),
+    ('avh_h_calscnlin', '<i4', 80),
+    ('avh_h_dataformat', '<i4', 88),
+], L1C_RECORD_LENGTH)
+
+# scanline record of AVHRR level 1c
+L1C_SCANLINE_DTYPE = _record_dtype([
+    ('avh_scnlinbit', '<u4', 20),
+    ('avh_pos', ('<i4', (TIE_POINTS, 2)), 676),
+    ('avh_pixels', ('<u2', (AVHRR_PIXELS, AVHRR_CHANNELS)), 1092),
+], L1C_RECORD_LENGTH)
+
+# scaling of the fields
+POSITION_SCALE = 1e-4
+ANGLE_SCALE = 1e-2
+VIS_CALIBRATION_SCALE = np.array([1e-7, 1e-6, 1e-7, 1e-6, 1.])
+RADTEMPCNV_SCALE = np.array([[1e2, 1e5, 1e6],
+                             [1e3, 1e5, 1e6],
+                             [1e3, 1e5, 1e6]])
+
+
+class AAPPFile(object):
+    """Header and scanline records of an AAPP file mapped into memory
+
+    Parameters
+    ----------
+    filename : str
+        name of the input file
+    header_dtype : numpy.dtype
+        structured dtype of the header record (e.g. L1B_HEADER_DTYPE)
+    scanline_dtype : numpy.dtype
+        structured dtype of the scanline records (e.g. L1B_SCANLINE_DTYPE)
+
+    Raises
+    ------
+    WrongMapperError : if the file cannot be mapped with the given dtypes
+
+    Notes
+    -----
+    Only the calibrated scanlines (as given in the header) which are present in the file are
+    mapped.
+
+    """
+    def __init__(self, filename, header_dtype, scanline_dtype):
+        self.filename = filename
+        self.header_dtype = header_dtype
+        self.scanline_dtype = scanline_dtype
+        try:
+            file_size = os.path.getsize(filename)
+            self.header = np.memmap(filename, dtype=header_dtype, mode='r', shape=(1,))[0]
+        except (IOError, OSError, ValueError):
+            raise WrongMapperError
+
+        num_scanlines = min(int(self.header['avh_h_calscnlin']),
+                            (file_size - header_dtype.itemsize) // scanline_dtype.itemsize)
+        if num_scanlines <= 0:
+            raise WrongMapperError
+        self.scanlines = np.memmap(filename, dtype=scanline_dtype, mode='r',
+                                   offset=header_dtype.itemsize, shape=(num_scanlines,))
+
+    @property
+    def num_scanlines(self):
+        """Number of mapped scanlines"""
+        return self.scanlines.shape[0]
+
+    def get_field_offset(self, field):
+        """Get offset of the first value of <field> of the first scanline in the file"""
+        return self.header_dtype.itemsize + self.scanline_dtype.fields[field][1]
+
+    def get_time(self):
+        """Get start time from the header as datetime.datetime"""
+        return (datetime.datetime(int(self.header['avh_h_startdatyr']), 1, 1) +
+                datetime.timedelta(int(self.header['avh_h_startdatdy']) - 1,
+                                   milliseconds=int(self.header['avh_h_startdattime'])))
+
+    def get_lonlat(self):
+        """Get longitude and latitude [degrees] of all scanlines at tie points
+
+        Returns
+        -------
+        lon, lat : numpy.ndarray
+            2D arrays (scanlines x TIE_POINTS)
+
+        """
+        pos = self.scanlines['avh_pos'] * POSITION_SCALE
+        return pos[:, :, 1], pos[:, :, 0]
+
+    def get_angles(self):
+        """Get solar zenith, satellite zenith and relative azimuth angles [degrees] at tie points
+
+        Returns
+        -------
+        solar_zenith, satellite_zenith, relative_azimuth : numpy.ndarray
+            2D arrays (scanlines x TIE_POINTS)
+
+        """
+        angles = self.scanlines['avh_ang'] * ANGLE_SCALE
+        return angles[:, :, 0], angles[:, :, 1], angles[:, :, 2]
+
+    def get_scanline_bits(self):
+        """Get scanline bit field (flags) of all scanlines as 1D array"""
+        return np.array(self.scanlines['avh_scnlinbit'])
+
+    def get_vis_calibration_coefficients(self):
+        """Get calibration coefficients of visible channels (1, 2, 3A) of all scanlines
+
+        Returns
+        -------
+        coefficients : numpy.ndarray
+            4D array (scanlines x channel x set x coefficient) with scaled slope1, intercept1,
+            slope2, intercept2 and intersection for each channel and set
+
+        """
+        return self.scanlines['avh_calvis'] * VIS_CALIBRATION_SCALE
+
+    def get_ir_calibration_coefficients(self, set_no=0):
+        """Get coefficients of radiance calibration of IR channels (3B, 4, 5) of all scanlines
+
+        Parameters
+        ----------
+        set_no : int
+            number of the coefficient set. Operational set (0) by default.
+
+        Returns
+        -------
+        coefficients : numpy.ndarray
+            3D array (scanlines x channel x coefficient) with coefficients a0, a1, a2 of
+            radiance = a0 + a1 * counts + a2 * counts**2
+
+        """
+        calir = self.scanlines['avh_calir'][:, :, set_no, :]
+        exponents = self.scanlines['avh_filler2'][:, None, :]
+        # NB: coefficients are stored "backwards"
+        return (calir / np.power(10., exponents))[:, :, ::-1]
+
+    def get_ir_temperature_conversion(self):
+        """Get central wavenumber, and band correction coefficients of IR channels from header
+
+        Returns
+        -------
+        wavenumber, c1, c2 : numpy.ndarray
+            1D arrays with values for channels 3B, 4, 5. Brightness temperature is computed from
+            the Planck temperature as (T* - c1) / c2.
+
+        """
+        radtempcnv = self.header['avh_h_radtempcnv'] / RADTEMPCNV_SCALE
+        return radtempcnv[:, 0], radtempcnv[:, 1], radtempcnv[:, 2]
+
+    def calibrate_ir(self, counts, channel, set_no=0):
+        """Convert counts of IR channel to brightness temperature
+
+        Parameters
+        ----------
+        counts : numpy.ndarray
+            2D array (scanlines x pixels) with counts of the channel
+        channel : int
+            index of the IR channel (0 - 3B, 1 - 4, 2 - 5)
+        set_no : int
+            number of the coefficient set
+
+        Returns
+        -------
+        brightness_temperature : numpy.ndarray
+            2D array with brightness temperature [K]
+
+        """
+        counts = np.asarray(counts, dtype=np.float64)
+        coefs = self.get_ir_calibration_coefficients(set_no)[:counts.shape[0], channel, :]
+        radiance = (coefs[:, 0:1] + coefs[:, 1:2] * counts + coefs[:, 2:3] * counts * counts)
+        wavenumber, c1, c2 = self.get_ir_temperature_conversion()
+        wavenumber = wavenumber[channel]
+        # constants of the Planck function [mW/(m2.sr.cm-4)] and [cm.K]
+        planck_c1 = 1.1910427e-5
+        planck_c2 = 1.4387752
+        with np.errstate(divide='ignore', invalid='ignore'):
+            te_star = (planck_c2 * wavenumber /
+                       np.log(1 + planck_c1 * wavenumber ** 3 / radiance))
+        return (te_star - c1[channel]) / c2[channel]
+
+
+def read_l1b(filename):
+    """Map AAPP AVHRR level 1b file into memory
+
+    Raises
+    ------
+    WrongMapperError : if the file is not AVHRR level 1b
+
+    """
+    aapp_file = AAPPFile(filename, L1B_HEADER_DTYPE, L1B_SCANLINE_DTYPE)
+    if (int(aapp_file.header['avh_h_satid']) not in SATELLITE_IDS or
+            int(aapp_file.header['avh_h_dataformat']) not in DATA_FORMATS):
+        raise WrongMapperError
+    return aapp_file
+
+
+def read_l1c(filename):
+    """Map AAPP AVHRR level 1c file into memory
+
+    Raises
+    ------
+    WrongMapperError : if the file is not AVHRR level 1c
+
+    """
+    aapp_file = AAPPFile(filename, L1C_HEADER_DTYPE, L1C_SCANLINE_DTYPE)
+    if int(aapp_file.header['avh_h_dataformat']) not in DATA_FORMATS:
+        raise WrongMapperError
+    try:
+        aapp_file.get_time()
+    except (ValueError, OverflowError):
+        raise WrongMapperError
+    return aapp_file
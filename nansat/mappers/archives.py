@@ -0,0 +1,298 @@
+# Name:         archives.py
+# Purpose:      Index of members of zip and tar archives for mappers
+# Licence:      This file is part of NANSAT. You can redistribute it or modify
+#               under the terms of GNU General Public License, v.3
+#               http://www.gnu.org/licenses/gpl-3.0.html
+#
+# An archive is scanned once: names, offsets and sizes of its members are kept in memory
+# (for the MAX_ARCHIVE_INDICES most recently used archives) and in NANSAT_CACHE_DIR, if set,
+# and members are exposed as GDAL VSI paths. Members of
+# tar archives are given as /vsisubfile/ paths with the offset of their data, so GDAL reads
+# them directly, without scanning the tar again for each member.
+from __future__ import absolute_import
+
+import os
+import gzip
+import atexit
+import json
+import shutil
+import fnmatch
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+from collections import OrderedDict
+
+# maximum number of indices kept in memory
+MAX_ARCHIVE_INDICES = 100
+# indices of opened archives {(path, size, mtime, extract): ArchiveIndex}, least recently
+# used first
+_ARCHIVE_INDICES = OrderedDict()
+# tar files extracted into the temporary directory {(path, size, mtime, True): filename},
+# removed at exit
+_SCRATCH_FILES = {}
+
+
+class ArchiveIndex(object):
+    """Names, offsets and sizes of members of a zip or tar archive
+
+    Parameters
+    ----------
+    filename : str
+        name of zip, tar, tar.gz or tgz file
+    extract : bool
+        decompress a gzipped tar once into a seekable scratch file and read members from it.
+        The scratch file is kept in NANSAT_CACHE_DIR or, if it is not set, written into the
+        temporary directory and removed at exit. Otherwise members of a gzipped tar are read
+        through /vsigzip/.
+
+    Raises
+    ------
+    ValueError
+        if the file is not a zip or tar archive
+
+    """
+    def __init__(self, filename, extract=False):
+        self.filename = filename
+        # file from which members are read (a scratch file for extracted tar.gz)
+        self.data_filename = filename
+        # {name: (offset, size)}; offset is None for compressed zip members
+        self.members = OrderedDict()
+        if zipfile.is_zipfile(filename):
+            self.kind = 'zip'
+            self._scan_zip()
+        elif os.path.isfile(filename) and tarfile.is_tarfile(filename):
+            self.kind = 'tar'
+            self.gzipped = _is_gzipped(filename)
+            if self.gzipped and extract:
+                self.data_filename = _extract_gzip(filename)
+                self.gzipped = False
+            self._scan_tar()
+        else:
+            raise ValueError('%s is not a zip or tar archive' % filename)
+
+    def _scan_zip(self):
+        """Read central directory of the zip file"""
+        with zipfile.ZipFile(self.filename) as zz:
+            for info in zz.infolist():
+                self.members[info.filename] = (None, info.file_size)
+
+    def _scan_tar(self):
+        """Read headers of all members in the tar file (decompresses gzipped tar once)"""
+        with tarfile.open(self.data_filename) as tar:
+            for info in tar:
+                if info.isfile():
+                    self.members[info.name] = (info.offset_data, info.size)
+
+    def to_dict(self):
+        """Get attributes and members of the index as a dict (for saving in JSON)"""
+        return {'filename': self.filename,
+                'data_filename': self.data_filename,
+                'kind': self.kind,
+                'gzipped': getattr(self, 'gzipped', False),
+                'members': [[name, offset, size]
+                            for name, (offset, size) in self.members.items()]}
+
+    @classmethod
+    def from_dict(cls, index_dict):
+        """Create index from a dict made by ArchiveIndex.to_dict without scanning the archive"""
+        index = cls.__new__(cls)
+        index.filename = index_dict['filename']
+        index.data_filename = index_dict['data_filename']
+        index.kind = index_dict['kind']
+        if index.kind == 'tar':
+            index.gzipped = index_dict['gzipped']
+        index.members = OrderedDict([(name, (offset, size))
+                                     for name, offset, size in index_dict['members']])
+        return index
+
+    def names(self, pattern=None):
+        """Get names of members, optionally only those matching a shell-style pattern"""
+        if pattern is None:
+            return list(self.members)
+        return [name for name in self.members if fnmatch.fnmatch(name, pattern)]
+
+    def vsi_path(self, name):
+        """Get GDAL VSI path of a member
+
+        Parameters
+        ----------
+        name : str
+            name of the member
+
+        Returns
+        -------
+        path : str
+            /vsizip/archive/name for zip files, /vsisubfile/offset_size,archive for tar
+            files (/vsigzip/ is added for gzipped tar)
+
+        """
+        if self.kind == 'zip':
+            return '/vsizip/%s/%s' % (self.filename, name)
+        offset, size = self.members[name]
+        data_filename = self.data_filename
+        if self.gzipped:
+            data_filename = '/vsigzip/' + data_filename
+        return '/vsisubfile/%d_%d,%s' % (offset, size, data_filename)
+
+    def vsi_paths(self, pattern=None):
+        """Get GDAL VSI paths of members matching a shell-style pattern"""
+        return [self.vsi_path(name) for name in self.names(pattern)]
+
+    def read(self, name):
+        """Read content of a member
+
+        Parameters
+        ----------
+        name : str
+            name of the member
+
+        Returns
+        -------
+        content : bytes
+
+        """
+        if self.kind == 'zip':
+            with zipfile.ZipFile(self.filename) as zz:
+                return zz.read(name)
+        offset, size = self.members[name]
+        if self.gzipped:
+            fp = gzip.open(self.data_filename, 'rb')
+        else:
+            fp = open(self.data_filename, 'rb')
+        try:
+            fp.seek(offset)
+            return fp.read(size)
+        finally:
+            fp.close()
+
+
+def _is_gzipped(filename):
+    """Check if file starts with the gzip magic number"""
+    with open(filename, 'rb') as fp:
+        return fp.read(2) == b'\x1f\x8b'
+
+
+def _get_cache_dir():
+    """Get NANSAT_CACHE_DIR or None"""
+    cache_dir = os.getenv('NANSAT_CACHE_DIR')
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        return cache_dir
+    return None
+
+
+def _get_key(filename, extract):
+    """Get key of the archive (path, size, modification time and extraction flag)"""
+    file_stat = os.stat(filename)
+    return (os.path.abspath(filename), file_stat.st_size, file_stat.st_mtime, extract)
+
+
+def _extract_gzip(filename):
+    """Decompress gzipped file into a scratch file (only once) and return its name
+
+    The scratch file is kept in NANSAT_CACHE_DIR. If NANSAT_CACHE_DIR is not set, it is written
+    into the temporary directory and removed at exit (see _remove_scratch_files).
+
+    """
+    key = _get_key(filename, True)
+    cache_dir = _get_cache_dir()
+    if cache_dir is None:
+        scratch_filename = _SCRATCH_FILES.get(key)
+        if scratch_filename is None or not os.path.exists(scratch_filename):
+            fd, scratch_filename = tempfile.mkstemp(suffix='.tar')
+            _decompress_gzip(filename, fd, scratch_filename)
+            _SCRATCH_FILES[key] = scratch_filename
+        return scratch_filename
+
+    scratch_filename = os.path.join(cache_dir, 'archive_%s.tar' %
+                                    hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+    if not os.path.exists(scratch_filename):
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        _decompress_gzip(filename, fd, tmp_filename)
+        os.rename(tmp_filename, scratch_filename)
+    return scratch_filename
+
+
+def _decompress_gzip(filename, fd, out_filename):
+    """Decompress gzipped file into opened output file, remove the output file on failure"""
+    try:
+        with os.fdopen(fd, 'wb') as fp_out:
+            with gzip.open(filename, 'rb') as fp_in:
+                shutil.copyfileobj(fp_in, fp_out, 1024 * 1024)
+    except Exception:
+        os.remove(out_filename)
+        raise
+
+
+def _remove_scratch_files():
+    """Remove tar files extracted into the temporary directory"""
+    for scratch_filename in _SCRATCH_FILES.values():
+        if os.path.exists(scratch_filename):
+            os.remove(scratch_filename)
+    _SCRATCH_FILES.clear()
+
+
+atexit.register(_remove_scratch_files)
+
+
+def get_archive_index(filename, extract=False):
+    """Get index of a zip or tar archive, scan the archive only if it was not scanned before
+
+    Indices of the MAX_ARCHIVE_INDICES most recently used archives are kept in memory and, if
+    the environment variable NANSAT_CACHE_DIR is set, all indices are saved there. An index is valid while size and modification time of the archive are
+    unchanged.
+
+    Parameters
+    ----------
+    filename : str
+        name of zip, tar, tar.gz or tgz file
+    extract : bool
+        decompress a gzipped tar into a seekable scratch file (see ArchiveIndex)
+
+    Returns
+    -------
+    index : ArchiveIndex or None
+        None if the file is not a zip or tar archive
+
+    """
+    if not os.path.isfile(filename):
+        return None
+    key = _get_key(filename, extract)
+    if key in _ARCHIVE_INDICES:
+        # move the index to the end (most recently used)
+        index = _ARCHIVE_INDICES.pop(key)
+        _ARCHIVE_INDICES[key] = index
+        return index
+
+    cache_dir = _get_cache_dir()
+    cache_file = None
+    index = None
+    if cache_dir is not None:
+        cache_file = os.path.join(cache_dir, 'archive_%s.json' %
+                                  hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+    if cache_file is not None and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as fp:
+                index = ArchiveIndex.from_dict(json.load(fp))
+        except (IOError, KeyError, TypeError, ValueError):
+            index = None
+        if index is not None and (index.filename != filename or
+                                  not os.path.exists(index.data_filename)):
+            # index of another file or scratch file was removed
+            index = None
+
+    if index is None:
+        try:
+            index = ArchiveIndex(filename, extract)
+        except (ValueError, tarfile.TarError, zipfile.BadZipfile, IOError, EOFError):
+            return None
+        if cache_file is not None:
+            fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(index.to_dict(), fp)
+            os.rename(tmp_filename, cache_file)
+
+    _ARCHIVE_INDICES[key] = index
+    while len(_ARCHIVE_INDICES) > MAX_ARCHIVE_INDICES:
+        _ARCHIVE_INDICES.popitem(last=False)
+    return index
@@ -0,0 +1,429 @@
+# Name:         downloads.py
+# Purpose:      Cached, concurrent downloading of remote files for online mappers
+# Licence:      This file is part of NANSAT. You can redistribute it or modify
+#               under the terms of GNU General Public License, v.3
+#               http://www.gnu.org/licenses/gpl-3.0.html
+#
+# Downloaded files are stored in a cache directory under names made from the SHA1 of the
+# expected content if it is known. Otherwise the name is made from the SHA1 of the URL, of the
+# selection of GRIB records and of the validator of the remote file (ETag or Last-Modified),
+# so a file which is changed on the server is downloaded again.
+# Each file is written to a temporary file in the cache directory and atomically renamed
+# when complete, and a lock file prevents several processes from downloading the same file
+# simultaneously. SHA1 of the content is stored next to the file and verified on reuse.
+from __future__ import absolute_import, division
+
+import os
+import re
+import time
+import errno
+import hashlib
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import URLError, HTTPError
+except ImportError:
+    from urllib2 import Request, urlopen, URLError, HTTPError
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class FileLock(object):
+    """Lock based on exclusive creation of a lock file
+
+    Parameters
+    ----------
+    filename : str
+        name of the locked file. Lock file is <filename>.lock
+    timeout : float
+        maximum time to wait for the lock [seconds]
+    stale : float
+        age of a lock file after which it is considered stale (left by a killed process) and
+        is removed [seconds]
+    poll : float
+        interval between attempts to acquire the lock [seconds]
+
+    """
+    def __init__(self, filename, timeout=600, stale=3600, poll=0.1):
+        self.lockfile = filename + '.lock'
+        self.timeout = timeout
+        self.stale = stale
+        self.poll = poll
+
+    def acquire(self):
+        """Create the lock file, wait if it exists. Raise IOError after <timeout>"""
+        t0 = time.time()
+        while True:
+            try:
+                fd = os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            else:
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return
+            try:
+                if time.time() - os.path.getmtime(self.lockfile) > self.stale:
+                    os.remove(self.lockfile)
+                    continue
+            except OSError:
+                # lock released meanwhile
+                continue
+            if time.time() - t0 > self.timeout:
+                raise IOError('Cannot acquire lock %s' % self.lockfile)
+            time.sleep(self.poll)
+
+    def release(self):
+        """Remove the lock file"""
+        try:
+            os.remove(self.lockfile)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def get_cache_dir(cache_dir=None):
+    """Get (and create) directory for downloaded files
+
+    Parameters
+    ----------
+    cache_dir : str
+        cache directory. If None, the environment variable NANSAT_CACHE_DIR or
+        ~/.nansat/downloads is used.
+
+    Returns
+    -------
+    cache_dir : str
+
+    """
+    if cache_dir is None:
+        cache_dir = os.getenv('NANSAT_CACHE_DIR',
+                              os.path.join(os.path.expanduser('~'), '.nansat', 'downloads'))
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # created by another process
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
+
+def get_cache_filename(url, cache_dir, pattern=None, validator='', sha1=None):
+    """Get name of the cache file for <url> and GRIB records selected by <pattern>
+
+    The name is the expected SHA1 of the content (if given) or the SHA1 of the URL, the
+    pattern and the validator, plus extension of the URL (needed by some GDAL drivers).
+
+    """
+    ext = os.path.splitext(url.split('?')[0])[1]
+    if sha1 is not None:
+        return os.path.join(cache_dir, sha1 + ext)
+    key = url if pattern is None else url + '#' + pattern
+    if validator:
+        key += '#' + validator
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ext)
+
+
+def get_validator(url, timeout=60, **kwargs):
+    """Get ETag or Last-Modified of URL from HEAD request
+
+    Parameters
+    ----------
+    url : str
+        http(s)://, ftp:// or file:// URL
+    timeout : float
+        timeout of connection [seconds]
+
+    Returns
+    -------
+    validator : str
+        ETag or Last-Modified header or '' if they are not available or the request fails
+
+    """
+    request = Request(url)
+    request.get_method = lambda: 'HEAD'
+    try:
+        response = urlopen(request, timeout=timeout)
+    except (URLError, IOError):
+        return ''
+    try:
+        headers = response.info()
+        return str(headers.get('ETag') or headers.get('Last-Modified') or '')
+    finally:
+        response.close()
+
+
+def get_file_sha1(filename):
+    """Get SHA1 hexdigest of the content of a file"""
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def open_url(url, byte_range=None, retries=3, backoff=1., timeout=60):
+    """Open URL, retry with exponential backoff on failures
+
+    Parameters
+    ----------
+    url : str
+        http(s)://, ftp:// or file:// URL
+    byte_range : tuple
+        (first, last) bytes to request (last is inclusive or None for the end of file)
+    retries : int
+        number of retries after the first failed attempt
+    backoff : float
+        delay before the first retry [seconds]. The delay is doubled for each next retry.
+    timeout : float
+        timeout of connection [seconds]
+
+    Returns
+    -------
+    response : file-like object
+        opened response
+    partial : bool
+        True if the server returned only the requested range (HTTP 206)
+
+    Raises
+    ------
+    IOError
+        if URL cannot be opened. Client errors (HTTP 4xx) are not retried.
+
+    """
+    request = Request(url)
+    if byte_range is not None:
+        request.add_header('Range', 'bytes=%d-%s' % (byte_range[0], '' if byte_range[1] is None
+                                                     else '%d' % byte_range[1]))
+    for attempt in range(retries + 1):
+        try:
+            response = urlopen(request, timeout=timeout)
+        except HTTPError as e:
+            if 400 <= e.code < 500 or attempt == retries:
+                raise IOError('Cannot open %s: %s' % (url, e))
+        except (URLError, IOError) as e:
+            if attempt == retries:
+                raise IOError('Cannot open %s: %s' % (url, e))
+        else:
+            return response, response.getcode() == 206
+        time.sleep(backoff * 2 ** attempt)
+
+
+def read_inventory(url, pattern=None, **kwargs):
+    """Read wgrib inventory and get byte ranges of the GRIB records
+
+    Parameters
+    ----------
+    url : str
+        URL of the inventory (.inv or .idx). Lines of the inventory are
+        'record_number:byte_offset:other:fields', sorted by offset.
+    pattern : str
+        regular expression for selecting records (e.g. ':(U|V)GRD:10 m '). All records are
+        returned if None.
+    **kwargs : dict
+        parameters for open_url
+
+    Returns
+    -------
+    ranges : list of tuples
+        (first, last) bytes of the selected records. Last is None for the last record.
+
+    """
+    response = open_url(url, **kwargs)[0]
+    try:
+        lines = response.read().decode('utf-8', 'replace').splitlines()
+    finally:
+        response.close()
+    records = [(int(line.split(':')[1]), line) for line in lines if line.count(':') > 1]
+    ranges = []
+    for i, (offset, line) in enumerate(records):
+        if pattern is not None and re.search(pattern, line) is None:
+            continue
+        last = records[i + 1][0] - 1 if i + 1 < len(records) else None
+        if ranges and ranges[-1][1] is not None and ranges[-1][1] + 1 == offset:
+            # merge with the previous adjacent record
+            ranges[-1] = (ranges[-1][0], last)
+        else:
+            ranges.append((offset, last))
+    return ranges
+
+
+def _copy_range(url, byte_range, fp, sha1, **kwargs):
+    """Copy bytes from URL into open file, update SHA1"""
+    response, partial = open_url(url, byte_range, **kwargs)
+    try:
+        if byte_range is None or partial:
+            skip, size = 0, None
+        else:
+            # server ignores Range (e.g. ftp:// or file://), skip unnecessary bytes
+            skip = byte_range[0]
+            size = None if byte_range[1] is None else byte_range[1] - byte_range[0] + 1
+        while skip > 0:
+            chunk = response.read(min(skip, CHUNK_SIZE))
+            if not chunk:
+                break
+            skip -= len(chunk)
+        while size is None or size > 0:
+            chunk = response.read(CHUNK_SIZE if size is None else min(size, CHUNK_SIZE))
+            if not chunk:
+                break
+            fp.write(chunk)
+            sha1.update(chunk)
+            if size is not None:
+                size -= len(chunk)
+    finally:
+        response.close()
+
+
+def download(url, cache_dir=None, inventory_url=None, pattern=None, sha1=None, **kwargs):
+    """Download file (or selected GRIB records) into the cache
+
+    Parameters
+    ----------
+    url : str
+        URL of the file
+    cache_dir : str
+        cache directory (see get_cache_dir)
+    inventory_url : str
+        URL of wgrib inventory of the GRIB file. If given, only records matching <pattern>
+        are downloaded using HTTP range requests.
+    pattern : str
+        regular expression for selecting records in the inventory
+    sha1 : str
+        expected SHA1 of the downloaded content. If given, the cache file is named by it and
+        the remote file is not checked for changes.
+    **kwargs : dict
+        parameters for open_url (retries, backoff, timeout)
+
+    Returns
+    -------
+    filename : str
+        name of the downloaded file in the cache
+
+    Raises
+    ------
+    IOError
+        if the file cannot be downloaded, or its checksum is wrong
+
+    """
+    cache_dir = get_cache_dir(cache_dir)
+    validator = ''
+    if sha1 is None:
+        validator = get_validator(url, **kwargs)
+    filename = get_cache_filename(url, cache_dir, None if inventory_url is None else pattern,
+                                  validator, sha1)
+
+    with FileLock(filename):
+        if os.path.exists(filename) and _is_valid(filename, sha1):
+            return filename
+
+        ranges = None
+        if inventory_url is not None:
+            ranges = read_inventory(inventory_url, pattern, **kwargs)
+            if not ranges:
+                raise IOError('No records matching %s in %s' % (pattern, inventory_url))
+
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+        content_sha1 = hashlib.sha1()
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                for byte_range in (ranges or [None]):
+                    _copy_range(url, byte_range, fp, content_sha1, **kwargs)
+            if sha1 is not None and content_sha1.hexdigest() != sha1:
+                raise IOError('Wrong checksum of %s' % url)
+            os.rename(tmp_filename, filename)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+        # SHA1 of the content is written only for the complete file
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(content_sha1.hexdigest())
+        os.rename(tmp_filename, filename + '.sha1')
+    return filename
+
+
+def _is_valid(filename, sha1=None):
+    """Check that SHA1 of a cached file equals the expected or the stored SHA1"""
+    if sha1 is None and os.path.exists(filename + '.sha1'):
+        with open(filename + '.sha1') as fp:
+            sha1 = fp.read().strip()
+    return sha1 is None or get_file_sha1(filename) == sha1
+
+
+def download_first(sources, cache_dir=None, **kwargs):
+    """Download the first available of several alternative sources
+
+    Parameters
+    ----------
+    sources : list of dicts
+        keyword arguments for download (e.g. [{'url': url1}, {'url': url2,
+        'inventory_url': inv2, 'pattern': pattern}])
+    cache_dir : str
+        cache directory
+    **kwargs : dict
+        parameters for open_url
+
+    Returns
+    -------
+    filename : str
+        name of the downloaded file
+
+    Raises
+    ------
+    IOError
+        if none of the sources is available
+
+    """
+    errors = []
+    for source in sources:
+        source_kwargs = dict(kwargs, **source)
+        try:
+            return download(cache_dir=cache_dir, **source_kwargs)
+        except IOError as e:
+            errors.append(str(e))
+    raise IOError('No sources available:\n' + '\n'.join(errors))
+
+
+def prefetch(sources_list, cache_dir=None, processes=4, **kwargs):
+    """Download several files concurrently
+
+    Parameters
+    ----------
+    sources_list : list of lists
+        alternative sources (see download_first) for each file
+    cache_dir : str
+        cache directory
+    processes : int
+        number of parallel downloads
+    **kwargs : dict
+        parameters for open_url
+
+    Returns
+    -------
+    filenames : list
+        names of downloaded files or None for files which are not available
+
+    """
+    def _download(sources):
+        try:
+            return download_first(sources, cache_dir=cache_dir, **kwargs)
+        except IOError:
+            return None
+
+    pool = ThreadPool(max(1, min(processes, len(sources_list))))
+    try:
+        return pool.map(_download, sources_list)
+    finally:
+        pool.close()
+        pool.join()
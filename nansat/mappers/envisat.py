@@ -4,8 +4,8 @@
 # Licence:      This file is part of NANSAT. You can redistribute it or modify
 #               under the terms of GNU General Public License, v.3
 #               http://www.gnu.org/licenses/gpl-3.0.html
+import os
 from dateutil.parser import parse
-import struct
 
 import numpy as np
 try:
@@ -21,6 +21,37 @@ from nansat.tools import gdal, ogr
 
 from nansat.exceptions import WrongMapperError, NansatReadError
 
+# text headers (MPH, SPH and DSDs) of recently opened files:
+# {(filename, size, mtime): list of header lines}
+_header_cache = {}
+_HEADER_CACHE_SIZE = 16
+
+
+def read_header_lines(filename, n_lines=150):
+    """Read text header of Envisat file (cached for recently opened files)
+
+    Parameters
+    ----------
+        filename : str
+            name of the N1 file
+        n_lines : int
+            number of header lines to read
+
+    Returns
+    -------
+        headerLines : list of str
+
+    """
+    file_stat = os.stat(filename)
+    key = (filename, file_stat.st_size, file_stat.st_mtime)
+    if key not in _header_cache:
+        if len(_header_cache) >= _HEADER_CACHE_SIZE:
+            _header_cache.clear()
+        with open(filename, "rb") as f:
+            _header_cache[key] = [f.readline().decode('utf-8') for i in range(n_lines)]
+    return _header_cache[key]
+
+
 class Envisat(object):
     """Methods/data shared between Envisat mappers
 
@@ -196,12 +227,14 @@ class Envisat(object):
                           }
                  }}
 
-    # map: GDAL TYPES ==> struct format strings
+    # map: GDAL TYPES ==> big-endian format strings (valid for struct and numpy)
     structFmt = {gdal.GDT_Int16: ">h",
                  gdal.GDT_UInt16: ">H",
                  gdal.GDT_Int32: ">i",
                  gdal.GDT_UInt32: ">I",
                  gdal.GDT_Float32: ">f"}
+    # all DSRs of the ADS as raw bytes (read once, see read_ads_records)
+    adsRecords = None
     # names of grids with longitude/latitude in ASAR and MERIS ADS
     lonlatNames = {'ASA_': ['first_line_longs', 'first_line_lats'],
                    'MER_': ['longitude', 'latitude']}
@@ -242,9 +275,8 @@ class Envisat(object):
         textOffset = {'DS_OFFSET': 3, 'DS_SIZE': 4,
                       'NUM_DSR': 5, 'DSR_SIZE': 6}
 
-        # open file and read 150 header lines
-        with open(self.iFileName, "rb") as f:
-            headerLines = [f.readline().decode('utf-8') for i in range(150)]
+        # read 150 header lines (parsed once per file)
+        headerLines = read_header_lines(self.iFileName)
 
         offsetDict = {}
         # create a dictionary with offset, size, number of records,
@@ -279,17 +311,61 @@ class Envisat(object):
                 values which are read from the file.
                 the number of elements is length
         """
-        # fseek, read all into a list
-        f = open(self.iFileName, 'rb')
-        f.seek(offset, 0)
-        binaryValues = []
-        for i in range(length):
-            fString = f.read(struct.calcsize(fmtString))
-            fVal = struct.unpack(fmtString, fString)[0]
-            binaryValues.append(fVal)
-        f.close()
-
-        return binaryValues
+        # fseek, read all values at once
+        with open(self.iFileName, 'rb') as f:
+            f.seek(offset, 0)
+            binaryValues = np.fromfile(f, dtype=np.dtype(fmtString), count=length)
+
+        return binaryValues.tolist()
+
+    def get_ads_dtype(self, adsNames):
+        """Get structured dtype of one DSR of the ADS
+
+        Parameters
+        ----------
+            adsNames : list of str
+                names of variables from ADS. should match allADSParams
+
+        Returns
+        -------
+            dtype : numpy.dtype
+                big-endian record with a field of <width> values for each
+                variable at the offset given in allADSParams
+
+        """
+        adsWidth = self.allADSParams['width']
+        adsParams = self.allADSParams['list']
+        return np.dtype({'names': list(adsNames),
+                         'formats': [(self.structFmt[adsParams[adsName]['dataType']], adsWidth)
+                                     for adsName in adsNames],
+                         'offsets': [adsParams[adsName]['offset'] for adsName in adsNames],
+                         'itemsize': self.dsOffsetDict['DSR_SIZE']})
+
+    def read_ads_records(self, adsNames):
+        """Read given variables from all DSRs of the ADS
+
+        All DSRs are read from the file with one call at the first use and
+        kept in memory (the ADS is small). Variables are extracted using
+        structured dtype.
+
+        Parameters
+        ----------
+            adsNames : list of str
+                names of variables from ADS. should match allADSParams
+
+        Returns
+        -------
+            records : numpy.ndarray
+                structured array with NUM_DSR records and fields <adsNames>
+
+        """
+        if self.adsRecords is None:
+            with open(self.iFileName, 'rb') as f:
+                f.seek(self.dsOffsetDict['DS_OFFSET'], 0)
+                self.adsRecords = np.fromfile(f, dtype=np.uint8,
+                                              count=(self.dsOffsetDict['NUM_DSR'] *
+                                                     self.dsOffsetDict['DSR_SIZE']))
+        return self.adsRecords.view(self.get_ads_dtype(adsNames))
 
     def read_scaling_gads(self, indeces):
         """ Read Scaling Factor GADS to get scalings of MERIS L1/L2
@@ -306,10 +382,11 @@ class Envisat(object):
         maxGADS = max(indeces) + 1
         dsOffsetDict = self.read_offset_from_header(
             'DS_NAME="Scaling Factor GADS         "\n')
-        allGADSValues = self.read_binary_line(dsOffsetDict["DS_OFFSET"],
-                                              '>f', maxGADS)
+        with open(self.iFileName, 'rb') as f:
+            f.seek(dsOffsetDict["DS_OFFSET"], 0)
+            allGADSValues = np.fromfile(f, dtype=np.dtype('>f'), count=maxGADS)
         #get only values required for the mapper
-        return [allGADSValues[i] for i in indeces]
+        return allGADSValues[list(indeces)].tolist()
 
     def get_array_from_ADS(self, adsName):
         """ Create VRT with a band from Envisat ADS metadata
@@ -334,35 +411,17 @@ class Envisat(object):
                 vrt with a band created from ADS array
 
         """
-        # Get parameters of arrays in ADS
-        adsWidth = self.allADSParams['width']
-        adsParams = self.allADSParams['list'][adsName]
-
-        # get data type format string and size
-        fmtString = self.structFmt[adsParams['dataType']]
-
-        # create an array whose elements are fetched from ADS
-        array = np.array([])
+        adsNames = [adsName]
+        # read 'last_line_...' (from the last DSR)
+        if self.prodType == 'ASA_':
+            adsNames.append(adsName.replace('first_line', 'last_line'))
+        adsParams = self.allADSParams['list'][adsNames[-1]]
 
-        # read sequence of 1D arrays from ADS
-        adsHeight = self.dsOffsetDict["NUM_DSR"]
-        for i in range(adsHeight):
-            lineOffset = (self.dsOffsetDict['DS_OFFSET'] +
-                          adsParams['offset'] +
-                          self.dsOffsetDict["DSR_SIZE"] * i)
-            binaryLine = self.read_binary_line(lineOffset, fmtString, adsWidth)
-            array = np.append(array, binaryLine)
-
-        # read 'last_line_...'
+        # read all DSRs at once and stack 1D arrays into 2D matrix
+        records = self.read_ads_records(adsNames)
+        array = records[adsNames[0]].astype(np.float64)
         if self.prodType == 'ASA_':
-            adsName = adsName.replace('first_line', 'last_line')
-            adsParams = self.allADSParams['list'][adsName]
-            lineOffset = (self.dsOffsetDict['DS_OFFSET'] +
-                          adsParams['offset'] +
-                          self.dsOffsetDict["DSR_SIZE"] * i)
-            binaryLine = self.read_binary_line(lineOffset, fmtString, adsWidth)
-            array = np.append(array, binaryLine)
-            adsHeight += 1
+            array = np.vstack([array, records[adsNames[1]][-1:]])
 
         # adjust the scale
         if '(10)^-6' in adsParams['units']:
@@ -372,8 +431,6 @@ class Envisat(object):
             # and hence necessary scaling is not performed
             # adsParams['units'] = adsParams['units'].replace('(10)^-6 ', '')
 
-        # reshape the array into 2D matrix
-        array = array.reshape(adsHeight, adsWidth)
         return array
 
     def create_VRT_from_ADS(self, adsName, zoomSize=500):
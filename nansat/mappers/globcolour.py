@@ -4,12 +4,131 @@
 # Licence:      This file is part of NANSAT. You can redistribute it or modify
 #               under the terms of GNU General Public License, v.3
 #               http://www.gnu.org/licenses/gpl-3.0.html
+import os
+import glob
+import hashlib
+import tempfile
 from copy import deepcopy
 
+import numpy as np
 
-class Globcolour():
+# shape of GLOBCOLOUR grid of bins
+GLOBCOLOUR_ROWS = 180 * 24
+GLOBCOLOUR_COLS = 360 * 24
+
+# indices of the last used target grids {hash of latlonGrid: (cells, inverse, shape)}
+_GRID_INDICES = {}
+
+
+def get_grid_index(latlonGrid, cache_dir=None):
+    ''' Get index for conversion from GLOBCOLOUR bins to a lat/lon grid
+
+    For each pixel of the target grid the GLOBCOLOUR bin is computed. The bins used by the
+    grid are stored as a sorted array of unique bins and an inverse index (pixel -> unique bin).
+    The index does not depend on the data and is kept in memory and saved in <cache_dir> (or
+    in NANSAT_CACHE_DIR), so it is computed only once for each target grid.
+
+    Parameters
+    ----------
+    latlonGrid : numpy 2 layered 2D array with lat/lons of desired grid
+    cache_dir : str
+        directory for saving the index
+
+    Returns
+    -------
+    cells : 1D array
+        sorted unique numbers of GLOBCOLOUR bins covered by the grid
+    inverse : 1D array
+        for each pixel of the grid, index in <cells>
+    shape : tuple
+        shape of the grid
+
+    '''
+    sha1 = hashlib.sha1(repr((latlonGrid.shape, latlonGrid.dtype.str)).encode('utf-8'))
+    sha1.update(np.ascontiguousarray(latlonGrid).tobytes())
+    key = sha1.hexdigest()
+    if key in _GRID_INDICES:
+        return _GRID_INDICES[key]
+
+    if cache_dir is None:
+        cache_dir = os.getenv('NANSAT_CACHE_DIR')
+    cache_file = None
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        cache_file = os.path.join(cache_dir, 'globcolour_index_%s.npz' % key)
+
+    if cache_file is not None and os.path.exists(cache_file):
+        with np.load(cache_file) as index:
+            cells, inverse = index['cells'], index['inverse']
+    else:
+        # index of the GLOBCOLOUR bin for each pixel of latlonGrid
+        yRawPro = np.rint(1 + (GLOBCOLOUR_ROWS - 1) * (latlonGrid[0] + 90) / 180.)
+        lon_step_Mat = 24. * np.cos(np.pi * latlonGrid[0] / 180.)
+        xRawPro = np.rint(1 + (latlonGrid[1] + 180) * lon_step_Mat)
+        iRawPro = (xRawPro.astype('uint32') +
+                   (yRawPro.astype('uint32') - 1) * GLOBCOLOUR_COLS).ravel()
+        cells, inverse = np.unique(iRawPro, return_inverse=True)
+        inverse = inverse.astype('uint32')
+        if cache_file is not None:
+            fd, tmp_filename = tempfile.mkstemp(dir=cache_dir, suffix='.npz')
+            with os.fdopen(fd, 'wb') as fp:
+                np.savez(fp, cells=cells, inverse=inverse)
+            os.rename(tmp_filename, cache_file)
+
+    _GRID_INDICES.clear()
+    _GRID_INDICES[key] = cells, inverse, latlonGrid.shape[1:]
+    return _GRID_INDICES[key]
+
+
+def bins_to_grid(grid_index, row, col, values):
+    ''' Put values of GLOBCOLOUR bins onto the grid
+
+    Only bins covered by the grid are used, the full GLOBCOLOUR grid is not created.
+
+    Parameters
+    ----------
+    grid_index : tuple
+        output from get_grid_index
+    row, col : 1D arrays
+        row and column (starting from 1) of bins with data
+    values : 1D array
+        values in the bins
+
+    Returns
+    -------
+    gridded : 2D array (float32)
+        values on the grid, zero in pixels without data
+
+    '''
+    cells, inverse, shape = grid_index
+    iBinned = (np.asarray(col).astype('uint32') +
+               (np.asarray(row).astype('uint32') - 1) * GLOBCOLOUR_COLS)
+    position = np.searchsorted(cells, iBinned)
+    position[position == len(cells)] = 0
+    valid = cells[position] == iBinned
+    cell_values = np.bincount(position[valid],
+                              weights=np.asarray(values, 'float64')[valid],
+                              minlength=len(cells)).astype('float32')
+    return cell_values[inverse].reshape(shape)
+
+
+def get_files_state(files_mask):
+    ''' Get names, sizes and modification times of files matching a mask (for Nansat cache) '''
+    files_state = []
+    for filename in sorted(glob.glob(files_mask)):
+        file_stat = os.stat(filename)
+        files_state.append([filename, file_stat.st_size, file_stat.st_mtime])
+    return [files_mask, files_state]
+
+
+class Globcolour(object):
     ''' Mapper for GLOBCOLOR L3M products'''
 
+    # results of the mapper are in the VRT-files and depend on the similar files (same date)
+    # in the directory, which are checked when the cached results are used
+    CACHEABLE = True
+    # mask of names of the similar files
+    similar_files_mask = None
+
     # detect wkv from metadata 'Parameter'
     varname2wkv = {'CHL1_mean': 'mass_concentration_of_chlorophyll_a_in_sea_water',
                    'CHL2_mean': 'mass_concentration_of_chlorophyll_a_in_sea_water',
@@ -29,6 +148,18 @@ class Globcolour():
                    'PAR_mean': 'surface_downwelling_photosynthetic_radiative_flux_in_air',
                        }
 
+    def _get_cache_state(self):
+        ''' Get state of VRT and of the similar files (see VRT._get_cache_state) '''
+        state = super(Globcolour, self)._get_cache_state()
+        state['similar_files'] = get_files_state(self.similar_files_mask)
+        return state
+
+    @staticmethod
+    def _check_cache_state(state):
+        ''' Check that no similar files were added, removed or changed after caching '''
+        if get_files_state(state['similar_files'][0]) != state['similar_files']:
+            raise ValueError('Files %s were changed' % state['similar_files'][0])
+
     def make_rrsw_meta_entry(self, nlwMetaEntry):
         '''Make metaEntry for calculation of Rrsw'''
         iWKV = nlwMetaEntry['dst']['wkv']
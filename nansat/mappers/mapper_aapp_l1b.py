@@ -7,216 +7,67 @@
 
 # Description of file format:
 # http://research.metoffice.gov.uk/research/interproj/nwpsaf/aapp/NWPSAF-MF-UD-003_Formats.pdf (page 8-)
-import sys
-import struct
-import datetime
+import warnings
 
-from nansat.exceptions import WrongMapperError
+import numpy as np
+
+from nansat.tools import gdal
 from nansat.geolocation import Geolocation
 from nansat.vrt import VRT
-
-satIDs = {4: 'NOAA-15', 2: 'NOAA-16', 6: 'NOAA-17', 7: 'NOAA-18', 8: 'NOAA-19',
-          11: 'Metop-B (Metop-1)', 12: 'Metop-A (Metop-2)',
-          13: 'Metop-C (Metop-3)'}
-dataFormats = {1: 'LAC', 2: 'GAC', 3: 'HRPT'}
-dataSetQualityIndicatorOffset = 114
-recordLength = 22016
-headerLength = recordLength
-imageOffset = headerLength + 1264
+from nansat.mappers.aapp import (read_l1b, SATELLITE_IDS, DATA_FORMATS, AVHRR_PIXELS,
+                                 TIE_POINT_OFFSET, TIE_POINT_STEP, L1B_RECORD_LENGTH)
 
 
 class Mapper(VRT):
-    ''' VRT with mapping of WKV for AVHRR L1B output from AAPP '''
+    ''' VRT with mapping of WKV for AVHRR L1B output from AAPP
+
+    Header and scanline records are read with nansat.mappers.aapp.read_l1b(). Calibration
+    coefficients of all scanlines are available from the returned AAPPFile object, e.g.::
+
+        aapp_file = read_l1b(filename)
+        bt4 = aapp_file.calibrate_ir(aapp_file.scanlines['avh_pixels'][:, :, 3], 1)
+
+    '''
 
     def __init__(self, filename, gdalDataset, gdalMetadata, **kwargs):
 
         ########################################
         # Read metadata from binary file
         ########################################
-        try:
-            fp = open(filename, 'rb')
-        except IOError:
-            raise WrongMapperError
-        fp.seek(72)
-
-        try:
-            satNum = int(struct.unpack('<H', fp.read(2))[0])
-        except:
-            raise WrongMapperError
+        aapp_file = read_l1b(filename)
+        header = aapp_file.header
 
-        if satNum >= 11:
-            isMetop = True
-        else:
-            isMetop = False
+        satID = SATELLITE_IDS[int(header['avh_h_satid'])]
+        dataFormat = DATA_FORMATS[int(header['avh_h_dataformat'])]
 
-        if satNum in satIDs.keys():
-            satID = satIDs[satNum]
-        else:
-            raise WrongMapperError
-
-        fp.seek(76)
-        dataFormatNum = int(struct.unpack('<H', fp.read(2))[0])
-        if dataFormatNum in dataFormats.keys():
-            dataFormat = dataFormats[dataFormatNum]
-        else:
-            raise WrongMapperError
-
-        fp.seek(dataSetQualityIndicatorOffset + 14)
-        numScanLines = int(struct.unpack('<H', fp.read(2))[0])
-        numCalibratedScanLines = int(struct.unpack('<H', fp.read(2))[0])
-        missingScanLines = int(struct.unpack('<H', fp.read(2))[0])
+        missingScanLines = int(header['avh_h_misscnlin'])
         if missingScanLines != 0:
-            print('WARNING: Missing scanlines: ' + str(missingScanLines))
-
-        ##################
-        # Read time
-        ##################
-        fp.seek(84)
-        year = int(struct.unpack('<H', fp.read(2))[0])
-        dayofyear = int(struct.unpack('<H', fp.read(2))[0])
-        millisecondsOfDay = int(struct.unpack('<l', fp.read(4))[0])
-        time = (datetime.datetime(year, 1, 1) +
-            datetime.timedelta(dayofyear-1, milliseconds=millisecondsOfDay))
+            warnings.warn('Missing scanlines: ' + str(missingScanLines))
 
-        ##################################
-        # Read calibration information
-        ##################################
-        #IRcalibration = {}
-        #fp.seek(202)
-        #avh_h_irttcoef=[]
-        #for i in range(24):
-        #    avh_h_irttcoef.append(int(struct.unpack('<H', fp.read(2))[0]))
-        ##print avh_h_irttcoef
-        #avh_h_albcnv=[]
-        #for i in range(6):
-        #    avh_h_albcnv.append(int(struct.unpack('<l', fp.read(4))[0]))
-        ##print avh_h_albcnv
-        #fp.seek(280)
-        #avh_h_radtempcnv = np.zeros((3,3))
-        #for IRchannelNo in range(3):
-        #    for coeffNo in range(3):
-        #        avh_h_radtempcnv[IRchannelNo, coeffNo] = \
-        #           int(struct.unpack('<l', fp.read(4))[0])
-        #print avh_h_radtempcnv
-        #IRcalibration['centralWavenumber'] = (avh_h_radtempcnv[:,0] /
-        #                                      [1E2, 1E3, 1E3])
-        #IRcalibration['c1'] = avh_h_radtempcnv[:,1] / 1E5
-        #IRcalibration['c2'] = avh_h_radtempcnv[:,2] / 1E6
-
-        ########################################################
-        # Read visible calibration coefficients per scanline
-        # - for channels 1, 2, 3A
-        ########################################################
-        #for scanline in range(1):
-        #    avh_calvis=np.zeros((3,3,5))
-        #    fp.seek(headerLength + recordLength*scanline + 48)
-        #    for VISchannel in range(3):
-        #        for sets in range(3):
-        #            for coeff in range(5):
-        #                avh_calvis[sets, VISchannel, coeff] = \
-        #                    int(struct.unpack('<l', fp.read(4))[0])
-        #    print avh_calvis
-        #    print '----'
-
-        ########################################################
-        # Read IR calibration coefficients per scanline
-        # - for channels 3B, 4, 5
-        ########################################################
-        #for scanline in range(1):
-        #    avh_calir=np.zeros((2,3,3))
-        #    fp.seek(headerLength + recordLength*scanline + 228)
-        #    for IRchannelNo in range(3):
-        #        for setNo in range(2):
-        #            for coeffNo in range(3):
-        #                avh_calir[setNo, IRchannelNo, coeffNo] = \
-        #                    int(struct.unpack('<l', fp.read(4))[0])
-
-        #avh_filler2 = np.zeros(3)
-        #for fillerNo in range(3):
-        #    avh_filler2[fillerNo] = int(struct.unpack('<l', fp.read(4))[0])
-
-        #setNo = 0 # Use operational set (the only available)
-        #a = np.zeros((3,3))
-        #for IRchannelNo in range(3):
-        #    for coeffNo in range(3):
-        #        # NB: apparently stored "backwards", therefore 2-coeffNo
-        #        a[IRchannelNo, 2-coeffNo] = (avh_calir[setNo, IRchannelNo,
-        #                                               coeffNo]
-        #                                     / np.power(10,
-        #                                                avh_filler2[coeffNo]))
-        #
-        ###########################
-        # Apply calibration
-        ###########################
-        #C = 410
-        #for IRchannelNo in range(3):
-        #    Ne = a[IRchannelNo,0] + a[IRchannelNo,1]*C + a[IRchannelNo,2]*C*C
-        #    vC = IRcalibration['centralWavenumber'][IRchannelNo]
-        #    c1 = -IRcalibration['c1'][IRchannelNo] # Note minus
-        #    c2 = IRcalibration['c2'][IRchannelNo]
-            #print '-----'
-            #print a[IRchannelNo,:]
-            #print vC, c1, c2
-            #TeStar = c2*vC/np.log(1 + (c1*vC*vC*vC)/Ne)
-            #Te = c1 + c2*TeStar
-            #print Ne, TeStar, Te
-            #print '-----'
-        #sys.exit('stop')
+        time = aapp_file.get_time()
+        numCalibratedScanLines = aapp_file.num_scanlines
 
         ###########################
         # Make Geolocation Arrays
         ###########################
-        srcRasterYSize = numCalibratedScanLines
+        lon, lat = aapp_file.get_lonlat()
+        self.band_vrts = {'lonVRT': VRT.from_array(lon),
+                          'latVRT': VRT.from_array(lat)}
 
-        # Making VRT with raw (unscaled) lon and lat
-        # (smaller bands than full dataset)
-        self.band_vrts = {'RawGeolocVRT': VRT(srcRasterXSize=51,
-                                            srcRasterYSize=srcRasterYSize)}
-        RawGeolocMetaDict = []
-        for lonlatNo in range(1, 3):
-            RawGeolocMetaDict.append(
-                {'src': {'SourceFilename': filename,
-                         'SourceBand': 0,
-                         'SourceType': "RawRasterBand",
-                         'DataType': gdal.GDT_Int32,
-                         'ImageOffset': (headerLength + 640 +
-                                         (lonlatNo - 1) * 4),
-                         'PixelOffset': 8,
-                         'LineOffset': recordLength,
-                         'ByteOrder': 'LSB'},
-                 'dst': {}})
-
-        self.band_vrts['RawGeolocVRT'].create_bands(RawGeolocMetaDict)
-
-        # Make derived GeolocVRT with scaled lon and lat
-        self.band_vrts['GeolocVRT'] = VRT(srcRasterXSize=51,
-                                        srcRasterYSize=srcRasterYSize)
-        GeolocMetaDict = []
-        for lonlatNo in range(1, 3):
-            GeolocMetaDict.append(
-                {'src': {'SourceFilename': (self.band_vrts['RawGeolocVRT'].
-                                            filename),
-                         'SourceBand': lonlatNo,
-                         'ScaleRatio': 0.0001,
-                         'ScaleOffset': 0,
-                         'DataType': gdal.GDT_Int32},
-                 'dst': {}})
-
-        self.band_vrts['GeolocVRT'].create_bands(GeolocMetaDict)
-
-        GeolocObject = Geolocation(x_vRT=self.band_vrts['GeolocVRT'],
-                                    y_vRT=self.band_vrts['GeolocVRT'],
-                                    x_band=2, y_band=1,  # x = lon, y = lat
-                                    line_offset=0, pixel_offset=25,
-                                    line_step=1, pixel_step=40)
+        GeolocObject = Geolocation(x_vrt=self.band_vrts['lonVRT'],
+                                   y_vrt=self.band_vrts['latVRT'],
+                                   x_band=1, y_band=1,
+                                   line_offset=0, pixel_offset=TIE_POINT_OFFSET,
+                                   line_step=1, pixel_step=TIE_POINT_STEP)
 
         #######################
         # Initialize dataset
         #######################
         # create empty VRT dataset with geolocation only
         # (from Geolocation Array)
-        self._init_from_dataset_params(2048, numCalibratedScanLines,
-                                        (0,1,0,numCalibratedScanLines,0,-1), GeolocObject.d['SRS'])
+        self._init_from_dataset_params(AVHRR_PIXELS, numCalibratedScanLines,
+                                       (0, 1, 0, numCalibratedScanLines, 0, -1),
+                                       GeolocObject.data['SRS'])
         self._add_geolocation(GeolocObject)
 
         ##################
@@ -237,15 +88,18 @@ class Mapper(VRT):
         ch[4]['minmax'] = '400 1000'
         ch[5]['minmax'] = '400 1000'
 
+        imageOffset = aapp_file.get_field_offset('avh_pixels')
         for bandNo in range(1, 6):
             metaDict.append({'src': {'SourceFilename': filename,
                                      'SourceBand': 0,
                                      'SourceType': "RawRasterBand",
-                                     'dataType': gdal.GDT_UInt16,
+                                     'DataType': gdal.GDT_UInt16,
                                      'ImageOffset': imageOffset + (bandNo-1)*2,
                                      'PixelOffset': 10,
-                                     'LineOffset': recordLength,
-                                     'ByteOrder': 'LSB'},
+                                     'LineOffset': L1B_RECORD_LENGTH,
+                                     'ByteOrder': 'LSB',
+                                     'xSize': AVHRR_PIXELS,
+                                     'ySize': numCalibratedScanLines},
                             'dst': {'dataType': gdal.GDT_UInt16,
                                     'wkv': 'raw_counts',
                                     'colormap': 'gray',
@@ -253,10 +107,54 @@ class Mapper(VRT):
                                     'minmax': ch[bandNo]['minmax'],
                                     'unit': "1"}})
 
+        # Add solar and satellite angles (given at the same tie points as lon/lat)
+        angleNames = [('solar_zenith_angle', 'solar_zenith_angle'),
+                      ('satellite_zenith_angle', 'sensor_zenith_angle'),
+                      ('relative_azimuth_angle', None)]
+        for (name, wkv), angle in zip(angleNames, aapp_file.get_angles()):
+            self.band_vrts[name] = VRT.from_array(self._extend_tie_points(angle))
+            dst = {'name': name, 'units': 'degrees'}
+            if wkv is not None:
+                dst['wkv'] = wkv
+            metaDict.append({'src': self._get_tie_point_source(name), 'dst': dst})
+
         self.create_bands(metaDict)
 
         # Adding valid time to dataset
+        self.dataset.SetMetadataItem('satID', satID)
+        self.dataset.SetMetadataItem('dataFormat', dataFormat)
         self.dataset.SetMetadataItem('time_coverage_start', time.isoformat())
         self.dataset.SetMetadataItem('time_coverage_end', time.isoformat())
 
-        return
+    @staticmethod
+    def _extend_tie_points(array):
+        """ Add one linearly extrapolated tie point at both ends of each scanline
+
+        The extended tie points (at pixels TIE_POINT_OFFSET - TIE_POINT_STEP and
+        TIE_POINT_OFFSET + TIE_POINTS * TIE_POINT_STEP) cover the edges of the scanline.
+
+        """
+        array = array.astype(np.float32)
+        return np.hstack([2 * array[:, :1] - array[:, 1:2],
+                          array,
+                          2 * array[:, -1:] - array[:, -2:-1]])
+
+    def _get_tie_point_source(self, name):
+        """ Get source for a band which interpolates values at tie points to all pixels
+
+        Centers of the extended tie points (see _extend_tie_points) are mapped onto centers of
+        the pixels TIE_POINT_OFFSET + i * TIE_POINT_STEP, i.e. the same pixels as the tie
+        points of the geolocation arrays, and are resampled bilinearly by GDAL.
+
+        """
+        tie_vrt = self.band_vrts[name]
+        tie_points = tie_vrt.dataset.RasterXSize
+        return {'SourceFilename': tie_vrt.filename,
+                'SourceBand': 1,
+                'xOff': 0.5,
+                'xSize': tie_points - 1,
+                'ySize': tie_vrt.dataset.RasterYSize,
+                'dstXOff': TIE_POINT_OFFSET - TIE_POINT_STEP + 0.5,
+                'dstXSize': (tie_points - 1) * TIE_POINT_STEP,
+                'dstYSize': self.dataset.RasterYSize,
+                'resampling': self.RESAMPLING_NAMES[1]}
@@ -7,20 +7,15 @@
 
 # Description of file format:
 # http://research.metoffice.gov.uk/research/interproj/nwpsaf/aapp/NWPSAF-MF-UD-003_Formats.pdf (page 120-)
-import sys
-import struct
-import datetime
 import warnings
 
-from nansat.exceptions import WrongMapperError
+import numpy as np
+
+from nansat.tools import gdal
 from nansat.geolocation import Geolocation
 from nansat.vrt import VRT
-
-dataFormats = {1: 'LAC', 2: 'GAC', 3: 'HRPT'}
-dataSetQualityIndicatorOffset = 114
-recordLength = 29808
-headerLength = recordLength
-imageOffset = headerLength + 1092
+from nansat.mappers.aapp import (read_l1c, AVHRR_PIXELS, TIE_POINT_OFFSET, TIE_POINT_STEP,
+                                 L1C_RECORD_LENGTH)
 
 
 class Mapper(VRT):
@@ -31,128 +26,53 @@ class Mapper(VRT):
         ########################################
         # Read metadata from binary file
         ########################################
-        try:
-            fp = open(filename, 'rb')
-        except IOError:
-            raise WrongMapperError
-        fp.seek(24)
-        try:
-            satID = int(struct.unpack('<l', fp.read(4))[0])
-        except:
-            raise WrongMapperError
+        aapp_file = read_l1c(filename)
+        header = aapp_file.header
+        satID = int(header['avh_h_satid'])
+        time = aapp_file.get_time()
 
-        ##################
-        # Read time
-        ##################
-        fp.seek(44)
-        year = int(struct.unpack('<l', fp.read(4))[0])
-        dayofyear = int(struct.unpack('<l', fp.read(4))[0])
-        millisecondsOfDay = int(struct.unpack('<l', fp.read(4))[0])
-        try:
-            time = (datetime.datetime(year, 1, 1) +
-                    datetime.timedelta(dayofyear - 1,
-                                       milliseconds=millisecondsOfDay))
-        except:
-            raise WrongMapperError
-
-        fp.seek(72)
-        numScanLines = int(struct.unpack('<l', fp.read(4))[0])
-        missingScanLines = int(struct.unpack('<l', fp.read(4))[0])
-        numCalibratedScanLines = int(struct.unpack('<l', fp.read(4))[0])
+        missingScanLines = int(header['avh_h_misscnlin'])
         if missingScanLines != 0:
-            print('WARNING: Missing scanlines: ' + str(missingScanLines))
-
-        fp.seek(88)
-        dataFormatNum = int(struct.unpack('<l', fp.read(4))[0])
-        dataFormat = dataFormats[dataFormatNum]
+            warnings.warn('Missing scanlines: ' + str(missingScanLines))
+        numCalibratedScanLines = aapp_file.num_scanlines
 
         # Determine if we have channel 3A (daytime) or channel 3B (nighttime)
-        def int2bitstring(s):
-            return str(s) if s <= 1 else int2bitstring(s >> 1) + str(s & 1)
-        fp.seek(headerLength + 20)
-        scanlinebitFirstline = int(struct.unpack('<L', fp.read(4))[0])
-        fp.seek(headerLength + recordLength*(numCalibratedScanLines-2) + 20)
-        scanlinebitLastline = int(struct.unpack('<L', fp.read(4))[0])
-
-        if int2bitstring(scanlinebitFirstline)[-1] == '0':
-            startsWith3A = True
-        else:
-            startsWith3A = False
-        if int2bitstring(scanlinebitLastline)[-1] == '0':
-            endsWith3A = True
-        else:
-            endsWith3A = False
+        # from the last bit of the scanline bit field
+        is3A = (aapp_file.get_scanline_bits() & 1) == 0
+        startsWith3A = bool(is3A[0])
+        # last but one scanline (the last one is often incomplete)
+        endsWith3A = bool(is3A[max(numCalibratedScanLines - 2, 0)])
 
         if startsWith3A != endsWith3A:
-            print('############################################')
-            print('WARNING: channel 3 switches ')
-            print('between daytime and nighttime (3A <-> 3B)')
-            print('###########################################')
+            warnings.warn('Channel 3 switches between daytime and nighttime (3A <-> 3B)')
 
         ###########################
         # Make Geolocation Arrays
         ###########################
-        srcRasterYSize = numCalibratedScanLines
-
-        # Making VRT with raw (unscaled) lon and lat
-        # (smaller bands than full dataset)
-        self.band_vrts = {'RawGeolocVRT': VRT(srcRasterXSize=51,
-                                            srcRasterYSize=srcRasterYSize)}
-        RawGeolocMetaDict = []
-        for lonlatNo in range(1, 3):
-            RawGeolocMetaDict.append(
-                {'src': {'SourceFilename': filename,
-                         'SourceBand': 0,
-                         'SourceType': "RawRasterBand",
-                         'DataType': gdal.GDT_Int32,
-                         'ImageOffset': (headerLength + 676 +
-                                         (lonlatNo - 1) * 4),
-                         'PixelOffset': 8,
-                         'LineOffset': recordLength,
-                         'ByteOrder': 'LSB'},
-                 'dst': {}})
-
-        self.band_vrts['RawGeolocVRT'].create_bands(RawGeolocMetaDict)
-
-        # Make derived GeolocVRT with scaled lon and lat
-        self.band_vrts['GeolocVRT'] = VRT(srcRasterXSize=51,
-                                        srcRasterYSize=srcRasterYSize)
-        GeolocMetaDict = []
-        for lonlatNo in range(1, 3):
-            GeolocMetaDict.append(
-                {'src': {'SourceFilename': (self.band_vrts['RawGeolocVRT'].
-                                            filename),
-                         'SourceBand': lonlatNo,
-                         'ScaleRatio': 0.0001,
-                         'ScaleOffset': 0,
-                         'DataType': gdal.GDT_Int32},
-                 'dst': {}})
+        lon, lat = aapp_file.get_lonlat()
+        self.band_vrts = {'lonVRT': VRT.from_array(lon),
+                          'latVRT': VRT.from_array(lat)}
 
-        self.band_vrts['GeolocVRT'].create_bands(GeolocMetaDict)
-
-        GeolocObject = Geolocation(x_vrt=self.band_vrts['GeolocVRT'],
-                                        y_vrt=self.band_vrts['GeolocVRT'],
-                                        x_band=2, y_band=1,  # x = lon, y = lat
-                                        line_offset=0, pixel_offset=25,
-                                        line_step=1, pixel_step=40)
+        GeolocObject = Geolocation(x_vrt=self.band_vrts['lonVRT'],
+                                   y_vrt=self.band_vrts['latVRT'],
+                                   x_band=1, y_band=1,
+                                   line_offset=0, pixel_offset=TIE_POINT_OFFSET,
+                                   line_step=1, pixel_step=TIE_POINT_STEP)
 
         #######################
         # Initialize dataset
         #######################
         # create empty VRT dataset with geolocation only
         # (from Geolocation Array)
-        self._init_from_dataset_params(2048, numCalibratedScanLines,
-                                        (0,1,0,numCalibratedScanLines,0,-1),
-                                        GeolocObject.d['SRS'])
+        self._init_from_dataset_params(AVHRR_PIXELS, numCalibratedScanLines,
+                                       (0, 1, 0, numCalibratedScanLines, 0, -1),
+                                       GeolocObject.data['SRS'])
         self._add_geolocation(GeolocObject)
 
-
         ##################
         # Create bands
         ##################
-        self.band_vrts['RawBandsVRT'] = VRT(
-            srcRasterXSize=2048,
-            srcRasterYSize=numCalibratedScanLines)
+        self.band_vrts['RawBandsVRT'] = VRT(x_size=AVHRR_PIXELS, y_size=numCalibratedScanLines)
         RawMetaDict = []
         metaDict = []
 
@@ -164,16 +84,19 @@ class Mapper(VRT):
             centralWavelengths[2] = 3.7
             firstIRband = 3
 
+        imageOffset = aapp_file.get_field_offset('avh_pixels')
         for bandNo in range(1, 6):
             RawMetaDict.append(
                 {'src': {'SourceFilename': filename,
                          'SourceBand': 0,
                          'SourceType': "RawRasterBand",
-                         'dataType': gdal.GDT_UInt16,
+                         'DataType': gdal.GDT_UInt16,
                          'ImageOffset': imageOffset + (bandNo - 1) * 2,
                          'PixelOffset': 10,
-                         'LineOffset': recordLength,
-                         'ByteOrder': 'LSB'},
+                         'LineOffset': L1C_RECORD_LENGTH,
+                         'ByteOrder': 'LSB',
+                         'xSize': AVHRR_PIXELS,
+                         'ySize': numCalibratedScanLines},
                  'dst': {'dataType': gdal.GDT_UInt16}})
 
             if bandNo < firstIRband:
@@ -220,7 +143,7 @@ class Mapper(VRT):
                          'units': 'kelvin',
                          'minmax': '-3 3'}})
 
-        self.self.band_vrts['RawBandsVRT'].create_bands(RawMetaDict)
+        self.band_vrts['RawBandsVRT'].create_bands(RawMetaDict)
         self.create_bands(metaDict)
 
         globalMetadata = {}
@@ -231,5 +154,3 @@ class Mapper(VRT):
         # Adding valid time to dataset
         self.dataset.SetMetadataItem('time_coverage_start', time.isoformat())
         self.dataset.SetMetadataItem('time_coverage_end', time.isoformat())
-
-        return
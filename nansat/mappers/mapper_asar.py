@@ -33,7 +33,10 @@ class Mapper(VRT, Envisat):
             http://envisat.esa.int/handbooks/asar/CNTR6-6-9.htm#eph.asar.asardf.asarrec.ASAR_Geo_Grid_ADSR
     '''
 
-    def __init__(self, filename, gdalDataset, gdalMetadata, **kwargs):
+    # all results of the mapper are in the VRT-files
+    CACHEABLE = True
+
+    def __init__(self, filename, gdalDataset, gdalMetadata, metadata_only=False, **kwargs):
 
         '''
         Parameters
@@ -44,6 +47,10 @@ class Mapper(VRT, Envisat):
 
         gdalMetadata : gdal metadata
 
+        metadata_only : bool
+            if True, only raw counts are added (incidence angle, look direction
+            and sigma0 are not computed from ADS)
+
         '''
 
         self.setup_ads_parameters(filename, gdalMetadata)
@@ -133,6 +140,12 @@ class Mapper(VRT, Envisat):
                              'SourceTransferType': gdal.GetDataTypeName(dtype),
                              'dataType': intensityDataType}})
 
+        # add only raw counts in the metadata only mode and RETURN
+        if metadata_only:
+            self.create_bands(metaDict)
+            self._set_asar_metadata(gdalMetadata)
+            return
+
         #####################################################################
         # Add incidence angle and look direction through small VRT objects
         #####################################################################
@@ -234,12 +247,6 @@ class Mapper(VRT, Envisat):
         # add bands with metadata and corresponding values to the empty VRT
         self.create_bands(metaDict)
 
-        # Add oribit and look information to metadata domain
-        # ASAR is always right-looking
-        self.dataset.SetMetadataItem('ANTENNA_POINTING', 'RIGHT')
-        self.dataset.SetMetadataItem('ORBIT_DIRECTION',
-                        gdalMetadata['SPH_PASS'].upper().strip())
-
         ###################################################################
         # Estimate sigma0_VV from sigma0_HH
         ###################################################################
@@ -267,6 +274,16 @@ class Mapper(VRT, Envisat):
             self.create_band(srcFiles, dst)
             self.dataset.FlushCache()
 
+        self._set_asar_metadata(gdalMetadata)
+
+    def _set_asar_metadata(self, gdalMetadata):
+        ''' Set orbit, look, time, instrument and platform metadata '''
+        # Add oribit and look information to metadata domain
+        # ASAR is always right-looking
+        self.dataset.SetMetadataItem('ANTENNA_POINTING', 'RIGHT')
+        self.dataset.SetMetadataItem('ORBIT_DIRECTION',
+                        gdalMetadata['SPH_PASS'].upper().strip())
+
         # set time
         self._set_envisat_time(gdalMetadata)
 
@@ -16,11 +16,15 @@ from netCDF4 import Dataset
 from nansat.nsr import NSR
 from nansat.geolocation import Geolocation
 from nansat.vrt import VRT
-from nansat.tools import gdal, parse_time
+from nansat.tools import (gdal, parse_time, array_to_gcps, crop_gcps, read_cropped_gcps,
+                          GCP_DTYPE, GCP_VARIABLE)
 from nansat.exceptions import WrongMapperError
 
 # TODO: remove WrongMapperError
 class Mapper(VRT):
+    # all results of the mapper are in the VRT-files
+    CACHEABLE = True
+
     def __init__(self, inputFileName, gdalDataset, gdalMetadata, logLevel=30,
                  rmMetadatas=['NETCDF_VARNAME', '_Unsigned',
                               'ScaleRatio', 'ScaleOffset', 'dods_variable'],
@@ -47,7 +51,9 @@ class Mapper(VRT):
         if len(subDatasets) == 0:
             filenames = [inputFileName]
         else:
-            filenames = [f[0] for f in subDatasets]
+            # skip variable with GCPs added by Nansat export
+            filenames = [f[0] for f in subDatasets
+                         if not f[0].endswith(':' + GCP_VARIABLE)]
 
         # add bands with metadata and corresponding values to the empty VRT
         metaDict = []
@@ -181,8 +187,12 @@ class Mapper(VRT):
         if not gcps:
             gcps = self.add_gcps_from_metadata(geoMetadata)
         # if yet no GCPs: try to add GCPs from variables
+        # (and read them again only inside the window when cropped, see get_cropped_vrt)
+        self._gcps_filename = None
         if not gcps:
             gcps = self.add_gcps_from_variables(inputFileName)
+            if gcps:
+                self._gcps_filename = inputFileName
 
         if gcps:
             if len(gcpProjection) == 0:
@@ -314,15 +324,39 @@ class Mapper(VRT):
             gcpAllValues.append(gcpValues)
 
         # create list of GDAL GCPs
-        gcps = []
-        for i in range(0, len(gcpAllValues[0])):
-            gcps.append(gdal.GCP(gcpAllValues[2][i], gcpAllValues[3][i], 0,
-                                 gcpAllValues[0][i], gcpAllValues[1][i]))
+        gcp_array = np.zeros(len(gcpAllValues[0]), GCP_DTYPE)
+        for gcpName, gcpValues in zip(gcpNames, gcpAllValues):
+            gcp_array[gcpName] = gcpValues
 
-        return gcps
+        return array_to_gcps(gcp_array)
 
     def add_gcps_from_variables(self, filename):
-        ''' Get GCPs from GCPPixel, GCPLine, GCPX, GCPY, GCPZ variables '''
+        ''' Get GCPs from 2D variable GCPs or from GCPX, GCPY, GCPZ, GCPPixel, GCPLine variables '''
+        gcp_array = self.read_gcp_array(filename)
+        if gcp_array is None:
+            return None
+
+        # create list of GDAL.GCPs
+        return array_to_gcps(gcp_array)
+
+    def read_gcp_array(self, filename, window=None):
+        ''' Read GCPs from 2D variable GCPs or from GCPX, GCPY, GCPZ, GCPPixel, GCPLine variables
+
+        Parameters
+        ----------
+        filename : str
+            name of the netCDF file
+        window : tuple
+            (x_offset, x_size, y_offset, y_size). If given, only GCPs inside the window are
+            returned, with pixel/line coordinates relative to the window. Only their rows of
+            the 2D variable are read (see tools.read_cropped_gcps).
+
+        Returns
+        -------
+        gcp_array : numpy.ndarray or None
+            structured array with GCPs (GCP_DTYPE), None if the file has no GCP variables
+
+        '''
         gcpVariables = ['GCPX', 'GCPY', 'GCPZ', 'GCPPixel', 'GCPLine', ]
         # open input netCDF file for reading GCPs
         try:
@@ -331,22 +365,41 @@ class Mapper(VRT):
             self.logger.info('%s' % e)
             return None
 
-        # check if all GCP variables exist in the file
-        if not all([var in ncFile.variables for var in gcpVariables]):
+        # get data from GCP variable(s) into array
+        try:
+            if GCP_VARIABLE in ncFile.variables:
+                gcp_variable = ncFile.variables[GCP_VARIABLE]
+                if window is not None:
+                    return read_cropped_gcps(gcp_variable, *window)
+                gcp_array = gcp_variable[:]
+            elif all([var in ncFile.variables for var in gcpVariables]):
+                gcp_array = np.array([ncFile.variables[var][:] for var in gcpVariables]).T
+            else:
+                return None
+        finally:
+            # close input file
+            ncFile.close()
+
+        gcp_array = np.rec.fromarrays(np.asarray(gcp_array, 'f8').T,
+                                      dtype=GCP_DTYPE).view(np.ndarray)
+        if window is not None:
+            gcp_array = crop_gcps(gcp_array, *window)
+        return gcp_array
+
+    def get_cropped_vrt(self, x_offset, y_offset, x_size, y_size):
+        ''' Create cropped VRT with GCPs read from the file only inside the window
+
+        Used if GCPs were read from variables of the file (see VRT.get_cropped_vrt)
+        '''
+        if getattr(self, '_gcps_filename', None) is None:
+            return None
+        gcp_array = self.read_gcp_array(self._gcps_filename,
+                                        (x_offset, x_size, y_offset, y_size))
+        if gcp_array is None:
             return None
 
-        # get data from GCP variables into array
-        varData = [ncFile.variables[var][:] for var in gcpVariables]
-        varData = np.array(varData)
-
-        # close input file
-        ncFile.close()
-
-        # create list of GDAL.GCPs
-        gcps = [gdal.GCP(float(x),
-                         float(y),
-                         float(z),
-                         float(pixel),
-                         float(line)) for x, y, z, pixel, line in varData.T]
-
-        return gcps
+        cropped_vrt = self.get_super_vrt()
+        cropped_vrt.set_offset_size('x', x_offset, x_size)
+        cropped_vrt.set_offset_size('y', y_offset, y_size)
+        cropped_vrt.shift_cropped_gcps(x_offset, x_size, y_offset, y_size, gcp_array)
+        return cropped_vrt
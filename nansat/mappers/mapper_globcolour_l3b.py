@@ -9,8 +9,6 @@ import glob
 import os
 import datetime
 import json
-import tempfile
-import shutil
 
 import numpy as np
 
@@ -20,10 +18,10 @@ import pythesint as pti
 
 from nansat.exceptions import WrongMapperError
 from nansat.vrt import VRT
-from globcolour import Globcolour
+from nansat.mappers.globcolour import Globcolour, get_grid_index, bins_to_grid
 
 
-class Mapper(VRT, Globcolour):
+class Mapper(Globcolour, VRT):
     ''' Create VRT with mapping of WKV for MERIS Level 2 (FR or RR)'''
 
     def __init__(self, filename, gdalDataset, gdalMetadata, latlonGrid=None,
@@ -50,10 +48,6 @@ class Mapper(VRT, Globcolour):
                      or gdalDataset.RasterCount > 0))):
             raise WrongMapperError
 
-        # define shape of GLOBCOLOUR grid
-        GLOBCOLOR_ROWS = 180 * 24
-        GLOBCOLOR_COLS = 360 * 24
-
         # define lon/lat grids for projected var
         if latlonGrid is None:
             latlonGrid = np.mgrid[90:-90:4320j,
@@ -64,8 +58,13 @@ class Mapper(VRT, Globcolour):
         # create empty VRT dataset with geolocation only
         self._init_from_lonlat(latlonGrid[1], latlonGrid[0])
 
+        # get index for converting from GLOBCOLOR-grid to latlonGrid
+        # (computed once for each latlonGrid and cached)
+        grid_index = get_grid_index(latlonGrid)
+
         # get list of similar (same date) files in the directory
         simFilesMask = os.path.join(iDir, iFileName[0:30] + '*' + mask + '.nc')
+        self.similar_files_mask = simFilesMask
         simFiles = glob.glob(simFilesMask)
         simFiles.sort()
 
@@ -74,28 +73,8 @@ class Mapper(VRT, Globcolour):
         mask = None
         for simFile in simFiles:
             print('sim: ', simFile)
-            # copy simFile to a temporary file
-            tmpf = tempfile.mkstemp()
-            shutil.copyfile(simFile, tmpf[1])
-            f = Dataset(tmpf[1])
-
-            # get iBinned, index for converting from binned into GLOBCOLOR-grid
-            colBinned = f.variables['col'][:]
-            rowBinned = f.variables['row'][:]
-            iBinned = (colBinned.astype('uint32') +
-                      (rowBinned.astype('uint32') - 1) * GLOBCOLOR_COLS)
-            colBinned = None
-            rowBinned = None
-
-            # get iRawPro, index for converting
-            # from GLOBCOLOR-grid to latlonGrid
-            yRawPro = np.rint(1 + (GLOBCOLOR_ROWS - 1) *
-                              (latlonGrid[0] + 90) / 180.)
-            lon_step_Mat = 24. * np.cos(np.pi * latlonGrid[0] / 180.)
-            xRawPro = np.rint(1 + (latlonGrid[1] + 180) * lon_step_Mat)
-            iRawPro = xRawPro.astype('uint32') + (yRawPro.astype('uint32') - 1) * GLOBCOLOR_COLS
-            yRawPro = None
-            xRawPro = None
+            f = Dataset(simFile)
+            title = f.title
 
             for varName in f.variables:
                 # find variable with _mean, eg CHL1_mean
@@ -105,20 +84,15 @@ class Mapper(VRT, Globcolour):
 
             # skip variable if no WKV is give in Globcolour
             if varName not in self.varname2wkv:
+                f.close()
                 continue
 
             # get WKV
             varWKV = self.varname2wkv[varName]
 
-            # read binned data
-            varBinned = var[:]
-
-            # convert to GLOBCOLOR grid
-            varRawPro = np.zeros([GLOBCOLOR_ROWS, GLOBCOLOR_COLS], 'float32')
-            varRawPro.flat[iBinned] = varBinned
-
-            # convert to latlonGrid
-            varPro = varRawPro.flat[iRawPro.flat[:]].reshape(iRawPro.shape)
+            # convert binned data to latlonGrid
+            varPro = bins_to_grid(grid_index, f.variables['row'][:], f.variables['col'][:],
+                                  var[:])
 
             # add mask band
             if mask is None:
@@ -163,9 +137,9 @@ class Mapper(VRT, Globcolour):
             if metaEntry2 is not None:
                 metaDict.append(metaEntry2)
 
-            os.remove(tmpf[1])
+            f.close()
 
-        instrument = f.title.strip().split(' ')[-2].split('/')[0]
+        instrument = title.strip().split(' ')[-2].split('/')[0]
         mm = pti.get_gcmd_instrument(instrument)
         self.dataset.SetMetadataItem('instrument', json.dumps(mm))
 
@@ -18,7 +18,7 @@ from nansat.tools import gdal, ogr
 from nansat.exceptions import WrongMapperError
 
 
-class Mapper(VRT, Globcolour):
+class Mapper(Globcolour, VRT):
     """Mapper for GLOBCOLOR L3M products"""
 
     def __init__(self, filename, gdalDataset, gdalMetadata, **kwargs):
@@ -38,6 +38,7 @@ class Mapper(VRT, Globcolour):
         print('idir:', iDir, iFile, iFileName[0:30], iFileExt[0:8])
 
         simFilesMask = os.path.join(iDir, iFileName[0:30] + '*.nc')
+        self.similar_files_mask = simFilesMask
         simFiles = glob.glob(simFilesMask)
         print('simFilesMask, simFiles', simFilesMask, simFiles)
 
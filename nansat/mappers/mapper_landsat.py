@@ -6,7 +6,6 @@
 #               http://www.gnu.org/licenses/gpl-3.0.html
 import os
 import glob
-import tarfile
 import warnings
 import datetime
 import json
@@ -15,6 +14,7 @@ import pythesint as pti
 
 from nansat.tools import gdal, np, parse_time
 from nansat.vrt import VRT
+from nansat.mappers.archives import get_archive_index
 
 from nansat.exceptions import WrongMapperError
 
@@ -22,10 +22,23 @@ class Mapper(VRT):
     ''' Mapper for LANDSAT5,6,7,8 .tar.gz or tif files'''
 
     def __init__(self, filename, gdalDataset, gdalMetadata,
-                       resolution='low', **kwargs):
-        ''' Create LANDSAT VRT from multiple tif files or single tar.gz file'''
+                       resolution='low', extract=False, **kwargs):
+        ''' Create LANDSAT VRT from multiple tif files or single tar.gz file
+
+        Parameters
+        ----------
+        resolution : str
+            'low' or 'high' - use bands with the lowest or the highest resolution
+        extract : bool
+            decompress tar.gz once into a seekable scratch file (see
+            nansat.mappers.archives.ArchiveIndex). Otherwise the TIF files are read directly
+            from the compressed archive.
+
+        '''
         mtlFileName = ''
+        mtlContent = None
         bandFileNames = []
+        bandNames = []
         bandSizes = []
         bandDatasets = []
         fname = os.path.split(filename)[1]
@@ -33,30 +46,31 @@ class Mapper(VRT):
         if   (filename.endswith('.tar') or
               filename.endswith('.tar.gz') or
               filename.endswith('.tgz')):
-            # try to open .tar or .tar.gz or .tgz file with tar
-            try:
-                tarFile = tarfile.open(filename)
-            except:
+            # get names and offsets of files in .tar or .tar.gz or .tgz (scanned once)
+            archive = get_archive_index(filename, extract=extract)
+            if archive is None:
                 raise WrongMapperError
 
             # collect names of bands and corresponding sizes
             # into bandsInfo dict and bandSizes list
-            tarNames = sorted(tarFile.getnames())
+            tarNames = sorted(archive.names())
             for tarName in tarNames:
                 # check if TIF files inside TAR qualify
                 if   (tarName[0] in ['L', 'M'] and
                       os.path.splitext(tarName)[1] in ['.TIF', '.tif']):
                     # open TIF file from TAR using VSI
-                    sourceFilename = '/vsitar/%s/%s' % (filename, tarName)
+                    sourceFilename = archive.vsi_path(tarName)
                     gdalDatasetTmp = gdal.Open(sourceFilename)
                     # keep name, GDALDataset and size
                     bandFileNames.append(sourceFilename)
+                    bandNames.append(tarName)
                     bandSizes.append(gdalDatasetTmp.RasterXSize)
                     bandDatasets.append(gdalDatasetTmp)
                 elif (tarName.endswith('MTL.txt') or
                       tarName.endswith('MTL.TXT')):
                     # get mtl file
                     mtlFileName = tarName
+                    mtlContent = archive.read(tarName).decode('utf-8', 'replace')
 
         elif ((fname.startswith('L') or fname.startswith('M')) and
               (fname.endswith('.tif') or
@@ -73,6 +87,7 @@ class Mapper(VRT):
                 gdalDatasetTmp = gdal.Open(sourceFilename)
                 # keep name, GDALDataset and size
                 bandFileNames.append(sourceFilename)
+                bandNames.append(sourceFilename)
                 bandSizes.append(gdalDatasetTmp.RasterXSize)
                 bandDatasets.append(gdalDatasetTmp)
 
@@ -98,12 +113,13 @@ class Mapper(VRT):
 
         # find bands with appropriate size and put to metaDict
         metaDict = []
-        for bandFileName, bandSize, bandDataset in zip(bandFileNames,
-                                                       bandSizes,
-                                                       bandDatasets):
+        for bandFileName, bandName, bandSize, bandDataset in zip(bandFileNames,
+                                                                 bandNames,
+                                                                 bandSizes,
+                                                                 bandDatasets):
             if bandSize == bandXSise:
                 # let last part of file name be suffix
-                bandSuffix = os.path.splitext(bandFileName)[0].split('_')[-1]
+                bandSuffix = os.path.splitext(bandName)[0].split('_')[-1]
 
                 metaDict.append({
                     'src': {'SourceFilename': bandFileName,
@@ -120,9 +136,11 @@ class Mapper(VRT):
         self.create_bands(metaDict)
 
         if len(mtlFileName) > 0:
-            mtlFileName = os.path.join(os.path.split(bandFileNames[0])[0],
-                                        mtlFileName)
-            mtlFileLines = [line.strip() for line in self.read_vsi(mtlFileName).split('\n')]
+            if mtlContent is None:
+                mtlFileName = os.path.join(os.path.split(bandFileNames[0])[0],
+                                            mtlFileName)
+                mtlContent = self.read_vsi(mtlFileName)
+            mtlFileLines = [line.strip() for line in mtlContent.split('\n')]
             dateString = [line.split('=')[1].strip()
                           for line in mtlFileLines
                             if ('DATE_ACQUIRED' in line or
@@ -16,8 +16,11 @@ import pythesint as pti
 class Mapper(VRT, Envisat):
     ''' VRT with mapping of WKV for MERIS Level 1 (FR or RR) '''
 
+    # all results of the mapper are in the VRT-files
+    CACHEABLE = True
+
     def __init__(self, filename, gdalDataset, gdalMetadata,
-                 geolocation=False, zoomSize=500, step=1, **kwargs):
+                 geolocation=False, zoomSize=500, step=1, metadata_only=False, **kwargs):
 
         ''' Create MER1 VRT
 
@@ -40,6 +43,9 @@ class Mapper(VRT, Envisat):
             step of pixel and line in GeolocationArrays. lat/lon grids are
             generated at that step
 
+        metadata_only : bool (default is False)
+            if True, bands from ADS and geolocation arrays are not added
+
         '''
 
         self.setup_ads_parameters(filename, gdalMetadata)
@@ -115,23 +121,24 @@ class Mapper(VRT, Envisat):
         for i, bandDict in enumerate(metaDict[:-1]):
             bandDict['src']['ScaleRatio'] = str(scales[i])
 
-        # get list with resized VRTs from ADS
-        self.band_vrts = {'adsVRTs': self.get_ads_vrts(gdalDataset,
-                                                     ['sun zenith angles',
-                                                      'sun azimuth angles',
-                                                      'zonal winds',
-                                                      'meridional winds'],
-                                                     zoomSize=zoomSize,
-                                                     step=step)}
-        # add bands from the ADS VRTs
-        for adsVRT in self.band_vrts['adsVRTs']:
-            metaDict.append({'src': {'SourceFilename': adsVRT.filename,
-                                     'SourceBand': 1},
-                             'dst': {'name': (adsVRT.dataset.GetRasterBand(1).
-                                              GetMetadataItem('name')),
-                                     'units': (adsVRT.dataset.GetRasterBand(1).
-                                               GetMetadataItem('units'))}
-                             })
+        # get list with resized VRTs from ADS (skipped in the metadata only mode)
+        if not metadata_only:
+            self.band_vrts = {'adsVRTs': self.get_ads_vrts(gdalDataset,
+                                                         ['sun zenith angles',
+                                                          'sun azimuth angles',
+                                                          'zonal winds',
+                                                          'meridional winds'],
+                                                         zoomSize=zoomSize,
+                                                         step=step)}
+            # add bands from the ADS VRTs
+            for adsVRT in self.band_vrts['adsVRTs']:
+                metaDict.append({'src': {'SourceFilename': adsVRT.filename,
+                                         'SourceBand': 1},
+                                 'dst': {'name': (adsVRT.dataset.GetRasterBand(1).
+                                                  GetMetadataItem('name')),
+                                         'units': (adsVRT.dataset.GetRasterBand(1).
+                                                   GetMetadataItem('units'))}
+                                 })
 
         # add bands with metadata and corresponding values to the empty VRT
         self.create_bands(metaDict)
@@ -151,6 +158,6 @@ class Mapper(VRT, Envisat):
         self.dataset.SetMetadataItem('platform', json.dumps(ee))
 
         # add geolocation arrays
-        if geolocation:
+        if geolocation and not metadata_only:
             self.add_geolocation_from_ads(gdalDataset,
                                           zoomSize=zoomSize, step=step)
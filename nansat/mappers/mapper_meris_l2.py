@@ -14,8 +14,11 @@ from envisat import Envisat
 class Mapper(VRT, Envisat):
     ''' Create VRT with mapping of WKV for MERIS Level 2 (FR or RR)'''
 
+    # all results of the mapper are in the VRT-files
+    CACHEABLE = True
+
     def __init__(self, filename, gdalDataset, gdalMetadata,
-                 geolocation=False, zoomSize=500, step=1, **kwargs):
+                 geolocation=False, zoomSize=500, step=1, metadata_only=False, **kwargs):
 
         ''' Create MER2 VRT
 
@@ -32,6 +35,8 @@ class Mapper(VRT, Envisat):
         step: int (used in envisat.py)
             step of pixel and line in GeolocationArrays. lat/lon grids are
             generated at that step
+        metadata_only : bool (default is False)
+            if True, bands from ADS and geolocation arrays are not added
         '''
 
         self.setup_ads_parameters(filename, gdalMetadata)
@@ -126,24 +131,25 @@ class Mapper(VRT, Envisat):
                               'expression': 'np.power(10., self["tsm_2_log"])'}}
                      ]
 
-        # get list with resized VRTs from ADS
-        self.band_vrts = {'adsVRTs': self.get_ads_vrts(gdalDataset,
-                                                     ['sun zenith angles',
-                                                      'sun azimuth angles',
-                                                      'zonal winds',
-                                                      'meridional winds'],
-                                                     zoomSize=zoomSize,
-                                                     step=step)}
-
-        # add bands from the ADS VRTs
-        for adsVRT in self.band_vrts['adsVRTs']:
-            metaDict.append({'src': {'SourceFilename': adsVRT.filename,
-                                     'SourceBand': 1},
-                             'dst': {'name': (adsVRT.dataset.GetRasterBand(1).
-                                              GetMetadataItem('name')),
-                                     'units': (adsVRT.dataset.GetRasterBand(1).
-                                               GetMetadataItem('units'))}
-                             })
+        # get list with resized VRTs from ADS (skipped in the metadata only mode)
+        if not metadata_only:
+            self.band_vrts = {'adsVRTs': self.get_ads_vrts(gdalDataset,
+                                                         ['sun zenith angles',
+                                                          'sun azimuth angles',
+                                                          'zonal winds',
+                                                          'meridional winds'],
+                                                         zoomSize=zoomSize,
+                                                         step=step)}
+
+            # add bands from the ADS VRTs
+            for adsVRT in self.band_vrts['adsVRTs']:
+                metaDict.append({'src': {'SourceFilename': adsVRT.filename,
+                                         'SourceBand': 1},
+                                 'dst': {'name': (adsVRT.dataset.GetRasterBand(1).
+                                                  GetMetadataItem('name')),
+                                         'units': (adsVRT.dataset.GetRasterBand(1).
+                                                   GetMetadataItem('units'))}
+                                 })
 
         # create empty VRT dataset with geolocation only
         self._init_from_gdal_dataset(gdalDataset)
@@ -155,7 +161,7 @@ class Mapper(VRT, Envisat):
         self._set_envisat_time(gdalMetadata)
 
         # add geolocation arrays
-        if geolocation:
+        if geolocation and not metadata_only:
             self.add_geolocation_from_ads(gdalDataset,
                                           zoomSize=zoomSize, step=step)
         # set time
@@ -4,7 +4,8 @@
     http://cfconventions.org/compliance-checker.html
 '''
 
-import warnings, os, datetime
+import warnings, os, datetime, itertools
+from collections import OrderedDict
 import numpy as np
 import gdal
 
@@ -21,6 +22,21 @@ from nansat.exceptions import WrongMapperError, NansatMissingProjectionError
 class Mapper(VRT):
     """
     """
+    # netCDF4.Dataset of the input file (see Mapper.ds)
+    _ds = None
+    # cached name of time variable, (epoch, units) and decoded times
+    _time_var_name = None
+    _time_units_cache = None
+    _times = None
+
+    # layout of variables for the lazy mode (see Mapper._get_dimension_layout) and
+    # numbers of bands created for slices {(subdataset filename, GDAL band): VRT band}
+    dimension_layout = None
+    _slice_bands = None
+
+    # CF time units: numpy timedelta64 unit and factor for conversion (None - truncation)
+    TIME_UNITS = [('second', 'us', 1e6), ('minute', 'us', 6e7), ('hour', 'h', None),
+                  ('day', 'D', None)]
 
     def __init__(self, filename, gdal_dataset, gdal_metadata, *args, **kwargs):
 
@@ -28,6 +44,8 @@ class Mapper(VRT):
             raise WrongMapperError
 
         self.input_filename = filename
+        metadata_only = kwargs.pop('metadata_only', False)
+        lazy = kwargs.pop('lazy', False)
 
         if not gdal_metadata:
             raise WrongMapperError
@@ -63,84 +81,235 @@ class Mapper(VRT):
         self._create_empty(gdal_dataset, metadata)
 
         # Add bands with metadata and corresponding values to the empty VRT
-        self.create_bands(self._band_list(gdal_dataset, metadata, *args, **kwargs))
+        if lazy:
+            # only layout of dimensions is read, bands are created for 2D variables or
+            # for slices selected in netcdf_dim (other slices are added by select_bands)
+            self._create_lazy_bands(gdal_dataset, *args, **kwargs)
+        else:
+            self.create_bands(self._band_list(gdal_dataset, metadata, *args, **kwargs))
 
         # Check size?
         #xsize, ysize = self.ds_size(sub0)
 
         # Create complex bands from *_real and *_imag bands (the function is in
-        # vrt.py)
-        self._create_complex_bands(self._get_sub_filenames(gdal_dataset))
+        # vrt.py). Derived bands are not created in the metadata only mode.
+        if not metadata_only:
+            self._create_complex_bands(self._get_sub_filenames(gdal_dataset))
 
         # Set GCMD/DIF compatible metadata if available
         self._set_time_coverage_metadata(metadata)
 
         # Then add remaining GCMD/DIF compatible metadata in inheriting mappers
 
+    @property
+    def ds(self):
+        ''' netCDF4.Dataset of the input file, opened once and shared by all methods '''
+        if self._ds is None:
+            self._ds = Dataset(self.input_filename)
+        return self._ds
+
+    def __del__(self):
+        if self._ds is not None:
+            self._ds.close()
+            self._ds = None
+        super(Mapper, self).__del__()
+
     def times(self):
         ''' Get times from time variable
 
         NOTE: This cannot be done with gdal because the time variable is a
-        vector
+        vector. All values are decoded at once and cached in the mapper.
 
         '''
-        ds = Dataset(self.input_filename)
-
-        # Get datetime object of epoch and time_units string
-        time_units = self._time_units(ds=ds)
-
-        # Get all times - consider caching to save time (see
-        # nansat/mappers/opendap.py)
-        times = ds.variables[self._timevarname(ds=ds)]
-
-        # Create numpy array of np.datetime64 times (provide epoch to save time)
-        tt = np.array([self._time_count_to_np_datetime64(tn,
-            time_units=time_units) for tn in times])
-
-        return tt
+        if self._times is None:
+            time_counts = self.ds.variables[self._timevarname()][:]
+            self._times = self._time_counts_to_np_datetime64(time_counts)
+        return self._times
 
     def _time_units(self, ds=None):
-        if not ds:
-            ds = Dataset(self.input_filename)
-        times = ds.variables[self._timevarname(ds=ds)]
-        rt = parse(times.units, fuzzy=True) # This sets timezone to local
-        # Remove timezone information from epoch, which defaults to
-        # utc (otherwise the timezone should be given in the dataset)
-        epoch = datetime.datetime(rt.year, rt.month, rt.day, rt.hour,
-                rt.minute, rt.second)
-        return epoch, times.units
+        if self._time_units_cache is None:
+            if not ds:
+                ds = self.ds
+            times = ds.variables[self._timevarname(ds=ds)]
+            rt = parse(times.units, fuzzy=True) # This sets timezone to local
+            # Remove timezone information from epoch, which defaults to
+            # utc (otherwise the timezone should be given in the dataset)
+            epoch = datetime.datetime(rt.year, rt.month, rt.day, rt.hour,
+                    rt.minute, rt.second)
+            self._time_units_cache = epoch, times.units
+        return self._time_units_cache
 
     def _timevarname(self, ds=None):
-        if not ds:
-            ds = Dataset(self.input_filename)
-        timevarname = 'time'
-        try:
-            ncvar = ds.variables[timevarname]
-        except KeyError:
-            for var in ds.variables:
-                try:
-                    standard_name = ds.variables[var].standard_name
-                except:
-                    continue
-                if standard_name=='time':
-                    timevarname = var
-                    break
-            ncvar = ds.variables[timevarname]
-        return timevarname
+        if self._time_var_name is None:
+            if not ds:
+                ds = self.ds
+            timevarname = 'time'
+            if timevarname not in ds.variables:
+                for var in ds.variables:
+                    try:
+                        standard_name = ds.variables[var].standard_name
+                    except:
+                        continue
+                    if standard_name=='time':
+                        timevarname = var
+                        break
+                # raise KeyError if no time variable is found
+                ncvar = ds.variables[timevarname]
+            self._time_var_name = timevarname
+        return self._time_var_name
+
+    def _time_counts_to_np_datetime64(self, time_counts, time_units=None):
+        ''' Convert time counts into np.datetime64 as epoch + counts * unit in one operation
+
+        Seconds and minutes are rounded to microseconds, hours and days are truncated to
+        integers (as in datetime.timedelta(hours=int(count))).
 
-    def _time_count_to_np_datetime64(self, time_count, time_units=None):
+        '''
         if not time_units:
             time_units = self._time_units()
-        if 'second' in time_units[1]:
-            tt = np.datetime64(time_units[0] +
-                    datetime.timedelta(seconds=float(time_count)))
-        elif 'hour' in time_units[1]:
-            tt = np.datetime64(time_units[0] + datetime.timedelta(hours=int(time_count)))
-        elif 'day' in time_units[1]:
-            tt = np.datetime64(time_units[0] + datetime.timedelta(days=int(time_count)))
+        for unit_name, np_unit, factor in self.TIME_UNITS:
+            if unit_name in time_units[1]:
+                break
         else:
             raise Exception('Check time units..')
-        return tt
+        counts = np.asarray(time_counts, dtype=np.float64)
+        if factor is None:
+            counts = np.trunc(counts)
+        else:
+            counts = np.round(counts * factor)
+        return (np.datetime64(time_units[0], 'us') +
+                counts.astype(np.int64).astype('timedelta64[%s]' % np_unit))
+
+    def _time_count_to_np_datetime64(self, time_count, time_units=None):
+        return self._time_counts_to_np_datetime64([float(time_count)], time_units)[0]
+
+    def _get_dimension_layout(self, gdal_dataset):
+        ''' Get names and sizes of non-spatial dimensions of all variables
+
+        Only the netCDF header is read (with netCDF4), subdatasets are not opened.
+
+        Returns
+        -------
+        layout : OrderedDict
+            for each variable: 'filename' (name of the GDAL subdataset), 'dimensions' and
+            'shape' (names and sizes of dimensions except the last two, i.e. y and x) and
+            'standard_name'
+
+        '''
+        layout = OrderedDict()
+        for fn in self._get_sub_filenames(gdal_dataset):
+            if ('GEOLOCATION_X_DATASET' in fn or 'longitude' in fn or
+                    'GEOLOCATION_Y_DATASET' in fn or 'latitude' in fn):
+                continue
+            var_name = fn.split(':')[-1]
+            if var_name not in self.ds.variables:
+                continue
+            var = self.ds.variables[var_name]
+            layout[var_name] = {
+                'filename': fn,
+                'dimensions': list(var.dimensions[:-2]),
+                'shape': list(var.shape[:-2]),
+                'standard_name': getattr(var, 'standard_name', None),
+            }
+        return layout
+
+    def _get_dimension_indices(self, dim_name, values):
+        ''' Get indices of <values> along the dimension <dim_name>
+
+        np.datetime64 values select the nearest time, other values are compared with the
+        coordinate variable of the dimension (or with indices if it does not exist). ValueError
+        is raised if a value does not match any coordinate (or index).
+
+        '''
+        indices = []
+        for value in np.atleast_1d(values):
+            if isinstance(value, np.datetime64):
+                value_indices = [int(np.argmin(np.abs(self.times() - value)))]
+            elif dim_name in self.ds.variables:
+                coordinates = self.ds.variables[dim_name][:]
+                value_indices = np.nonzero(np.isclose(coordinates, float(value)))[0].tolist()
+            elif 0 <= int(value) < len(self.ds.dimensions[dim_name]):
+                value_indices = [int(value)]
+            else:
+                value_indices = []
+            if not value_indices:
+                raise ValueError('%s does not match any value of dimension %s'
+                                 % (value, dim_name))
+            indices += value_indices
+        return indices
+
+    def _create_lazy_bands(self, gdal_dataset, netcdf_dim=None, bands=None):
+        ''' Read layout of dimensions and create bands for 2D variables or selected slices '''
+        self.dimension_layout = self._get_dimension_layout(gdal_dataset)
+        self._slice_bands = {}
+        if netcdf_dim:
+            self.select_bands(netcdf_dim, bands)
+        else:
+            self.select_bands(bands=bands, variables=[
+                var_name for var_name in self.dimension_layout
+                if not self.dimension_layout[var_name]['dimensions']])
+
+    def select_bands(self, netcdf_dim=None, bands=None, variables=None):
+        ''' Create bands for slices of multi-dimensional variables (only in lazy mode)
+
+        Band numbers of the slices in the subdatasets are computed from the dimension layout,
+        so only the selected bands are opened and created. Bands which already exist are not
+        created again.
+
+        Parameters
+        ----------
+        netcdf_dim : dict
+            values of dimensions to select, e.g. {'time': np.datetime64('2010-01-01'),
+            'depth': [0, 10]}. Values may be scalars or lists. All slices are selected along
+            dimensions which are not given. Given dimensions are ignored for variables which
+            do not have them (e.g. 2D variables are always selected).
+        bands : list
+            standard names of variables to select
+        variables : list
+            names of variables to select
+
+        Returns
+        -------
+        band_numbers : list of int
+            numbers of VRT bands with the selected slices
+
+        '''
+        if self.dimension_layout is None:
+            raise ValueError('Bands can be selected only if the file is opened with lazy=True')
+        if netcdf_dim is None:
+            netcdf_dim = {}
+        # indices along the given dimensions (dimensions not in the file are ignored)
+        dimensions = set(dim_name for layout in self.dimension_layout.values()
+                         for dim_name in layout['dimensions'])
+        selected_indices = dict([(dim_name, self._get_dimension_indices(dim_name, values))
+                                 for dim_name, values in netcdf_dim.items()
+                                 if dim_name in dimensions])
+        band_numbers = []
+        for var_name, layout in self.dimension_layout.items():
+            if variables is not None and var_name not in variables:
+                continue
+            if bands and layout['standard_name'] not in bands:
+                continue
+            dim_indices = [selected_indices.get(dim_name, range(dim_size))
+                           for dim_name, dim_size in zip(layout['dimensions'], layout['shape'])]
+            subds = None
+            for index in itertools.product(*dim_indices):
+                # bands in GDAL subdatasets follow C-order of the non-spatial dimensions
+                band_num = 1
+                if index:
+                    band_num += int(np.ravel_multi_index(index, layout['shape']))
+                key = (layout['filename'], band_num)
+                if key not in self._slice_bands:
+                    if subds is None:
+                        subds = gdal.Open(layout['filename'])
+                    bdict = self._band_dict(layout['filename'], band_num, subds)
+                    if not bdict:
+                        continue
+                    self.create_band(bdict['src'], bdict['dst'])
+                    self._slice_bands[key] = self.dataset.RasterCount
+                band_numbers.append(self._slice_bands[key])
+        self.dataset.FlushCache()
+        return band_numbers
 
     def _band_list(self, gdal_dataset, gdal_metadata, netcdf_dim={}, bands=[]):
         ''' Create list of dictionaries mapping source and destination metadata
@@ -172,7 +341,7 @@ class Mapper(VRT):
             pass
 
         metadictlist = []
-        ds = Dataset(self.input_filename)
+        ds = self.ds
         # Pop netcdf_dim item if the dimension is not in the dimension
         # list of the given dataset
         kpop = []
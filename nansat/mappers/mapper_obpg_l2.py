@@ -26,6 +26,9 @@ class Mapper(OBPGL2BaseClass):
     * Test on MODIS Terra
     '''
 
+    # all results of the mapper are in the VRT-files
+    CACHEABLE = True
+
     def __init__(self, filename, gdalDataset, gdalMetadata,
                  GCP_COUNT=10, **kwargs):
         ''' Create VRT
@@ -6,19 +6,12 @@
 #               http://www.gnu.org/licenses/gpl-3.0.html
 from __future__ import unicode_literals, division, absolute_import
 import os
-import tarfile
 import zipfile
 from dateutil.parser import parse
 from math import asin
 
 import json
 import numpy as np
-try:
-    import scipy.ndimage
-except:
-    IMPORT_SCIPY = False
-else:
-    IMPORT_SCIPY = True
 
 import pythesint as pti
 
@@ -27,21 +20,40 @@ from nansat.vrt import VRT
 from nansat.domain import Domain
 from nansat.node import Node
 from nansat.tools import initial_bearing, gdal, ogr
-from nansat.exceptions import WrongMapperError, NansatReadError
+from nansat.mappers.archives import get_archive_index
+from nansat.exceptions import WrongMapperError
 
 
 class Mapper(VRT):
     ''' Create VRT with mapping of WKV for Radarsat2 '''
 
+    # all results of the mapper are in the VRT-files
+    CACHEABLE = True
+
     def __init__(self, inputFileName, gdalDataset, gdalMetadata,
-                 xmlonly=False,  **kwargs):
-        ''' Create Radarsat2 VRT '''
+                 xmlonly=False, metadata_only=False, **kwargs):
+        ''' Create Radarsat2 VRT
+
+        Parameters
+        ----------
+        xmlonly : bool
+            if True, only georeference and metadata are read from product.xml (no bands)
+        metadata_only : bool
+            if True, only sigma0 bands are added (look direction, incidence angle
+            and sigma0_VV are not computed)
+
+        '''
         fPathName, fExt = os.path.splitext(inputFileName)
 
+        # index of files in zip archive (None for directory)
+        archive = None
         if zipfile.is_zipfile(inputFileName):
+            archive = get_archive_index(inputFileName)
+
+        if archive is not None:
             # Open zip file using VSI
             fPath, fName = os.path.split(fPathName)
-            filename = '/vsizip/%s/%s' % (inputFileName, fName)
+            filename = archive.vsi_path(fName)
             if not 'RS' in fName[0:2]:
                 raise WrongMapperError('%s: Provided data is not Radarsat-2'
                         %fName)
@@ -56,11 +68,10 @@ class Mapper(VRT):
         elif gdalMetadata['SATELLITE_IDENTIFIER'] != 'RADARSAT-2':
             raise WrongMapperError(filename)
 
-        if zipfile.is_zipfile(inputFileName):
+        if archive is not None:
             # Open product.xml to get additional metadata
-            zz = zipfile.ZipFile(inputFileName)
             productXmlName = os.path.join(os.path.basename(inputFileName).split('.')[0],'product.xml')
-            productXml = zz.open(productXmlName).read()
+            productXml = archive.read(productXmlName)
         else:
             # product.xml to get additionali metadata
             productXmlName = os.path.join(filename,'product.xml')
@@ -68,9 +79,6 @@ class Mapper(VRT):
                 raise WrongMapperError(filename)
             productXml = open(productXmlName).read()
 
-        if not IMPORT_SCIPY:
-            raise NansatReadError('Radarsat-2 data cannot be read because scipy is not installed')
-
         # parse product.XML
         rs2_0 = Node.create(productXml)
 
@@ -145,6 +153,12 @@ class Mapper(VRT):
                     if polString == s0datasetPol:
                         b0datasetBand = j
 
+        # add only sigma0 bands in the metadata only mode and RETURN
+        if metadata_only:
+            self.create_bands(metaDict)
+            self._set_sar_metadata(gdalMetadata, antennaPointing, passDirection)
+            return
+
         ###############################
         # Add SAR look direction
         ###############################
@@ -173,36 +187,25 @@ class Mapper(VRT):
 
         # Calculate SAR look direction
         look_direction = sat_heading + antennaPointing
-        # Interpolate to regain lost row
-        look_direction = np.mod(look_direction, 360)
-        look_direction = scipy.ndimage.interpolation.zoom(
-            look_direction, (1, 11./10.))
+        # Repeat the last column to regain lost column
+        look_direction = np.mod(np.hstack([look_direction, look_direction[:, -1:]]), 360)
         # Decompose, to avoid interpolation errors around 0 <-> 360
         look_direction_u = np.sin(np.deg2rad(look_direction))
         look_direction_v = np.cos(np.deg2rad(look_direction))
-        look_u_VRT = VRT.from_array(look_direction_u)
-        look_v_VRT = VRT.from_array(look_direction_v)
-
-        # Note: If incidence angle and look direction are stored in
-        #       same VRT, access time is about twice as large
-        lookVRT = VRT.from_lonlat(lon, lat)
-        lookVRT.create_band(
-            [{'SourceFilename': look_u_VRT.filename, 'SourceBand': 1},
-             {'SourceFilename': look_v_VRT.filename, 'SourceBand': 1}],
-            {'PixelFunctionType': 'UVToDirectionTo'})
-
-        # Blow up to full size
-        lookVRT = lookVRT.get_resized_vrt(gdalDataset.RasterXSize, gdalDataset.RasterYSize)
-        # Store VRTs so that they are accessible later
-        self.band_vrts['look_u_VRT'] = look_u_VRT
-        self.band_vrts['look_v_VRT'] = look_v_VRT
-        self.band_vrts['lookVRT'] = lookVRT
+
+        # Components are resampled to full size by GDAL only when the band is read
+        self.band_vrts['look_u_VRT'] = VRT.from_array(look_direction_u).get_resampled_vrt(
+            gdalDataset.RasterXSize, gdalDataset.RasterYSize)
+        self.band_vrts['look_v_VRT'] = VRT.from_array(look_direction_v).get_resampled_vrt(
+            gdalDataset.RasterXSize, gdalDataset.RasterYSize)
 
         # Add band to full sized VRT
-        lookFileName = self.band_vrts['lookVRT'].filename
-        metaDict.append({'src': {'SourceFilename': lookFileName,
-                                 'SourceBand': 1},
+        metaDict.append({'src': [{'SourceFilename': self.band_vrts['look_u_VRT'].filename,
+                                  'SourceBand': 1},
+                                 {'SourceFilename': self.band_vrts['look_v_VRT'].filename,
+                                  'SourceBand': 1}],
                          'dst': {'wkv': 'sensor_azimuth_angle',
+                                 'PixelFunctionType': 'UVToDirectionTo',
                                  'name': 'look_direction'}})
 
         ###############################
@@ -252,6 +255,10 @@ class Mapper(VRT):
             self.create_band(src, dst)
             self.dataset.FlushCache()
 
+        self._set_sar_metadata(gdalMetadata, antennaPointing, passDirection)
+
+    def _set_sar_metadata(self, gdalMetadata, antennaPointing, passDirection):
+        ''' Set antenna pointing, orbit direction, time, instrument and platform metadata '''
         ############################################
         # Add SAR metadata
         ############################################
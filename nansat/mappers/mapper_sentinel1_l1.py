@@ -17,22 +17,18 @@ import numpy as np
 from dateutil.parser import parse
 import xml.etree.ElementTree as ET
 
-try:
-    import scipy
-except:
-    IMPORT_SCIPY = False
-else:
-    IMPORT_SCIPY = True
-
 import json
+
 import pythesint as pti
 
 from nansat.vrt import VRT
 from nansat.tools import gdal, initial_bearing
 from nansat.warnings import NansatFutureWarning
-from nansat.exceptions import WrongMapperError, NansatReadError
+from nansat.exceptions import WrongMapperError
 from nansat.nsr import NSR
 from nansat.node import Node
+from nansat.mappers.archives import get_archive_index
+from nansat.mappers.sentinel1 import read_lut, LUTInterpolator
 
 
 class Mapper(VRT):
@@ -49,12 +45,22 @@ class Mapper(VRT):
         If True, no bands are added to the dataset and georeference is not corrected.
         If False, all bands are added and GCPs are corrected if necessary
         (see Mapper.correct_geolocation_data for details).
+    metadata_only : bool
+        If True, only bands with digital numbers are added, calibration and noise LUTs and
+        angles are not read and georeference is not corrected.
 
     Note
     ----
     Creates self.dataset and populates it with S1 bands (when fast=False).
+    Calibration and noise LUTs can be evaluated in any window with Mapper.get_lut().
     """
-    def __init__(self, filename, gdalDataset, gdalMetadata, fast=False, fixgcp=True, **kwargs):
+    # results of the mapper and LUTs (see Mapper._get_cache_state) can be cached
+    CACHEABLE = True
+    # interpolators of calibration and noise LUTs (keys: e.g. 'sigmaNought_HH')
+    luts = None
+
+    def __init__(self, filename, gdalDataset, gdalMetadata, fast=False, fixgcp=True,
+                 metadata_only=False, **kwargs):
         if kwargs.get('manifestonly', False):
             fast = True
             NansatFutureWarning('manifestonly option will be deprecated. Use: fast=True')
@@ -62,30 +68,18 @@ class Mapper(VRT):
         if not os.path.split(filename.rstrip('/'))[1][:3] in ['S1A', 'S1B']:
             raise WrongMapperError('%s: Not Sentinel 1A or 1B' %filename)
 
-        if not IMPORT_SCIPY:
-            raise NansatReadError('Sentinel-1 data cannot be read because scipy is not installed')
-
         if zipfile.is_zipfile(filename):
-            zz = zipfile.PyZipFile(filename)
+            # list of files in the archive is read once
+            archive = get_archive_index(filename)
             # Assuming the file names are consistent, the polarization
             # dependent data should be sorted equally such that we can use the
             # same indices consistently for all the following lists
             # THIS IS NOT THE CASE...
-            mds_files = ['/vsizip/%s/%s' % (filename, fn)
-                        for fn in zz.namelist() if 'measurement/s1' in fn]
-            calibration_files = ['/vsizip/%s/%s' % (filename, fn)
-                        for fn in zz.namelist()
-                        if 'annotation/calibration/calibration-s1' in fn]
-            noise_files = ['/vsizip/%s/%s' % (filename, fn)
-                          for fn in zz.namelist()
-                          if 'annotation/calibration/noise-s1' in fn]
-            annotation_files = ['/vsizip/%s/%s' % (filename, fn)
-                               for fn in zz.namelist()
-                               if 'annotation/s1' in fn]
-            manifest_files = ['/vsizip/%s/%s' % (filename, fn)
-                            for fn in zz.namelist()
-                            if 'manifest.safe' in fn]
-            zz.close()
+            mds_files = archive.vsi_paths('*measurement/s1*')
+            calibration_files = archive.vsi_paths('*annotation/calibration/calibration-s1*')
+            noise_files = archive.vsi_paths('*annotation/calibration/noise-s1*')
+            annotation_files = archive.vsi_paths('*annotation/s1*')
+            manifest_files = archive.vsi_paths('*manifest.safe*')
         else:
             mds_files = glob.glob('%s/measurement/s1*' % filename)
             calibration_files = glob.glob('%s/annotation/calibration/calibration-s1*'
@@ -106,7 +100,7 @@ class Mapper(VRT):
 
         # read annotation files
         self.annotation_data = self.read_annotation(annotation_files)
-        if not fast and fixgcp:
+        if not fast and not metadata_only and fixgcp:
             self.correct_geolocation_data()
 
         # read manifest file
@@ -130,35 +124,6 @@ class Mapper(VRT):
         # Check metadata to confirm it is Sentinel-1 L1
         metadata = gdalDatasets[polarizations[0]].GetMetadata()
 
-        # create full size VRTs with incidenceAngle and elevationAngle
-        annotation_vrts = self.vrts_from_arrays(self.annotation_data,
-                                                ['incidenceAngle', 'elevationAngle'])
-        self.band_vrts.update(annotation_vrts)
-
-        # create full size VRTS with calibration LUT
-        calibration_names = ['sigmaNought', 'betaNought']
-        calibration_list_tag = 'calibrationVectorList'
-        for calibration_file in calibration_files:
-            pol = '_' + os.path.basename(calibration_file).split('-')[4].upper()
-            xml = self.read_vsi(calibration_file)
-            calibration_data = self.read_calibration(xml, calibration_list_tag, calibration_names, pol)
-            calibration_vrts = self.vrts_from_arrays(calibration_data, calibration_names, pol, True, 1)
-            self.band_vrts.update(calibration_vrts)
-
-        # create full size VRTS with noise LUT
-        for noise_file in noise_files:
-            pol = '_' + os.path.basename(noise_file).split('-')[4].upper()
-            xml = self.read_vsi(noise_file)
-            if '<noiseVectorList' in xml:
-                noise_list_tag = 'noiseVectorList'
-                noise_name = 'noiseLut'
-            elif '<noiseRangeVectorList' in xml:
-                noise_list_tag = 'noiseRangeVectorList'
-                noise_name = 'noiseRangeLut'
-            noise_data = self.read_calibration(xml, noise_list_tag, [noise_name], pol)
-            noise_vrts = self.vrts_from_arrays(noise_data, [noise_name], pol, True, 1)
-            self.band_vrts.update(noise_vrts)
-
         #### Create metaDict: dict with metadata for all bands
         metaDict = []
         bandNumberDict = {}
@@ -189,6 +154,31 @@ class Mapper(VRT):
         # add bands with metadata and corresponding values to the empty VRT
         self.create_bands(metaDict)
 
+        # skip calibration, noise and angles in the metadata only mode and RETURN
+        if metadata_only:
+            return
+
+        # create full size VRTs with incidenceAngle and elevationAngle
+        annotation_vrts = self.vrts_from_arrays(self.annotation_data,
+                                                ['incidenceAngle', 'elevationAngle'])
+        self.band_vrts.update(annotation_vrts)
+
+        # read calibration and noise LUTs. Each LUT is kept as a small VRT with values on a
+        # regular grid which GDAL interpolates only in the window which is read
+        self.luts = {}
+        for lut_file in calibration_files + noise_files:
+            data = self.read_lut_file(lut_file)
+            pol = data['pol']
+            if 'sigmaNought' + pol in data:
+                calibration_data = data
+            else:
+                noise_name = data['variable_names'][0]
+            for var_name in data['variable_names']:
+                self.luts[var_name + pol] = data['interpolators'][var_name]
+                self.band_vrts[var_name + pol] = VRT.from_array(
+                    self.luts[var_name + pol].get_regular_grid(self.dataset.RasterXSize,
+                                                               self.dataset.RasterYSize))
+
         '''
         Calibration should be performed as
 
@@ -217,30 +207,18 @@ class Mapper(VRT):
                                       latitude[:-1, :],
                                       longitude[1:, :],
                                       latitude[1:, :])
-        look_direction = scipy.ndimage.interpolation.zoom(
-            np.mod(sat_heading + 90, 360),
-            (np.shape(longitude)[0] / (np.shape(longitude)[0]-1.), 1))
+        # repeat the last row to regain lost row
+        look_direction = np.mod(np.vstack([sat_heading, sat_heading[-1:]]) + 90, 360)
 
         # Decompose, to avoid interpolation errors around 0 <-> 360
         look_direction_u = np.sin(np.deg2rad(look_direction))
         look_direction_v = np.cos(np.deg2rad(look_direction))
-        look_u_VRT = VRT.from_array(look_direction_u)
-        look_v_VRT = VRT.from_array(look_direction_v)
-        lookVRT = VRT.from_lonlat(longitude, latitude)
-        lookVRT.create_band([{'SourceFilename': look_u_VRT.filename,
-                               'SourceBand': 1},
-                              {'SourceFilename': look_v_VRT.filename,
-                               'SourceBand': 1}],
-                             {'PixelFunctionType': 'UVToDirectionTo'}
-                             )
-
-        # Blow up to full size
-        lookVRT = lookVRT.get_resized_vrt(self.dataset.RasterXSize, self.dataset.RasterYSize, 1)
-
-        # Store VRTs so that they are accessible later
-        self.band_vrts['look_u_VRT'] = look_u_VRT
-        self.band_vrts['look_v_VRT'] = look_v_VRT
-        self.band_vrts['lookVRT'] = lookVRT
+
+        # Components are resampled to full size by GDAL only when the band is read
+        self.band_vrts['look_u_VRT'] = VRT.from_array(look_direction_u).get_resampled_vrt(
+            self.dataset.RasterXSize, self.dataset.RasterYSize, 1)
+        self.band_vrts['look_v_VRT'] = VRT.from_array(look_direction_v).get_resampled_vrt(
+            self.dataset.RasterXSize, self.dataset.RasterYSize, 1)
 
         metaDict = []
         # Add bands to full size VRT
@@ -249,10 +227,7 @@ class Mapper(VRT):
             bandNumberDict[name] = bnmax+1
             bnmax = bandNumberDict[name]
             metaDict.append(
-                {'src': {'SourceFilename':
-                         (self.band_vrts[name].filename),
-                         'SourceBand': 1
-                         },
+                {'src': self._get_lut_source(name),
                  'dst': {'name': name
                          }
                  })
@@ -260,10 +235,7 @@ class Mapper(VRT):
             bandNumberDict[name] = bnmax+1
             bnmax = bandNumberDict[name]
             metaDict.append({
-                'src': {
-                    'SourceFilename': self.band_vrts['%s_%s' % (noise_name, pol)].filename,
-                    'SourceBand': 1
-                },
+                'src': self._get_lut_source('%s_%s' % (noise_name, pol)),
                 'dst': {
                     'name': name
                 }
@@ -273,12 +245,16 @@ class Mapper(VRT):
         bandNumberDict[name] = bnmax+1
         bnmax = bandNumberDict[name]
         metaDict.append({
-            'src': {
-                'SourceFilename': self.band_vrts['lookVRT'].filename,
+            'src': [{
+                'SourceFilename': self.band_vrts['look_u_VRT'].filename,
+                'SourceBand': 1
+            }, {
+                'SourceFilename': self.band_vrts['look_v_VRT'].filename,
                 'SourceBand': 1
-            },
+            }],
             'dst': {
                 'wkv': 'sensor_azimuth_angle',
+                'PixelFunctionType': 'UVToDirectionTo',
                 'name': name
             }
         })
@@ -292,9 +268,7 @@ class Mapper(VRT):
                 {'src': [{'SourceFilename': self.filename,
                           'SourceBand': bandNumberDict['DN_%s' % pol],
                           },
-                         {'SourceFilename': self.band_vrts['sigmaNought_%s' % pol].filename,
-                          'SourceBand': 1
-                          }
+                         self._get_lut_source('sigmaNought_%s' % pol)
                          ],
                  'dst': {'wkv': 'surface_backwards_scattering_coefficient_of_radar_wave',
                          'PixelFunctionType': 'Sentinel1Calibration',
@@ -309,9 +283,7 @@ class Mapper(VRT):
                 {'src': [{'SourceFilename': self.filename,
                           'SourceBand': bandNumberDict['DN_%s' % pol]
                           },
-                         {'SourceFilename': self.band_vrts['betaNought_%s' % pol].filename,
-                          'SourceBand': 1
-                          }
+                         self._get_lut_source('betaNought_%s' % pol)
                          ],
                  'dst': {'wkv': 'surface_backwards_brightness_coefficient_of_radar_wave',
                          'PixelFunctionType': 'Sentinel1Calibration',
@@ -352,10 +324,7 @@ class Mapper(VRT):
             src = [{'SourceFilename': self.filename,
                     'SourceBand': bandNumberDict['DN_HH'],
                     },
-                   {'SourceFilename': (self.band_vrts['sigmaNought_HH'].
-                                       filename),
-                    'SourceBand': 1,
-                    },
+                   self._get_lut_source('sigmaNought_HH'),
                    {'SourceFilename': self.band_vrts['incidenceAngle'].filename,
                     'SourceBand': 1}
                    ]
@@ -384,37 +353,110 @@ class Mapper(VRT):
         -------
         data : dict
             Calibration or noise data. Keys:
-            The same as variable_names + 'pixel', 'line'
+            The same as variable_names + 'pixel', 'line' (2D arrays), and
+            'interpolators' (dict with LUTInterpolator for each variable name)
         """
-        data = {}
-        n = Node.create(xml)
-        vecList = n.node(vectorListName)
-        data['pixel'] = []
-        data['line'] = []
+        lut = read_lut(xml, vectorListName, variable_names)
+        data = {'interpolators': {}}
         for var_name in variable_names:
-            data[var_name+pol] = []
-        xLengths = []
-        for vec in vecList.children:
-            xVec = list(map(int, vec['pixel'].split()))
-            xLengths.append(len(xVec))
-            data['pixel'].append(xVec)
-            data['line'].append(int(vec['line']))
-            for var_name in variable_names:
-                data[var_name+pol].append(np.fromiter(vec[var_name].split(), float))
+            data[var_name+pol] = lut[var_name]
+            data['interpolators'][var_name] = LUTInterpolator(lut['line'], lut['pixel'],
+                                                              lut[var_name])
+        data['pixel'], data['line'] = np.meshgrid(lut['pixel'], lut['line'])
 
-        # truncate data['pixel'] and var_name to minimum length for all rows
-        minLength = np.min(xLengths)
-        data['pixel'] = [x[:minLength] for x in data['pixel']]
-        for var_name in variable_names:
-            data[var_name+pol] = [d[:minLength] for d in data[var_name+pol]]
+        return data
 
-        data['pixel'] = np.array(data['pixel'])
-        for var_name in variable_names:
-            data[var_name+pol] = np.array(data[var_name+pol])
-        data['line'] = np.array([data['line'], ]*np.shape(data['pixel'])[1]).transpose()
+    def read_lut_file(self, filename):
+        """ Read calibration (sigmaNought, betaNought) or noise LUT from XML file
 
+        Parameters
+        ----------
+        filename : str
+            name of calibration or noise XML file
+
+        Returns
+        -------
+        data : dict
+            Output of Mapper.read_calibration and keys:
+            'pol' : str, suffix with polarization (e.g. '_HH')
+            'variable_names' : list of str, names of LUT variables
+
+        """
+        pol = '_' + os.path.basename(filename).split('-')[4].upper()
+        xml = self.read_vsi(filename)
+        if '<calibrationVectorList' in xml:
+            vector_list_name = 'calibrationVectorList'
+            variable_names = ['sigmaNought', 'betaNought']
+        elif '<noiseVectorList' in xml:
+            vector_list_name = 'noiseVectorList'
+            variable_names = ['noiseLut']
+        elif '<noiseRangeVectorList' in xml:
+            vector_list_name = 'noiseRangeVectorList'
+            variable_names = ['noiseRangeLut']
+        data = self.read_calibration(xml, vector_list_name, variable_names, pol)
+        data['pol'] = pol
+        data['variable_names'] = variable_names
         return data
 
+    def _get_lut_source(self, name):
+        """ Get source for a band which stretches small VRT with LUT <name> to full size
+
+        The LUT grid (see LUTInterpolator.get_regular_grid) is resampled bilinearly by GDAL from
+        the center of the first to the center of the last node, only in the window which is read.
+
+        """
+        lut_vrt = self.band_vrts[name]
+        return {'SourceFilename': lut_vrt.filename,
+                'SourceBand': 1,
+                'xOff': 0.5,
+                'yOff': 0.5,
+                'xSize': lut_vrt.dataset.RasterXSize - 1,
+                'ySize': lut_vrt.dataset.RasterYSize - 1,
+                'dstXSize': self.dataset.RasterXSize,
+                'dstYSize': self.dataset.RasterYSize,
+                'resampling': self.RESAMPLING_NAMES[1]}
+
+    def get_lut(self, name, x_off=0, y_off=0, x_size=None, y_size=None, step=1):
+        """ Evaluate calibration or noise LUT in a window of the image at full resolution
+
+        Parameters
+        ----------
+        name : str
+            name of LUT and polarization, e.g. 'sigmaNought_HH', 'betaNought_VV', 'noiseLut_HV'
+            or 'noiseRangeLut_HV'
+        x_off, y_off : int
+            offset of the window
+        x_size, y_size : int
+            size of the window. Full image by default.
+        step : int
+            step of pixels and lines in the window
+
+        Returns
+        -------
+        lut : 2D numpy.ndarray
+            values of the LUT in the window
+
+        """
+        if x_size is None:
+            x_size = self.dataset.RasterXSize - x_off
+        if y_size is None:
+            y_size = self.dataset.RasterYSize - y_off
+        return self.luts[name](x_off, y_off, x_size, y_size, step)
+
+    def _get_cache_state(self):
+        """ Get state of VRT with grids and values of LUTs (see VRT._get_cache_state) """
+        state = VRT._get_cache_state(self)
+        if self.luts is not None:
+            state['luts'] = dict([(name, self.luts[name].to_dict()) for name in self.luts])
+        return state
+
+    def _set_cache_state(self, state):
+        """ Restore state of VRT and LUT interpolators (see VRT._set_cache_state) """
+        VRT._set_cache_state(self, state)
+        if 'luts' in state:
+            self.luts = dict([(str(name), LUTInterpolator.from_dict(state['luts'][name]))
+                              for name in state['luts']])
+
     def read_annotation(self, annotation_files):
         """ Read lon, lat, etc from annotation XML
 
@@ -600,9 +642,9 @@ class Mapper(VRT):
         pol : str
             HH, HV, etc
         resize : bool
-            Shall VRT be zoomed to full size?
+            Shall VRT be zoomed to full size? Zooming is done by GDAL when the band is read.
         resample_alg : int
-            Index of resampling algorithm. See VRT.get_resized_vrt()
+            Index of resampling algorithm. See VRT.get_resampled_vrt()
 
         Returns:
         --------
@@ -613,7 +655,6 @@ class Mapper(VRT):
         for var_name in variable_names:
             vrts[var_name+pol] = VRT.from_array(data[var_name+pol])
             if resize:
-                vrts[var_name+pol] = vrts[var_name+pol].get_resized_vrt(self.dataset.RasterXSize,
-                                                                        self.dataset.RasterYSize,
-                                                                        resample_alg)
+                vrts[var_name+pol] = vrts[var_name+pol].get_resampled_vrt(
+                    self.dataset.RasterXSize, self.dataset.RasterYSize, resample_alg)
         return vrts
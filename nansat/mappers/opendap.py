@@ -8,12 +8,21 @@
 # http://cfconventions.org/wkt-proj-4.html
 
 import os
+import time
+import json
+import hashlib
+import tempfile
 import datetime
 from dateutil.parser import parse
 from time import sleep as time_sleep
 import warnings
 import numpy as np
 
+try:
+    from urllib.request import Request, urlopen
+except ImportError:
+    from urllib2 import Request, urlopen
+
 try:
     from netCDF4 import Dataset
 except ImportError:
@@ -39,6 +48,13 @@ class Opendap(VRT):
         'Y': 31536000,
         }
 
+    # time to live of the metadata cache [seconds]
+    cache_ttl = 24*60*60
+    # metadata of the dataset (see Opendap.get_metadata)
+    metadata = None
+    # netCDF4.Dataset, opened only if metadata is not cached or data is read
+    _ds = None
+
     ### TODOs:
     # add band metadata
 
@@ -65,37 +81,139 @@ class Opendap(VRT):
 
         return ds
 
+    @property
+    def ds(self):
+        ''' netCDF4.Dataset opened on first access '''
+        if self._ds is None:
+            self._ds = self.get_dataset(None)
+        return self._ds
+
+    @ds.setter
+    def ds(self, ds):
+        self._ds = ds
+
     def get_geospatial_variable_names(self):
         ''' Get names of variables with both spatial dimentions'''
         dsNames = []
-        for var in self.ds.variables:
-            if     (self.xName in self.ds.variables[var].dimensions and
-                    self.yName in self.ds.variables[var].dimensions):
+        for var, var_metadata in self.metadata['variables'].items():
+            if     (self.xName in var_metadata['dimensions'] and
+                    self.yName in var_metadata['dimensions']):
                 dsNames.append(var)
 
-        return dsNames
+        return sorted(dsNames)
 
     def get_dataset_time(self):
         ''' Load data from time variable '''
-        cachefile = ''
-        if (type(self.cachedir) in [str, unicode] and
-            os.path.isdir(self.cachedir)):
-            # do caching
-            cachefile = '%s_%s.npz' % (os.path.join(self.cachedir,
-                                       os.path.split(self.filename)[1]),
-                                       self.timeVarName)
-
-        if os.path.exists(cachefile):
-            dsTime = np.load(cachefile)[self.timeVarName]
-        else:
-            warnings.warn('Time consuming loading time from OpenDAP...')
-            dsTime = self.ds.variables[self.timeVarName][:]
-            warnings.warn('Loading time - OK!')
+        return self.metadata['time']
+
+    def get_last_modified(self):
+        ''' Get modification time of local file or Last-Modified header of URL (or '') '''
+        filename = self.filename
+        if filename.startswith('file://'):
+            filename = filename[7:]
+        if os.path.exists(filename):
+            return str(os.path.getmtime(filename))
+        request = Request(self.filename + '.dds')
+        request.get_method = lambda: 'HEAD'
+        try:
+            response = urlopen(request, timeout=10)
+        except Exception:
+            return ''
+        return str(response.info().get('Last-Modified', ''))
+
+    def get_cache_filename(self):
+        ''' Get name of the metadata cache file (or None if caching is off)
+
+        The name is made from the URL and its Last-Modified time. Cache directory is given
+        in <cachedir> or in the environment variable NANSAT_CACHE_DIR.
+
+        '''
+        cachedir = self.cachedir
+        if cachedir is None:
+            cachedir = os.getenv('NANSAT_CACHE_DIR')
+        if cachedir is None or not os.path.isdir(cachedir):
+            return None
+        key = repr((self.filename, self.get_last_modified(), self.timeVarName,
+                    self.xName, self.yName))
+        return os.path.join(cachedir,
+                            'opendap_' + hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def read_metadata(self):
+        ''' Read time axis, coordinate variables and attributes from the Dataset
+
+        Returns
+        -------
+        metadata : dict
+            'time', 'x', 'y' : 1D arrays with values of time and X/Y coordinate variables
+            'variables' : dict with 'dimensions' and 'attributes' for each variable
+            'global_attributes' : dict
+
+        '''
+        warnings.warn('Time consuming loading metadata from OpenDAP...')
+        metadata = {
+            'time': np.array(self.ds.variables[self.timeVarName][:]),
+            'x': np.array(self.ds.variables[self.xName][:]),
+            'y': np.array(self.ds.variables[self.yName][:]),
+            'variables': {},
+            'global_attributes': dict([(attr, self.ds.getncattr(attr))
+                                       for attr in self.ds.ncattrs()]),
+        }
+        for var_name, var in self.ds.variables.items():
+            metadata['variables'][var_name] = {
+                'dimensions': tuple(var.dimensions),
+                'attributes': dict([(attr, var.getncattr(attr)) for attr in var.ncattrs()]),
+            }
+        warnings.warn('Loading metadata - OK!')
+        return metadata
+
+    @staticmethod
+    def _to_json(obj):
+        ''' Convert numpy arrays/scalars and bytes in metadata for saving into JSON '''
+        if isinstance(obj, np.ndarray):
+            return {'dtype': obj.dtype.str, 'data': obj.tolist()}
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, bytes):
+            return obj.decode('utf-8', 'ignore')
+        raise TypeError('Cannot save %s in metadata cache' % type(obj))
+
+    @staticmethod
+    def _from_json(metadata):
+        ''' Restore arrays and tuples of dimensions in metadata loaded from JSON '''
+        for key in ['time', 'x', 'y']:
+            metadata[key] = np.array(metadata[key]['data'], dtype=metadata[key]['dtype'])
+        for var_metadata in metadata['variables'].values():
+            var_metadata['dimensions'] = tuple(var_metadata['dimensions'])
+            for attr, val in var_metadata['attributes'].items():
+                if isinstance(val, dict):
+                    var_metadata['attributes'][attr] = np.array(val['data'], dtype=val['dtype'])
+        return metadata
+
+    def get_metadata(self):
+        ''' Get metadata from the cache (if valid) or from the Dataset
+
+        Metadata is saved in the cache (JSON file) if <cachedir> is given. Cached metadata is
+        valid if it is younger than <cache_ttl> seconds and if the URL was not modified.
+
+        '''
+        cachefile = self.get_cache_filename()
+        if (cachefile is not None and os.path.exists(cachefile) and
+                time.time() - os.path.getmtime(cachefile) < self.cache_ttl):
+            try:
+                with open(cachefile, 'r') as f:
+                    return self._from_json(json.load(f))
+            except (IOError, KeyError, TypeError, ValueError):
+                warnings.warn('Cannot load metadata cache %s' % cachefile)
 
-        if os.path.exists(cachefile):
-            np.savez(cachefile, **{self.timeVarName: dsTime})
+        metadata = self.read_metadata()
 
-        return dsTime
+        if cachefile is not None:
+            fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(cachefile))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(metadata, f, default=self._to_json)
+            os.rename(tmp_filename, cachefile)
+
+        return metadata
 
     def get_layer_datetime(self, date, datetimes):
         ''' Get datetime of the matching layer and layer number '''
@@ -128,11 +246,12 @@ class Opendap(VRT):
                             }
                     }
 
-        for attr in self.ds.variables[varName].ncattrs():
-            attrKey = attr.encode('ascii', 'ignore')
-            attrVal = self.ds.variables[varName].getncattr(attr)
-            if type(attrVal) in [str, unicode]:
-                attrVal = attrVal.encode('ascii', 'ignore')
+        for attr, attrVal in self.metadata['variables'][varName]['attributes'].items():
+            attrKey = str(attr.encode('ascii', 'ignore').decode())
+            if isinstance(attrVal, (type(u''), bytes)):
+                if isinstance(attrVal, type(u'')):
+                    attrVal = attrVal.encode('ascii', 'ignore')
+                attrVal = str(attrVal.decode())
             if attrKey in ['scale', 'scale_factor']:
                 metaItem['src']['ScaleRatio'] = attrVal
             elif attrKey in ['offset', 'add_offset']:
@@ -151,7 +270,9 @@ class Opendap(VRT):
 
         self.filename = filename
         self.cachedir = cachedir
-        self.ds = self.get_dataset(ds)
+        if ds is not None:
+            self.ds = self.get_dataset(ds)
+        self.metadata = self.get_metadata()
 
         dsTime = self.get_dataset_time()
 
@@ -171,6 +292,8 @@ class Opendap(VRT):
 
         metaDict = [self.get_metaitem(filename, dsVarName, dsLayerNo)
                       for dsVarName in dsVarNames]
+        self.dsVarNames = dsVarNames
+        self.dsLayerNo = dsLayerNo
 
         self.create_bands(metaDict)
 
@@ -182,8 +305,8 @@ class Opendap(VRT):
     def get_time_coverage_resolution(self):
         ''' Try to fecth time_coverage_resolution and convert to seconds '''
         timeResSecs = 0
-        if 'time_coverage_resolution' in self.ds.ncattrs():
-            time_res = self.ds.time_coverage_resolution
+        if 'time_coverage_resolution' in self.metadata['global_attributes']:
+            time_res = self.metadata['global_attributes']['time_coverage_resolution']
             try:
                 timeResSecs = int(time_res[1]) * self.P2S[time_res[2].upper()]
             except:
@@ -193,13 +316,44 @@ class Opendap(VRT):
 
     def get_shape(self):
         ''' Get srcRasterXSize and srcRasterYSize from OpenDAP '''
-        return (self.ds.variables[self.xName].size,
-                self.ds.variables[self.yName].size)
+        return (self.metadata['x'].size,
+                self.metadata['y'].size)
 
 
     def get_geotransform(self):
         ''' Get first two values of X,Y variables and create geoTranform '''
 
-        xx = self.ds.variables[self.xName][0:2]
-        yy = self.ds.variables[self.yName][0:2]
+        xx = self.metadata['x'][0:2]
+        yy = self.metadata['y'][0:2]
         return (xx[0], xx[1]-xx[0], 0, yy[0], 0, yy[1]-yy[0])
+
+    def get_cropped_vrt(self, x_offset, y_offset, x_size, y_size):
+        ''' Create VRT with bands reading only a subset from the server (see VRT.get_cropped_vrt)
+
+        Bands of the cropped VRT refer to the same OPeNDAP variables as the full size bands, with
+        the same data type, scale and offset, but the source window is limited to the subset.
+        Nothing is downloaded when the VRT is created: when a band is read, the server receives
+        the index expression var[t][y0:y1][x0:x1] for the subset only.
+
+        '''
+        x_raster_size, y_raster_size = self.get_shape()
+        if (x_offset < 0 or y_offset < 0 or
+                x_offset + x_size > x_raster_size or y_offset + y_size > y_raster_size):
+            return None
+
+        geo_transform = list(self.dataset.GetGeoTransform())
+        geo_transform[0] += geo_transform[1] * x_offset
+        geo_transform[3] += geo_transform[5] * y_offset
+        cropped_vrt = VRT.from_dataset_params(x_size, y_size, geo_transform,
+                                              self.dataset.GetProjection())
+        cropped_vrt.dataset.SetMetadata(self.dataset.GetMetadata())
+        metadicts = []
+        for band_no, varName in enumerate(self.dsVarNames):
+            metaitem = self.get_metaitem(self.filename, varName, self.dsLayerNo)
+            metaitem['src'].update({'xOff': x_offset, 'yOff': y_offset,
+                                    'xSize': x_size, 'ySize': y_size})
+            metaitem['dst'] = self.dataset.GetRasterBand(band_no + 1).GetMetadata()
+            metaitem['dst']['dataType'] = self.dataset.GetRasterBand(band_no + 1).DataType
+            metadicts.append(metaitem)
+        cropped_vrt.create_bands(metadicts)
+        return cropped_vrt
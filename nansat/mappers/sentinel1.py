@@ -0,0 +1,196 @@
+# Name:         sentinel1.py
+# Purpose:      Reading and interpolation of Sentinel-1 calibration and noise LUTs
+# Authors:      Morten Wergeland Hansen, Anton Korosov
+# Licence:      This file is part of NANSAT. You can redistribute it or modify
+#               under the terms of GNU General Public License, v.3
+#               http://www.gnu.org/licenses/gpl-3.0.html
+from __future__ import absolute_import, division
+
+from io import BytesIO
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+
+def read_lut(xml, vector_list_name, variable_names):
+    """Read LUT from calibration or noise XML into dense arrays
+
+    The XML is parsed with a streaming parser: only the elements <line>, <pixel> and
+    <variable_names> inside the vector list are converted to arrays, all other elements are
+    discarded as soon as they are parsed.
+
+    Parameters
+    ----------
+    xml : str or bytes
+        content of calibration or noise XML file
+    vector_list_name : str
+        tag of the element that contains vectors with LUT values (e.g. 'calibrationVectorList')
+    variable_names : list of str
+        names of LUT variables to read (e.g. ['sigmaNought', 'betaNought'])
+
+    Returns
+    -------
+    data : dict
+        'line' : 1D array with line coordinates of vectors
+        'pixel' : 1D array with pixel coordinates of the LUT (the longest vector)
+        <variable_names> : 2D arrays (lines x pixels) with LUT values. Vectors which are given
+        at other pixel coordinates are linearly interpolated to the common pixel coordinates.
+
+    """
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    lines = []
+    pixels = []
+    values = dict([(var_name, []) for var_name in variable_names])
+    in_list = False
+    for event, elem in ET.iterparse(BytesIO(xml), events=('start', 'end')):
+        if elem.tag == vector_list_name:
+            if event == 'end':
+                break
+            in_list = True
+            continue
+        if event == 'start' or not in_list:
+            continue
+        if elem.tag == 'line':
+            lines.append(float(elem.text))
+        elif elem.tag == 'pixel':
+            pixels.append(np.array(elem.text.split(), float))
+        elif elem.tag in values:
+            values[elem.tag].append(np.array(elem.text.split(), float))
+        else:
+            # end of vector or other elements of the vector
+            elem.clear()
+
+    data = {'line': np.array(lines), 'pixel': max(pixels, key=len)}
+    for var_name in variable_names:
+        data[var_name] = np.array([
+            row_values if len(row_pixels) == len(data['pixel']) and
+                          np.all(row_pixels == data['pixel'])
+            else np.interp(data['pixel'], row_pixels, row_values)
+            for row_pixels, row_values in zip(pixels, values[var_name])])
+    return data
+
+
+class LUTInterpolator(object):
+    """Separable linear interpolator of LUT values given on a grid of lines and pixels
+
+    LUT values are first interpolated along azimuth (lines) to the requested lines and then
+    along range (pixels) to the requested pixels. Only arrays of the size of the requested
+    window are created, so any block of a full resolution image can be evaluated without
+    creating full size LUTs. Values outside of the grid are equal to the nearest grid values.
+
+    Parameters
+    ----------
+    lines : 1D array
+        line coordinates of the LUT rows (increasing)
+    pixels : 1D array
+        pixel coordinates of the LUT columns (increasing)
+    values : 2D array
+        LUT values (lines x pixels)
+
+    """
+    def __init__(self, lines, pixels, values):
+        self.lines = np.array(lines, float)
+        self.pixels = np.array(pixels, float)
+        self.values = np.array(values, float)
+
+    def to_dict(self):
+        """Get grid and values of the LUT as a dict of lists (for saving in JSON)"""
+        return {'lines': self.lines.tolist(),
+                'pixels': self.pixels.tolist(),
+                'values': self.values.tolist()}
+
+    @classmethod
+    def from_dict(cls, lut_dict):
+        """Create interpolator from a dict made by LUTInterpolator.to_dict"""
+        return cls(lut_dict['lines'], lut_dict['pixels'], lut_dict['values'])
+
+    @staticmethod
+    def _get_weights(coordinates, grid):
+        """Get indices of the preceding grid nodes and weights of the next grid nodes"""
+        if len(grid) == 1:
+            return np.zeros(len(coordinates), int), np.zeros(len(coordinates))
+        indices = np.clip(np.searchsorted(grid, coordinates, side='right') - 1, 0, len(grid) - 2)
+        weights = (coordinates - grid[indices]) / (grid[indices + 1] - grid[indices])
+        return indices, np.clip(weights, 0, 1)
+
+    def __call__(self, x_off=0, y_off=0, x_size=None, y_size=None, step=1):
+        """Evaluate LUT in a window of the image
+
+        Parameters
+        ----------
+        x_off, y_off : int
+            offset of the window in pixels and lines
+        x_size, y_size : int
+            size of the window. By default, till the last pixel/line of the LUT grid.
+        step : int
+            step of pixels and lines in the window (for reduced resolution)
+
+        Returns
+        -------
+        values : 2D array
+            LUT values in the window
+
+        """
+        if x_size is None:
+            x_size = int(self.pixels[-1]) + 1 - x_off
+        if y_size is None:
+            y_size = int(self.lines[-1]) + 1 - y_off
+        rows = np.arange(y_off, y_off + y_size, step, dtype=float)
+        cols = np.arange(x_off, x_off + x_size, step, dtype=float)
+        return self.interpolate(rows, cols)
+
+    @staticmethod
+    def _get_grid_size(grid, size):
+        """Get number of nodes of a regular grid with the median spacing of <grid>"""
+        if len(grid) < 2:
+            return 2
+        spacing = max(np.median(np.diff(grid)), 1)
+        return int(min(size, np.ceil(size / spacing))) + 1
+
+    def get_regular_grid(self, x_size, y_size):
+        """Evaluate LUT on a small regular grid covering an image of <x_size> x <y_size> pixels
+
+        Spacing of the grid is the median spacing of the LUT. Nodes of the grid are placed so
+        that the grid stretched to the image size with a resampled VRT source (SrcRect from
+        the center of the first to the center of the last node, see VRT.get_resampled_vrt)
+        matches the LUT at the nodes. GDAL then interpolates the grid only in the window
+        which is read.
+
+        Parameters
+        ----------
+        x_size, y_size : int
+            size of the image
+
+        Returns
+        -------
+        values : 2D array
+            LUT values on the regular grid
+
+        """
+        rows = np.linspace(-0.5, y_size - 0.5, self._get_grid_size(self.lines, y_size))
+        cols = np.linspace(-0.5, x_size - 0.5, self._get_grid_size(self.pixels, x_size))
+        return self.interpolate(rows, cols)
+
+    def interpolate(self, rows, cols):
+        """Evaluate LUT at all combinations of given lines (<rows>) and pixels (<cols>)
+
+        Parameters
+        ----------
+        rows, cols : 1D arrays
+            line and pixel coordinates
+
+        Returns
+        -------
+        values : 2D array (len(rows) x len(cols))
+
+        """
+        # interpolate in azimuth
+        i, wi = self._get_weights(rows, self.lines)
+        i1 = np.minimum(i + 1, len(self.lines) - 1)
+        row_values = (self.values[i] * (1 - wi)[:, None] + self.values[i1] * wi[:, None])
+
+        # interpolate in range
+        j, wj = self._get_weights(cols, self.pixels)
+        j1 = np.minimum(j + 1, len(self.pixels) - 1)
+        return row_values[:, j] * (1 - wj) + row_values[:, j1] * wj
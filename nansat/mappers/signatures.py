@@ -0,0 +1,198 @@
+# Name:         signatures.py
+# Purpose:      Cheap match criteria for selecting candidate mappers before import
+# Licence:      This file is part of NANSAT. You can redistribute it or modify
+#               under the terms of GNU General Public License, v.3
+#               http://www.gnu.org/licenses/gpl-3.0.html
+from __future__ import absolute_import
+
+import os
+import re
+
+# Signatures of the built-in mappers.
+#
+# Each signature is a dict with one or several of the following criteria:
+#   'filename'     : list of regular expressions searched in the input filename (or URL)
+#   'driver'       : list of short names of GDAL drivers which can open the input file
+#   'metadata'     : list of regular expressions searched in the 'key=value' strings of
+#                    the GDAL metadata of the input file
+#   'magic'        : list of (offset, bytes) found in the header of the input file
+#   'geotransform' : list of tuples with the first elements of the GDAL GeoTransform
+#
+# A mapper is a candidate for the input file if ANY of its criteria matches. The criteria
+# must therefore only describe conditions which are necessary for the mapper to succeed
+# (i.e. they should mirror the first checks which raise WrongMapperError in the mapper).
+# Mappers without signature (e.g. mapper_generic or user-defined mappers) are always tried.
+MAPPER_SIGNATURES = {
+    'mapper_aapp_l1b': {'magic': [(76, b'\x01\x00'), (76, b'\x02\x00'), (76, b'\x03\x00')]},
+    'mapper_amsr2_l1r': {'filename': [r'GW1AM2_[^/]*\.h5$']},
+    'mapper_amsr2_l3': {'metadata': [r'^ProductName=AMSR2-L3$']},
+    'mapper_amsre_uham_leadfraction': {'metadata': [r'title[^=]*=Daily AMSR-E Arctic lead']},
+    'mapper_arome': {'metadata': [r'^NC_GLOBAL#source=']},
+    'mapper_asar': {'metadata': [r'^MPH_PRODUCT=ASA_']},
+    'mapper_ascat_nasa': {'filename': [r'(^|/)ascat_[^/]*\.nc$']},
+    'mapper_aster_l1a': {'filename': [r'AST_L1A_']},
+    'mapper_aster_l1b': {'metadata': [r'^SHORTNAME=ASTL1B$']},
+    'mapper_case2reg': {'filename': [r'N1_C2IOP[^/]*\.nc$']},
+    'mapper_cmems': {'metadata': [r'source=']},
+    'mapper_csks': {'filename': [r'(^|/)CSKS[^/]*$']},
+    'mapper_ecmwf_metno': {'metadata': [r'^NC_GLOBAL#institution=']},
+    'mapper_emodnet': {'filename': [r'\.mnt$']},
+    'mapper_geostationary': {'filename': [r',.*,']},
+    'mapper_globcolour_l3b': {'filename': [r'(^|/)L3b_[^/]*\.nc$']},
+    'mapper_globcolour_l3m': {'metadata': [r'^NC_GLOBAL#title=.*GlobColour']},
+    'mapper_goci_l1': {'metadata': [r'^HDFEOS_POINTS_Scene_Header_Scene_Title=']},
+    'mapper_hirlam': {'geotransform': [(-12.1, 0.2, 0.0, 81.95, 0.0)]},
+    'mapper_hirlam_wind_netcdf': {'metadata': [r'=.*creation by fimex from file']},
+    'mapper_kmss': {'filename': [r'(^|/)10[12]_[^/]*tif$']},
+    'mapper_landsat': {'filename': [r'\.(tar|tar\.gz|tgz)$',
+                                    r'(^|/)[LM][^/]*(\.tif|\.TIF|\._MTL\.txt)$']},
+    'mapper_meris_l1': {'metadata': [r'^MPH_PRODUCT=MER_(FRS_|RR__)1']},
+    'mapper_meris_l2': {'metadata': [r'^MPH_PRODUCT=MER_(FRS_|RR__)2']},
+    'mapper_metno_hires_seaice': {'filename': [r'^metno_hires_seaice']},
+    'mapper_metno_local_hires_seaice': {'filename': [r'^metno_local_hires_seaice']},
+    'mapper_mod44w': {'filename': [r'(^|/)MOD44W\.vrt$']},
+    'mapper_modis_l1': {'metadata': [r'^SHORTNAME=']},
+    'mapper_ncep': {'geotransform': [(-0.25, 0.5, 0.0, 90.25, 0.0, -0.5),
+                                     (-0.5, 1.0, 0.0, 90.5, 0.0, -1.0)]},
+    'mapper_ncep_wind': {'geotransform': [(-0.25, 0.5, 0.0, 90.25, 0.0, -0.5)]},
+    'mapper_ncep_wind_online': {'filename': [r'^ncep_wind_online']},
+    'mapper_netcdf_cf': {'metadata': [r'Conventions=.*CF']},
+    'mapper_nora10_local_vpv': {'filename': [r'^nora10_local_vpv']},
+    'mapper_obpg_l2': {'metadata': [r'^Title=']},
+    'mapper_obpg_l2_nc': {'filename': [r'\.nc$']},
+    'mapper_obpg_l3': {'metadata': [r'^Title=.*Level-3 Standard Mapped Image']},
+    'mapper_ocean_productivity': {'metadata': [r'^Projection Category=.*IDL']},
+    'mapper_opendap_arome': {'filename': [r'^https?://']},
+    'mapper_opendap_globcurrent': {'filename': [r'^https?://']},
+    'mapper_opendap_globcurrent_thredds': {'filename': [r'^https?://']},
+    'mapper_opendap_occci': {'filename': [r'^https?://']},
+    'mapper_opendap_osisaf': {'filename': [r'^https?://']},
+    'mapper_opendap_siwtacsst': {'filename': [r'^https?://']},
+    'mapper_opendap_sstcci': {'filename': [r'^https?://']},
+    'mapper_pathfinder52': {'filename': [r'AVHRR_Pathfinder-PFV5\.2']},
+    'mapper_radarsat2': {'filename': [r'(^|/)RS[^/]*$'],
+                         'metadata': [r'^SATELLITE_IDENTIFIER=RADARSAT-2$']},
+    'mapper_sentinel1_l1': {'filename': [r'(^|/)S1[AB][^/]*/?$']},
+    'mapper_sentinel1_l2': {'metadata': [r'^NC_GLOBAL=']},
+    'mapper_topography': {'filename': [r'gmted2010_30.vrt', r'gtopo30.vrt', r'.*.DEM',
+                                       r'.*_gmted_mea.*.tif']},
+    'mapper_viirs_l1': {'filename': [r'GMTCO_npp_']},
+}
+
+
+def read_header(filename, size):
+    """Read first <size> bytes of the input file
+
+    Parameters
+    ----------
+    filename : str
+        name of the input file
+    size : int
+        number of bytes to read
+
+    Returns
+    -------
+    header : bytes
+        first bytes of the file or empty bytes if the file cannot be read (e.g. URL or directory)
+
+    """
+    if size == 0 or not os.path.isfile(filename):
+        return b''
+    try:
+        with open(filename, 'rb') as fp:
+            return fp.read(size)
+    except IOError:
+        return b''
+
+
+def get_header_size(signatures):
+    """Get number of header bytes required to test 'magic' criteria of all <signatures>"""
+    size = 0
+    for signature in signatures:
+        for offset, magic in signature.get('magic', []):
+            size = max(size, offset + len(magic))
+    return size
+
+
+def match_signature(signature, filename, gdal_dataset, metadata_strings, header):
+    """Check if any of the criteria in signature matches the input file
+
+    Parameters
+    ----------
+    signature : dict
+        criteria of a mapper (see MAPPER_SIGNATURES)
+    filename : str
+        name of the input file
+    gdal_dataset : gdal.Dataset or None
+        input file opened with GDAL
+    metadata_strings : list of str
+        GDAL metadata of the input file formatted as 'key=value'
+    header : bytes
+        first bytes of the input file
+
+    Returns
+    -------
+    match : bool
+
+    """
+    for pattern in signature.get('filename', []):
+        if re.search(pattern, filename):
+            return True
+
+    for pattern in signature.get('metadata', []):
+        for metadata_string in metadata_strings:
+            if re.search(pattern, metadata_string):
+                return True
+
+    for offset, magic in signature.get('magic', []):
+        if header[offset:offset + len(magic)] == magic:
+            return True
+
+    if gdal_dataset is not None:
+        if gdal_dataset.GetDriver().ShortName in signature.get('driver', []):
+            return True
+        geo_transform = tuple(gdal_dataset.GetGeoTransform())
+        for gt in signature.get('geotransform', []):
+            if geo_transform[:len(gt)] == tuple(gt):
+                return True
+
+    return False
+
+
+def select_mappers(mapper_names, filename, gdal_dataset, metadata, signatures=None):
+    """Select names of mappers which may be able to open the input file
+
+    Parameters
+    ----------
+    mapper_names : list of str
+        names of all available mappers in the order of testing
+    filename : str
+        name of the input file
+    gdal_dataset : gdal.Dataset or None
+        input file opened with GDAL
+    metadata : dict
+        GDAL metadata of the input file
+    signatures : dict
+        signatures of mappers. MAPPER_SIGNATURES by default
+
+    Returns
+    -------
+    candidates : list of str
+        names of mappers which signature matches the input file or which have no signature.
+        The order of <mapper_names> is preserved.
+
+    """
+    if signatures is None:
+        signatures = MAPPER_SIGNATURES
+    if metadata is None:
+        metadata = {}
+    metadata_strings = ['%s=%s' % (key, metadata[key]) for key in metadata]
+    header = read_header(filename, get_header_size([signatures[name] for name in mapper_names
+                                                    if name in signatures]))
+    candidates = []
+    for name in mapper_names:
+        if (name not in signatures or
+                match_signature(signatures[name], filename, gdal_dataset, metadata_strings,
+                                header)):
+            candidates.append(name)
+    return candidates
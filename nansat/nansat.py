@@ -16,12 +16,16 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
 from __future__ import absolute_import, print_function
 import os
+import re
 import glob
 import sys
 import tempfile
 import datetime
+import hashlib
+import json
 import pkgutil
 import warnings
+from timeit import default_timer
 
 import numpy as np
 from numpy import nanmedian
@@ -38,6 +42,7 @@ from nansat.tools import add_logger, gdal
 from nansat.tools import parse_time, test_openable
 from nansat.node import Node
 from nansat.pointbrowser import PointBrowser
+from nansat.mappers.signatures import select_mappers
 
 from nansat.warnings import NansatFutureWarning
 from nansat.exceptions import NansatGDALError, WrongMapperError, NansatReadError
@@ -50,8 +55,10 @@ if hasattr(collections, 'OrderedDict'):
 else:
     from ordereddict import OrderedDict
 
-# container for all mappers
+# container for names of all mappers (mappers are imported on demand)
 nansatMappers = None
+# container for imported mappers
+loadedMappers = {}
 
 
 class Nansat(Domain, Exporter):
@@ -70,8 +77,19 @@ class Nansat(Domain, Exporter):
         'sentinel1_l1', 'asar', 'hirlam', 'meris_l1', 'meris_l2', etc.
     log_level : int
         Level of logging. See: http://docs.python.org/howto/logging.html
+    metadata_only : bool
+        If True, mappers read only what is needed for cataloguing: georeference, time coverage,
+        instrument/platform and list of source bands. Derived bands, LUTs and angles are not
+        created. Mappers without such lightweight mode create the full set of bands.
+    profile_callback : callable
+        function called as profile_callback(step, seconds, status) after each step of
+        opening the file (see Nansat.open_profile)
     kwargs : additional arguments for mappers
 
+    If environment variable NANSAT_CACHE_DIR is set, result of the mapper (the VRT-file and
+    all VRT-files it refers to) is saved in that directory and reused when the same file
+    (same path, size and modification time) is opened with the same arguments.
+
     Examples
     --------
         >>> n1 = Nansat(filename)
@@ -117,6 +135,14 @@ class Nansat(Domain, Exporter):
                            'Use Nansat.get_band_number()')
     FILL_VALUE = 9.96921e+36
     ALT_FILL_VALUE = -10000.
+    # number of pixels read at once by Nansat.band_stats
+    STATS_BLOCK_SIZE = 4 * 1024 * 1024
+    # maximum width/height of the decimated read for approximate statistics
+    STATS_MAX_SIZE = 1000
+    # number of bins in histograms computed by Nansat.band_stats
+    STATS_BINS = 1000
+    # pattern of band metadata items with cached statistics
+    STATS_METADATA_PATTERN = r'\s*<MDI key="STATISTICS_[^"]*">[^<]*</MDI>'
 
     # instance attributes
     logger = None
@@ -125,6 +151,7 @@ class Nansat(Domain, Exporter):
     path = None
     vrt = None
     mapper = None
+    open_profile = None
 
     @classmethod
     def from_domain(cls, domain, array=None, parameters=None, log_level=30):
@@ -147,7 +174,8 @@ class Nansat(Domain, Exporter):
         return n
 
     def __init__(self, filename='', fileName='', mapper='', mapperName='', domain=None,
-                 array=None, parameters=None, log_level=30, logLevel=None, **kwargs):
+                 array=None, parameters=None, log_level=30, logLevel=None,
+                 metadata_only=False, profile_callback=None, **kwargs):
         """Create Nansat object
 
         Notes
@@ -164,6 +192,11 @@ class Nansat(Domain, Exporter):
             name of object (for writing KML)
         self.path : str
             path to input file
+        self.open_profile : list of tuples
+            time spent in each step of opening the file: (step, seconds, status).
+            Steps are 'test_openable', '_get_dataset_metadata', 'select_mappers',
+            name of each tested mapper (status is 'success', 'WrongMapperError', 'ImportError'
+            or 'skipped' for modules without Mapper), 'create_bands' and 'total'
 
         """
         if filename == '' and fileName != '':
@@ -184,8 +217,17 @@ class Nansat(Domain, Exporter):
             raise ValueError('Nansat is called without valid parameters! Use: Nansat(filename)')
 
         self._init_empty(filename, log_level)
-        # Create VRT object with mapping of variables
-        self.vrt = self._get_mapper(mapper, **kwargs)
+        self._profile_callback = profile_callback
+        if metadata_only:
+            kwargs['metadata_only'] = True
+        start_time = default_timer()
+        cache_filename = self._get_cache_filename(mapper, kwargs)
+        self.vrt = self._load_cache(cache_filename)
+        if self.vrt is None:
+            # Create VRT object with mapping of variables
+            self.vrt = self._get_mapper(mapper, **kwargs)
+            self._save_cache(cache_filename)
+        self._add_profile_step('total', start_time)
 
     def __getitem__(self, band_id):
         """Returns the band as a NumPy array, by overloading []
@@ -202,13 +244,31 @@ class Nansat(Domain, Exporter):
         a : NumPy array
 
 
+        """
+        return self._get_band_data(band_id)
+
+    def _get_band_data(self, band_id, y_off=0, y_size=None, buf_x_size=None, buf_y_size=None,
+                       resample_alg=None):
+        """Read rows <y_off>:<y_off> + <y_size> of a band (all rows if <y_size> is None)
+
+        Expression from band metadata is evaluated, invalid values and out-of-swath pixels are
+        replaced with np.nan as in Nansat.__getitem__. If <buf_x_size> and <buf_y_size> are given,
+        the rows are decimated by GDAL to an array of that size (overviews are used if available)
+        with <resample_alg> (gdal.GRIORA_*, nearest neighbour by default).
+
         """
         # get band
         band = self.get_GDALRasterBand(band_id)
+        if y_size is None:
+            y_size = band.YSize - y_off
         # get expression from metadata
         expression = band.GetMetadata().get('expression', '')
         # get data
-        band_data = band.ReadAsArray()
+        if resample_alg is None:
+            band_data = band.ReadAsArray(0, y_off, band.XSize, y_size, buf_x_size, buf_y_size)
+        else:
+            band_data = band.ReadAsArray(0, y_off, band.XSize, y_size, buf_x_size, buf_y_size,
+                                         resample_alg=resample_alg)
         if band_data is None:
             raise NansatGDALError('Cannot read array from band %s' % str(band_data))
 
@@ -227,7 +287,8 @@ class Nansat(Domain, Exporter):
 
         # erase out-of-swath pixels with np.Nan (if not integer)
         if self.has_band('swathmask') and all_float_flag:
-            swathmask = self.get_GDALRasterBand('swathmask').ReadAsArray()
+            swathmask = self.get_GDALRasterBand('swathmask').ReadAsArray(
+                0, y_off, band.XSize, y_size, buf_x_size, buf_y_size)
             band_data[swathmask == 0] = np.nan
 
         return band_data
@@ -265,6 +326,7 @@ class Nansat(Domain, Exporter):
         self.logger = add_logger('Nansat', log_level)
         # set input file name
         self.filename = filename
+        self.open_profile = []
         # name, for compatibility with some Domain methods
         self.name = os.path.basename(filename)
         self.path = os.path.dirname(filename)
@@ -386,6 +448,38 @@ class Nansat(Domain, Exporter):
 
         return band_metadata
 
+    def select(self, bands=None, **netcdf_dim):
+        """Add bands with selected slices of multi-dimensional variables
+
+        Available only for files opened in the lazy mode of the NetCDF-CF mapper, e.g.
+        Nansat(filename, lazy=True), and before any transformation (resize, crop,
+        reproject, etc.). Only the selected bands are created, existing bands are reused.
+
+        Parameters
+        ----------
+        bands : list
+            standard names of variables to select (all variables by default)
+        **netcdf_dim : dict
+            values of dimensions to select. Values may be scalars or lists, np.datetime64
+            selects the nearest time, e.g. n.select(time=np.datetime64('2010-01-01'),
+            depth=[0, 10]). Variables without the given dimensions are selected entirely.
+
+        Returns
+        -------
+        band_numbers : list of int
+            numbers of bands with the selected slices
+
+        Raises
+        ------
+        ValueError
+            if a value does not match any coordinate of the dimension
+
+        """
+        if not hasattr(self.vrt, 'select_bands'):
+            raise ValueError('Bands can be selected only before transformations of files '
+                             'opened with lazy=True')
+        return self.vrt.select_bands(netcdf_dim, bands)
+
     def has_band(self, band):
         """Check if self has band with name <band>
         Parameters
@@ -791,7 +885,8 @@ class Nansat(Domain, Exporter):
         return watermask
 
     def write_figure(self, filename='', bands=1, clim=None, addDate=False,
-                     array_modfunc=None, fileName='', **kwargs):
+                     array_modfunc=None, fileName='', max_size=None, width=None, resample_alg=0,
+                     **kwargs):
         """Save a raster band to a figure in graphical format.
 
         Get numpy array from the band(s) and band information specified
@@ -824,14 +919,24 @@ class Nansat(Domain, Exporter):
             fallback-'hist'
             [min, max] : min and max are numbers, or
             [[min, min, min], [max, max, max]]: three bands used
-            'hist' : a histogram is used to calculate min and max values
+            'hist' : a histogram of all pixels is used to calculate min and max values (see
+            Nansat.band_stats with approx=False)
         addDate : boolean
             False (default) : no date will be aded to the caption
             True : the first time of the object will be added to the caption
         array_modfunc : None
             None (default) : figure created using array in provided band
             function : figure created using array modified by provided function
+        max_size : int
+            None (default) : figure has the size of the bands
+            int : maximum width and height of the figure. Larger bands are read decimated by
+            GDAL (overviews are used if available).
+        width : int
+            width of the figure (height is proportional). Has priority over <max_size>.
+        resample_alg : int
+            resampling of decimated bands: 0 - NearestNeighbour (default), -1 - Average
         **kwargs : parameters for Figure().
+            mask_array, latGrid and lonGrid of the size of bands are decimated as the bands.
 
         Notes
         ---------
@@ -848,6 +953,7 @@ class Nansat(Domain, Exporter):
             >>> n.write_figure('r09_log3_leg.jpg', logarithm=True, legend=True,
                                 gamma=3, titleString='Title', fontSize=30,
                                 numOfTicks=15) # add legend
+            >>> n.write_figure('quicklook.png', max_size=1000) # decimated figure
             >>> n.write_figure(filename='transparent.png', bands=[3],
                                mask_array=wmArray,
                                mask_lut={0: [0,0,0]},
@@ -871,22 +977,33 @@ class Nansat(Domain, Exporter):
         else:
             bands = [self.get_band_number(bands)]
 
+        # == get size of figure and decimate full size input arrays ==
+        buf_x_size, buf_y_size = self._get_figure_size(max_size, width)
+        if buf_x_size is not None:
+            for key in ['mask_array', 'latGrid', 'lonGrid']:
+                if kwargs.get(key) is not None and np.shape(kwargs[key]) == self.shape():
+                    kwargs[key] = self._decimate_array(kwargs[key], buf_x_size, buf_y_size)
+        gdal_resample_alg = {-1: gdal.GRIORA_Average, 0: gdal.GRIORA_NearestNeighbour}
+        if resample_alg not in gdal_resample_alg:
+            raise ValueError('Incorrect resample_alg %s' % str(resample_alg))
+
         # == create 3D ARRAY ==
-        array = None
+        arrays = []
         for band in bands:
-            # get array from band and reshape to (1,height,width)
-            iArray = self[band]
+            # get (decimated) array from band
+            if buf_x_size is None:
+                iArray = self[band]
+            else:
+                iArray = self._get_band_data(band, buf_x_size=buf_x_size, buf_y_size=buf_y_size,
+                                             resample_alg=gdal_resample_alg[resample_alg])
             if array_modfunc:
                 iArray = array_modfunc(iArray)
-            iArray = iArray.reshape(1, iArray.shape[0], iArray.shape[1])
-            # create new 3D array or append band
-            if array is None:
-                array = iArray
-            else:
-                array = np.append(array, iArray, axis=0)
+            arrays.append(iArray)
+        array = np.array(arrays)
+        arrays = None
 
         # == CREATE FIGURE object and parse input parameters ==
-        fig = Figure(array, **kwargs)
+        fig = Figure(array, copy=False, **kwargs)
         array = None
 
         # == PREPARE cmin/cmax ==
@@ -908,8 +1025,14 @@ class Nansat(Domain, Exporter):
                 clim[0].append(float(defValue[0]))
                 clim[1].append(float(defValue[1]))
 
-        # Estimate color min/max from histogram
-        if clim == 'hist':
+        # Estimate color min/max from histogram of the figure array. Statistics of full size
+        # bands which are not modified or masked are cached in band metadata. Decimated figures
+        # use only the decimated array, so the bands are never read at full size.
+        if (clim == 'hist' and buf_x_size is None and array_modfunc is None and
+                (fig.mask_array is None or fig.mask_lut is None)):
+            clim = self._clim_from_band_stats(bands, fig.ratio, fig.array)
+            fig.color_limits = clim
+        elif clim == 'hist':
             clim = fig.clim_from_histogram(**kwargs)
 
         # modify clim to the proper shape [[min], [max]]
@@ -951,9 +1074,62 @@ class Nansat(Domain, Exporter):
         fig.save(filename, **kwargs)
         # If tiff image, convert to GeoTiff
         if filename[-3:] == 'tif':
-            self.vrt.copyproj(filename)
+            if buf_x_size is None:
+                self.vrt.copyproj(filename)
+            else:
+                self.vrt.copyproj(filename, float(buf_x_size) / self.shape()[1],
+                                  float(buf_y_size) / self.shape()[0])
         return fig
 
+    def _get_figure_size(self, max_size=None, width=None):
+        """Get width and height of a decimated figure, or (None, None) for a full size figure"""
+        y_size, x_size = self.shape()
+        if width is not None:
+            factor = float(width) / x_size
+        elif max_size is not None and max(x_size, y_size) > max_size:
+            factor = float(max_size) / max(x_size, y_size)
+        else:
+            return None, None
+        return max(1, int(round(x_size * factor))), max(1, int(round(y_size * factor)))
+
+    @staticmethod
+    def _decimate_array(array, buf_x_size, buf_y_size):
+        """Take nearest pixels of a 2D array for the decimated size as GDAL does"""
+        rows = ((np.arange(buf_y_size) + 0.5) * array.shape[0] / float(buf_y_size)).astype(int)
+        cols = ((np.arange(buf_x_size) + 0.5) * array.shape[1] / float(buf_x_size)).astype(int)
+        return np.asarray(array)[rows[:, None], cols[None]]
+
+
+    def _clim_from_band_stats(self, bands, ratio, arrays=None):
+        """Get color limits of bands from percentiles in Nansat.band_stats
+
+        Parameters
+        ----------
+        bands : list of int
+            numbers of bands
+        ratio : float, (0 1]
+            ratio of pixels between the color limits (see Figure.clim_from_histogram)
+        arrays : list of numpy arrays
+            full size data of the bands, if already read
+
+        Returns
+        -------
+        clim : list
+            [[min, ...], [max, ...]] for each band
+
+        """
+        if not (isinstance(ratio, float) or isinstance(ratio, int)) or ratio <= 0 or ratio > 1:
+            raise ValueError('Incorrect input ratio %s' % str(ratio))
+        percentiles = [100 * (1 - ratio) / 2., 100 * (1 - (1 - ratio) / 2.)]
+        clim = [[], []]
+        for i, band in enumerate(bands):
+            band_clim = self.band_stats(band, percentiles, approx=False,
+                                        array=None if arrays is None else arrays[i])['percentiles']
+            if not np.all(np.isfinite(band_clim)):
+                band_clim = [0, 1]
+            clim[0].append(float(band_clim[0]))
+            clim[1].append(float(band_clim[1]))
+        return clim
 
     def write_geotiffimage(self, filename, band_id=1, bandID=None):
         """Writes an 8-bit GeoTiff image for a given band.
@@ -1105,6 +1281,313 @@ class Nansat(Domain, Exporter):
         else:
             metadata_receiver.SetMetadataItem(str(key), str(value))
 
+    def band_stats(self, band_id=1, percentiles=(2.5, 97.5), approx=True, bins=None, array=None):
+        """Get statistics, histogram and percentiles of band values
+
+        Statistics are computed block by block (or from one decimated read if <approx> is True)
+        and cached in the band metadata as STATISTICS_* items, like in GDAL. The cache is valid
+        while the VRT is not changed (e.g. by crop, resize or reproject).
+
+        Parameters
+        ----------
+        band_id : int or str
+            number or name of band
+        percentiles : list of float
+            percentiles [0 - 100] to get from the histogram
+        approx : bool
+            if True and the band is larger than STATS_MAX_SIZE, statistics are computed from
+            the band decimated to STATS_MAX_SIZE (overviews are used if available).
+            If False, all pixels are used.
+        bins : int
+            number of bins in the histogram (STATS_BINS by default)
+        array : numpy array
+            full size data of the band, if already read. Statistics are computed from it
+            instead of reading the band (used only with approx=False).
+
+        Returns
+        -------
+        stats : dict
+            'min', 'max', 'mean', 'std' : float
+                statistics of valid (finite) values
+            'count' : int
+                number of valid values
+            'histogram' : numpy array
+                number of values in <bins> equal bins between 'min' and 'max'
+            'percentiles' : numpy array
+                values at the given <percentiles>, linearly interpolated within the bins
+
+        Examples
+        --------
+            >>> stats = n.band_stats('sigma0_HV', percentiles=[1, 99])
+            >>> cmin, cmax = stats['percentiles']
+
+        """
+        band_number = self.get_band_number(band_id)
+        if bins is None:
+            bins = self.STATS_BINS
+        key = self._get_stats_key(band_number, approx, bins)
+        metadata = self.get_metadata(band_id=band_number)
+        if metadata.get('STATISTICS_KEY') == key:
+            stats = {'min': float(metadata['STATISTICS_MINIMUM']),
+                     'max': float(metadata['STATISTICS_MAXIMUM']),
+                     'mean': float(metadata['STATISTICS_MEAN']),
+                     'std': float(metadata['STATISTICS_STDDEV']),
+                     'count': int(metadata['STATISTICS_VALID_COUNT']),
+                     'histogram': np.array(metadata['STATISTICS_HISTOGRAM'].split(), 'int64')}
+        else:
+            if approx:
+                array = None
+            stats = self._compute_band_stats(band_number, approx, bins, array)
+            self.set_metadata({'STATISTICS_MINIMUM': repr(stats['min']),
+                               'STATISTICS_MAXIMUM': repr(stats['max']),
+                               'STATISTICS_MEAN': repr(stats['mean']),
+                               'STATISTICS_STDDEV': repr(stats['std']),
+                               'STATISTICS_VALID_COUNT': stats['count'],
+                               'STATISTICS_APPROXIMATE': 'YES' if approx else 'NO',
+                               'STATISTICS_HISTOGRAM': ' '.join(map(str, stats['histogram'])),
+                               'STATISTICS_KEY': key}, band_id=band_number)
+
+        # percentiles are interpolated in the cumulative histogram
+        if stats['count'] == 0:
+            stats['percentiles'] = np.zeros(len(percentiles)) + np.nan
+        else:
+            cumulative = np.append(0, np.cumsum(stats['histogram']))
+            bin_edges = np.linspace(stats['min'], stats['max'], len(stats['histogram']) + 1)
+            stats['percentiles'] = np.interp(np.array(percentiles) / 100. * stats['count'],
+                                             cumulative, bin_edges)
+        return stats
+
+    def _get_stats_key(self, band_number, approx, bins):
+        """Get hash of VRT content (without cached statistics) and parameters of statistics"""
+        vrt_xml = re.sub(self.STATS_METADATA_PATTERN, '', self.vrt.xml)
+        key = '%s %d %s %d' % (vrt_xml, band_number, approx, bins)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _get_stats_blocks(self, band_number, approx, array=None):
+        """Yield valid (finite) values of the band (or of the <array> with the band data) block
+        by block or from one decimated read"""
+        band = self.get_GDALRasterBand(band_number)
+        x_size, y_size = band.XSize, band.YSize
+        if array is not None:
+            block_rows = max(1, self.STATS_BLOCK_SIZE // x_size)
+            for y_off in range(0, y_size, block_rows):
+                band_data = array[y_off:y_off + block_rows]
+                yield band_data[np.isfinite(band_data)].astype('float64')
+            return
+        if approx and max(x_size, y_size) > self.STATS_MAX_SIZE:
+            factor = float(self.STATS_MAX_SIZE) / max(x_size, y_size)
+            blocks = [(0, y_size, max(1, int(x_size * factor)), max(1, int(y_size * factor)))]
+        else:
+            block_rows = max(1, self.STATS_BLOCK_SIZE // x_size)
+            blocks = [(y_off, min(block_rows, y_size - y_off), None, None)
+                      for y_off in range(0, y_size, block_rows)]
+        for y_off, block_y_size, buf_x_size, buf_y_size in blocks:
+            band_data = self._get_band_data(band_number, y_off, block_y_size,
+                                            buf_x_size, buf_y_size)
+            yield band_data[np.isfinite(band_data)].astype('float64')
+
+    def _compute_band_stats(self, band_number, approx, bins, array=None):
+        """Compute statistics and histogram of a band in two passes over blocks of data
+
+        Count, mean and variance of blocks are merged as in Chan et al. (1979), histograms of
+        blocks in the second pass have the same bins and are summed.
+
+        """
+        count, mean, m2 = 0, 0., 0.
+        v_min, v_max = np.inf, -np.inf
+        for values in self._get_stats_blocks(band_number, approx, array):
+            if values.size == 0:
+                continue
+            block_mean = values.mean()
+            delta = block_mean - mean
+            new_count = count + values.size
+            mean += delta * values.size / new_count
+            m2 += ((values - block_mean) ** 2).sum() + delta ** 2 * count * values.size / new_count
+            count = new_count
+            v_min = min(v_min, values.min())
+            v_max = max(v_max, values.max())
+
+        histogram = np.zeros(bins, 'int64')
+        if count == 0:
+            return {'min': np.nan, 'max': np.nan, 'mean': np.nan, 'std': np.nan,
+                    'count': 0, 'histogram': histogram}
+
+        for values in self._get_stats_blocks(band_number, approx, array):
+            histogram += np.histogram(values, bins, (v_min, v_max))[0]
+
+        return {'min': float(v_min), 'max': float(v_max), 'mean': float(mean),
+                'std': float(np.sqrt(m2 / count)), 'count': count, 'histogram': histogram}
+
+    def _add_profile_step(self, step, start_time, status='', seconds=None):
+        """Add time elapsed since <start_time> to self.open_profile, log and report it
+
+        Parameters
+        ----------
+        step : str
+            name of the step of opening the file
+        start_time : float
+            time when the step started (from timeit.default_timer)
+        status : str
+            result of the step (e.g. 'success' or 'WrongMapperError')
+        seconds : float
+            duration of the step if it was measured elsewhere (start_time is ignored)
+
+        Returns
+        -------
+        stop_time : float
+            time when the step was added. Can be used as start_time of the next step
+
+        """
+        stop_time = default_timer()
+        if seconds is None:
+            seconds = stop_time - start_time
+        if self.open_profile is None:
+            self.open_profile = []
+        self.open_profile.append((step, seconds, status))
+        self.logger.debug('Profile: %s %s %.6f s' % (step, status, seconds))
+        profile_callback = getattr(self, '_profile_callback', None)
+        if profile_callback is not None:
+            profile_callback(step, seconds, status)
+        return stop_time
+
+    def _get_cache_filename(self, mapper, kwargs):
+        """Get name of the file in NANSAT_CACHE_DIR with cached result of the mapper
+
+        Parameters
+        ----------
+        mapper : str
+            name of the mapper given to Nansat()
+        kwargs : dict
+            additional arguments for mappers
+
+        Returns
+        -------
+        cache_filename : str or None
+            None if NANSAT_CACHE_DIR is not set, if the input is not a local file or if the
+            file is opened with lazy=True
+
+        """
+        cache_dir = os.getenv('NANSAT_CACHE_DIR')
+        if cache_dir is None or not os.path.exists(self.filename) or kwargs.get('lazy'):
+            # lazy mappers keep the dimension layout for creating bands later
+            return None
+        file_stat = os.stat(self.filename)
+        # arrays (e.g. grids given to mappers) are represented by hash of their contents
+        kwargs_key = sorted([(name, (value.shape, value.dtype.str,
+                                     hashlib.sha1(value.tobytes()).hexdigest())
+                             if isinstance(value, np.ndarray) else value)
+                             for name, value in kwargs.items()])
+        key = repr((os.path.abspath(self.filename), file_stat.st_size, file_stat.st_mtime,
+                    mapper, kwargs_key))
+        return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def _load_cache(self, cache_filename):
+        """Create VRT from cached result of the mapper
+
+        Parameters
+        ----------
+        cache_filename : str or None
+            name of the cache file (see Nansat._get_cache_filename)
+
+        Returns
+        -------
+        vrt : VRT or None
+            object of the cached mapper class. None if cache is not used, does not exist or
+            cannot be read
+
+        Notes
+        -----
+        self.mapper is set to the name of the cached mapper
+
+        The cache file has one line with JSON header (name of the mapper, name of the main
+        VRT-file, tps flag, state of the mapper (see VRT._get_cache_state) and names and sizes
+        of all VSI files) followed by the raw contents of the VSI files.
+
+        """
+        if cache_filename is None:
+            return None
+        start_time = default_timer()
+        vrt = None
+        if os.path.exists(cache_filename):
+            try:
+                with open(cache_filename, 'rb') as cache_file:
+                    cache = json.loads(cache_file.readline().decode('utf-8'))
+                    vsi_files = {}
+                    for vsi_filename, size in cache['vsi_files']:
+                        vsi_files[str(vsi_filename)] = cache_file.read(size)
+                        if len(vsi_files[vsi_filename]) != size:
+                            raise ValueError('Incomplete cache file')
+                mapper_class = self._get_cached_mapper_class(cache['mapper'])
+                mapper_class._check_cache_state(cache['state'])
+                vrt = mapper_class.from_vsi_files(vsi_files, str(cache['filename']))
+                vrt._set_cache_state(cache['state'])
+            except (IOError, EOFError, KeyError, TypeError, ValueError) as e:
+                self.logger.warning('Cannot read cache %s: %s' % (cache_filename, e))
+                vrt = None
+            else:
+                vrt.tps = cache['tps']
+                self.mapper = cache['mapper']
+        self._add_profile_step('load_cache', start_time, 'miss' if vrt is None else 'hit')
+        return vrt
+
+    @staticmethod
+    def _get_cached_mapper_class(mapper):
+        """Get class of the cached mapper (VRT if no mapper was used)"""
+        if mapper == 'gdal_bands':
+            return VRT
+        mapper_class = _load_mapper('mapper_' + mapper)
+        if not isinstance(mapper_class, type) or not mapper_class.CACHEABLE:
+            raise ValueError('Mapper %s cannot be restored from cache' % mapper)
+        return mapper_class
+
+    def _save_cache(self, cache_filename):
+        """Save result of the mapper (self.vrt and all VSI files it refers to) into cache
+
+        The cache file is written into a temporary file and renamed, so that concurrent
+        processes never read incomplete cache. VRTs which refer to temporary files (e.g.
+        extracted from archives) are not cached. Only results of mappers with CACHEABLE = True
+        are cached, together with their state which is not kept in the VRT-files (see
+        VRT._get_cache_state).
+
+        Parameters
+        ----------
+        cache_filename : str or None
+            name of the cache file (see Nansat._get_cache_filename)
+
+        """
+        if cache_filename is None:
+            return
+        start_time = default_timer()
+        if type(self.vrt) is not VRT and not self.vrt.CACHEABLE:
+            self._add_profile_step('save_cache', start_time, 'skipped')
+            return
+        vsi_files = self.vrt.get_vsi_files()
+        temp_dir = tempfile.gettempdir().encode()
+        if any(temp_dir in vsi_files[vsi_filename] for vsi_filename in vsi_files):
+            self._add_profile_step('save_cache', start_time, 'skipped')
+            return
+
+        vsi_filenames = sorted(vsi_files)
+        cache = {'mapper': self.mapper,
+                 'filename': self.vrt.filename,
+                 'tps': self.vrt.tps,
+                 'state': self.vrt._get_cache_state(),
+                 'vsi_files': [(vsi_filename, len(vsi_files[vsi_filename]))
+                               for vsi_filename in vsi_filenames]}
+        cache_dir = os.path.dirname(cache_filename)
+        try:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            fd, temp_filename = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(json.dumps(cache).encode('utf-8') + b'\n')
+                for vsi_filename in vsi_filenames:
+                    cache_file.write(vsi_files[vsi_filename])
+            os.rename(temp_filename, cache_filename)
+        except (IOError, OSError) as e:
+            self.logger.warning('Cannot write cache %s: %s' % (cache_filename, e))
+        self._add_profile_step('save_cache', start_time)
+
     def _get_dataset_metadata(self):
         # open GDAL dataset. It will be parsed to all mappers for testing
         gdal_dataset, metadata = None, dict()
@@ -1150,6 +1633,7 @@ class Nansat(Domain, Exporter):
         NansatReadError : occurs if no mapper fits the input file
 
         """
+        start_time = default_timer()
         if os.path.isfile(self.filename):
             # Make sure file exists and can be opened for reading
             # before proceeding
@@ -1158,14 +1642,16 @@ class Nansat(Domain, Exporter):
             ff = glob.glob(os.path.join(self.filename, '*.*'))
             for f in ff:
                 test_openable(f)
-        # lazy import of nansat mappers
-        # if nansat mappers were not imported yet
+        start_time = self._add_profile_step('test_openable', start_time)
+        # lazy listing of nansat mappers (modules are imported only when tested)
+        # if nansat mappers were not listed yet
         global nansatMappers
         if nansatMappers is None:
-            nansatMappers = _import_mappers()
+            nansatMappers = _list_mappers()
 
         # open GDAL dataset. It will be parsed to all mappers for testing
         gdal_dataset, metadata = self._get_dataset_metadata()
+        start_time = self._add_profile_step('_get_dataset_metadata', start_time)
         tmp_vrt = None
 
         if mappername is not '':
@@ -1177,24 +1663,35 @@ class Nansat(Domain, Exporter):
                 raise ValueError('Mapper ' + mappername + ' not found')
 
             # check if mapper is importbale or raise an ImportError error
-            if isinstance(nansatMappers[mappername], tuple):
-                errType, err, traceback = nansatMappers[mappername]
+            mapper_class = _load_mapper(mappername)
+            if isinstance(mapper_class, tuple):
+                errType, err, traceback = mapper_class
                 # self.logger.error(err, exc_info=(errType, err, traceback))
                 # TODO: python 3.6 does not support with syntax
                 raise EnvironmentError
                 #raise errType, err, traceback
 
             # create VRT using the selected mapper
-            tmp_vrt = nansatMappers[mappername](self.filename, gdal_dataset, metadata, **kwargs)
+            tmp_vrt = mapper_class(self.filename, gdal_dataset, metadata, **kwargs)
             self.mapper = mappername.replace('mapper_', '')
+            start_time = self._add_profile_step(mappername, start_time, 'success')
         else:
-            # We test all mappers, import one by one
+            # We test only mappers which signature matches the input file, import one by one
+            candidates = select_mappers(list(nansatMappers), self.filename,
+                                        gdal_dataset, metadata)
+            self.logger.debug('Candidate mappers: %s' % candidates)
+            start_time = self._add_profile_step('select_mappers', start_time)
             import_errors = []
-            for iMapper in nansatMappers:
-                # skip non-importable mappers
-                if isinstance(nansatMappers[iMapper], tuple):
+            for iMapper in candidates:
+                mapper_class = _load_mapper(iMapper)
+                # skip non-importable mappers and modules without Mapper
+                if mapper_class is None:
+                    start_time = self._add_profile_step(iMapper, start_time, 'skipped')
+                    continue
+                if isinstance(mapper_class, tuple):
                     # keep errors to show before use of generic mapper
-                    import_errors.append(nansatMappers[iMapper][1])
+                    import_errors.append(mapper_class[1])
+                    start_time = self._add_profile_step(iMapper, start_time, 'ImportError')
                     continue
 
                 self.logger.debug('Trying %s...' % iMapper)
@@ -1207,12 +1704,13 @@ class Nansat(Domain, Exporter):
 
                 # create a Mapper object and get VRT dataset from it
                 try:
-                    tmp_vrt = nansatMappers[iMapper](self.filename, gdal_dataset, metadata, **kwargs)
+                    tmp_vrt = mapper_class(self.filename, gdal_dataset, metadata, **kwargs)
                     self.logger.info('Mapper %s - success!' % iMapper)
                     self.mapper = iMapper.replace('mapper_', '')
+                    start_time = self._add_profile_step(iMapper, start_time, 'success')
                     break
                 except (WrongMapperError, WrongMapperErrorOld):
-                    pass
+                    start_time = self._add_profile_step(iMapper, start_time, 'WrongMapperError')
 
         # if no mapper fits, make simple copy of the input DS into a VSI/VRT
         if tmp_vrt is None and gdal_dataset is not None:
@@ -1223,6 +1721,7 @@ class Nansat(Domain, Exporter):
                                      'SourceBand': iBand + 1})
                 tmp_vrt.dataset.FlushCache()
             self.mapper = 'gdal_bands'
+            start_time = self._add_profile_step('gdal_bands', start_time, 'success')
 
         # if GDAL cannot open the file, and no mappers exist which can make VRT
         if tmp_vrt is None and gdal_dataset is None:
@@ -1232,6 +1731,8 @@ class Nansat(Domain, Exporter):
             raise NansatReadError('%s: File cannot be read with NANSAT - '
                     'consider writing a mapper' % self.filename)
 
+        # time of band creation is included in the time of the mapper
+        self._add_profile_step('create_bands', start_time, seconds=tmp_vrt.band_creation_time)
         return tmp_vrt
 
     def get_band_number(self, band_id):
@@ -1563,6 +2064,12 @@ class Nansat(Domain, Exporter):
             self.logger.error(('WARNING! Cropping region is larger or equal to image!'))
             return extent
 
+        # read subset directly from the source if the mapper supports it
+        cropped_vrt = self.vrt.get_cropped_vrt(x_offset, y_offset, x_size, y_size)
+        if cropped_vrt is not None:
+            self.vrt = cropped_vrt
+            return extent
+
         # create super VRT and change it
         self.vrt = self.vrt.get_super_vrt()
         self.vrt.set_offset_size('x', x_offset, x_size)
@@ -1626,22 +2133,25 @@ class Nansat(Domain, Exporter):
         return pixVector[gpi], linVector[gpi]
 
 
-def _import_mappers(log_level=None):
-    """Import available mappers into a dictionary
+def _list_mappers(log_level=None):
+    """List available mappers without importing them
+
+    Built-in mappers (modules with names starting with 'mapper_' in nansat.mappers) and
+    user-defined mappers (any module in the package nansat_mappers) are listed.
 
     Returns
     --------
-    nansat_mappers : dict
+    nansat_mappers : OrderedDict
         key  : mapper name
-        value: class Mapper(VRT) from the mappers module
+        value: finder of the package with the mapper module
 
     """
     logger = add_logger('import_mappers', logLevel=log_level)
-    # import built-in mappers
+    # import built-in mappers package
     import nansat.mappers
     mapper_packages = [nansat.mappers]
 
-    # import user-defined mappers (if any)
+    # import user-defined mappers package (if any)
     try:
         import nansat_mappers as nansat_mappers_pkg
     except ImportError:
@@ -1654,15 +2164,12 @@ def _import_mappers(log_level=None):
     nansat_mappers = OrderedDict()
     for mapper_package in mapper_packages:
         logger.debug('From package: %s' % mapper_package.__path__)
-        # scan through modules and load all modules that contain class Mapper
+        # scan through modules without loading them
         for finder, name, ispkg in (pkgutil.iter_modules(mapper_package.__path__)):
-            logger.debug('Loading mapper %s' % name)
-            loader = finder.find_module(name)
-            # try to import mapper module
-            module = loader.load_module(name)
-            # add the imported mapper to nansat_mappers
-            if hasattr(module, 'Mapper'):
-                nansat_mappers[name] = module.Mapper
+            # skip helper modules of the built-in package (envisat, opendap, etc)
+            if mapper_package is nansat.mappers and not name.startswith('mapper_'):
+                continue
+            nansat_mappers[name] = finder
 
         # move netcdfcdf mapper to the end
         if 'mapper_netcdf_cf' in nansat_mappers:
@@ -1673,3 +2180,62 @@ def _import_mappers(log_level=None):
             nansat_mappers['mapper_generic'] = nansat_mappers.pop('mapper_generic')
 
     return nansat_mappers
+
+
+def _load_mapper(name):
+    """Import mapper module and return its class Mapper
+
+    Imported mappers are kept in a cache and imported only once.
+
+    Parameters
+    ----------
+    name : str
+        name of the mapper module (e.g. 'mapper_asar')
+
+    Returns
+    --------
+    mapper : class Mapper(VRT) from the mapper module, or
+             tuple from sys.exc_info() if the module cannot be imported, or
+             None if the module has no class Mapper
+
+    """
+    global nansatMappers
+    if nansatMappers is None:
+        nansatMappers = _list_mappers()
+
+    if name not in loadedMappers:
+        logger = add_logger('import_mappers')
+        logger.debug('Loading mapper %s' % name)
+        loader = nansatMappers[name].find_module(name)
+        try:
+            module = loader.load_module(name)
+        except ImportError:
+            loadedMappers[name] = sys.exc_info()
+        else:
+            loadedMappers[name] = getattr(module, 'Mapper', None)
+
+    return loadedMappers[name]
+
+
+def _import_mappers(log_level=None):
+    """Import available mappers into a dictionary
+
+    Returns
+    --------
+    nansat_mappers : dict
+        key  : mapper name
+        value: class Mapper(VRT) from the mappers module
+
+    """
+    global nansatMappers
+    nansatMappers = _list_mappers(log_level)
+
+    # create ordered dict for mappers
+    nansat_mappers = OrderedDict()
+    for name in nansatMappers:
+        mapper = _load_mapper(name)
+        # add the imported mapper to nansat_mappers
+        if mapper is not None:
+            nansat_mappers[name] = mapper
+
+    return nansat_mappers
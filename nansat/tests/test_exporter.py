@@ -37,6 +37,9 @@ import gdal
 from netCDF4 import Dataset
 
 from nansat import Nansat, Domain, NSR
+from nansat.vrt import VRT
+from nansat.exporter import Exporter
+from nansat.tools import gcps_to_array, read_cropped_gcps
 from nansat.warnings import NansatFutureWarning
 from nansat.tests.nansat_test_base import NansatTestBase
 
@@ -96,6 +99,17 @@ class ExporterTest(NansatTestBase):
         earrWithNaN = exported['testBandWithNaN']
         np.testing.assert_allclose(arrWithNaN, earrWithNaN)
 
+    def test_export_netcdf_without_band_stats(self):
+        n = Nansat(self.test_file_gcps, mapper=self.default_mapper)
+        n.band_stats(1)
+        n.export(self.tmp_filename)
+        ncf = Dataset(self.tmp_filename)
+
+        self.assertIn('STATISTICS_KEY', n.get_metadata(band_id=1))
+        self.assertFalse([attr for attr in ncf.variables[n.bands()[1]['name']].ncattrs()
+                          if attr.startswith('STATISTICS_')])
+        ncf.close()
+
     def test_export_gcps_filename_warning(self):
         """ Should export file with GCPs and write correct bands"""
         n0 = Nansat(self.test_file_gcps, log_level=40, mapper=self.default_mapper)
@@ -113,10 +127,8 @@ class ExporterTest(NansatTestBase):
 
         ncf = Dataset(tmpfilename)
         self.assertTrue(os.path.exists(tmpfilename))
-        self.assertTrue('GCPX' in ncf.variables)
-        self.assertTrue('GCPY' in ncf.variables)
-        self.assertTrue('GCPPixel' in ncf.variables)
-        self.assertTrue('GCPLine' in ncf.variables)
+        self.assertTrue('GCPs' in ncf.variables)
+        self.assertEqual(ncf.variables['GCPs'].shape, (len(n0.vrt.dataset.GetGCPs()), 5))
 
         n1 = Nansat(tmpfilename, mapper=self.default_mapper)
         b0 = n0['L_469']
@@ -128,6 +140,24 @@ class ExporterTest(NansatTestBase):
         np.testing.assert_allclose(lon0, lon1)
         np.testing.assert_allclose(lat0, lat1)
 
+    def test_export_gcps_to_netcdf_crop(self):
+        n0 = Nansat(self.test_file_gcps, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_export_gcps_crop.nc')
+        n0.export(tmpfilename)
+        n1 = Nansat(tmpfilename, mapper=self.default_mapper)
+        with patch('nansat.mappers.mapper_generic.read_cropped_gcps',
+                   side_effect=read_cropped_gcps) as mock_read_cropped_gcps:
+            n1.crop(10, 20, 50, 60)
+        n0.crop(10, 20, 50, 60)
+
+        self.assertTrue(mock_read_cropped_gcps.called)
+        self.assertEqual(n1.shape(), (60, 50))
+        gcps0 = gcps_to_array(n0.vrt.dataset.GetGCPs())
+        gcps1 = gcps_to_array(n1.vrt.dataset.GetGCPs())
+        for name in ['GCPX', 'GCPY', 'GCPPixel', 'GCPLine']:
+            np.testing.assert_allclose(gcps0[name], gcps1[name], rtol=1e-4)
+        np.testing.assert_allclose(n0['L_469'], n1['L_469'])
+
     def test_export_gcps_complex_to_netcdf(self):
         """ Should export file with GCPs and write correct complex bands"""
         n0 = Nansat(self.test_file_gcps, log_level=40, mapper=self.default_mapper)
@@ -141,10 +171,8 @@ class ExporterTest(NansatTestBase):
 
         ncf = Dataset(tmpfilename)
         self.assertTrue(os.path.exists(tmpfilename))
-        self.assertTrue('GCPX' in ncf.variables)
-        self.assertTrue('GCPY' in ncf.variables)
-        self.assertTrue('GCPPixel' in ncf.variables)
-        self.assertTrue('GCPLine' in ncf.variables)
+        self.assertTrue('GCPs' in ncf.variables)
+        self.assertEqual(ncf.variables['GCPs'].shape, (len(n0.vrt.dataset.GetGCPs()), 5))
 
         n2 = Nansat(tmpfilename, mapper=self.default_mapper)
         b2 = n2['L_469']
@@ -161,6 +189,63 @@ class ExporterTest(NansatTestBase):
 
         self.assertTrue(os.path.exists(tmpfilename))
 
+    def test_export_gtiff_profile(self):
+        n = Nansat(self.test_file_gcps, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_export_deflate.tif')
+        n.export(tmpfilename, profile='gtiff_deflate', processes=2)
+
+        ds = gdal.Open(tmpfilename)
+        self.assertEqual(ds.GetMetadata('IMAGE_STRUCTURE')['COMPRESSION'], 'DEFLATE')
+        self.assertEqual(ds.GetRasterBand(1).GetBlockSize(), [256, 256])
+        np.testing.assert_allclose(ds.GetRasterBand(1).ReadAsArray(), n[1])
+
+    def test_export_cog(self):
+        d = Domain(4326, '-te 0 0 10 10 -ts 600 500')
+        n = Nansat.from_domain(d, np.random.randn(500, 600).astype(np.float32))
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_export_cog.tif')
+        n.export(tmpfilename, profile='cog')
+
+        ds = gdal.Open(tmpfilename)
+        band = ds.GetRasterBand(1)
+        self.assertEqual(band.GetBlockSize(), [256, 256])
+        self.assertEqual(band.GetOverviewCount(), 2)
+        self.assertEqual(band.GetOverview(1).XSize, 150)
+        self.assertEqual(ds.GetMetadata('IMAGE_STRUCTURE')['COMPRESSION'], 'DEFLATE')
+        np.testing.assert_allclose(band.ReadAsArray(), n[1])
+
+    def test_export_cog_gcps(self):
+        n = Nansat(self.test_file_gcps, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_export_cog_gcps.tif')
+        n.export(tmpfilename, driver='COG', overview_resampling='NEAREST')
+
+        ds = gdal.Open(tmpfilename)
+        self.assertEqual(len(ds.GetGCPs()), len(n.vrt.dataset.GetGCPs()))
+
+    def test_get_overview_levels(self):
+        self.assertEqual(Nansat._get_overview_levels(200, 100), [])
+        self.assertEqual(Nansat._get_overview_levels(1000, 100), [2, 4])
+        self.assertEqual(Nansat._get_overview_levels(100, 1025, 256), [2, 4, 8])
+
+    def test_export_netcdf4_profile(self):
+        n = Nansat(self.test_file_arctic, mapper=self.default_mapper)
+        n.export(self.tmp_filename, profile='netcdf4', options=['ZLEVEL=9'])
+        nc = Dataset(self.tmp_filename)
+        self.assertEqual(nc.file_format, 'NETCDF4')
+        self.assertTrue(nc.variables['Bristol'].filters()['zlib'])
+        nc.close()
+
+    def test_export_wrong_profile(self):
+        n = Nansat(self.test_file_arctic, mapper=self.default_mapper)
+        with self.assertRaises(ValueError):
+            n.export(self.tmp_filename, profile='netcdf5')
+
+    def test_get_profile_options(self):
+        driver, options = Nansat._get_profile_options('gtiff_zstd', ['zstd_level=1'])
+        self.assertEqual(driver, 'GTiff')
+        self.assertIn('COMPRESS=ZSTD', options)
+        self.assertIn('zstd_level=1', options)
+        self.assertNotIn('ZSTD_LEVEL=9', options)
+
     def test_export_band(self):
         n = Nansat(self.test_file_gcps, log_level=40, mapper=self.default_mapper)
         tmpfilename = os.path.join(self.tmp_data_path,
@@ -296,6 +381,131 @@ class ExporterTest(NansatTestBase):
         self.assertEqual(ncIVar[:].dtype, np.int8)
 
 
+    def test_export2thredds_scale_blocks(self):
+        d = Domain("+proj=stere +lat_0=90 +lon_0=0 +datum=WGS84 +no_defs",
+                   "-te -100000 -100000 100000 100000 -tr 1000 2000")
+        n = Nansat.from_domain(d)
+        array = np.random.randn(*d.shape()).astype(np.float32)
+        n.add_band(array, parameters={'name': 'sst', 'units': 'K'})
+        n.THREDDS_BLOCK_SIZE = 1000
+        n.export2thredds(self.tmp_filename, {'sst': {'type': '>i2', 'scale': 0.001,
+                                                     'offset': 1, 'long_name': 'SST'}},
+                         time=datetime.datetime(2016, 1, 20))
+        nc = Dataset(self.tmp_filename)
+        self.assertEqual(nc.variables['sst'].dimensions, ('time', 'y', 'x'))
+        self.assertEqual(nc.variables['sst'].units, 'K')
+        self.assertEqual(nc.variables['sst'].long_name, 'SST')
+        self.assertIn(nc.variables['sst'].grid_mapping, nc.variables)
+        self.assertTrue(np.all(np.diff(nc.variables['y'][:]) > 0))
+        np.testing.assert_allclose(nc.variables['sst'][0][::-1], array, atol=0.001)
+        nc.close()
+
+    def test_export_append(self):
+        d = Domain("+proj=stere +lat_0=90 +lon_0=0 +datum=WGS84 +no_defs",
+                   "-te -100000 -100000 100000 100000 -tr 2000 2000")
+        bands = {'sst': {'type': '>i2', 'scale': 0.01, '_FillValue': -32768}}
+        arrays = []
+        for day in [1, 2]:
+            arrays.append(np.random.randn(*d.shape()).astype(np.float32))
+            n = Nansat.from_domain(d, arrays[-1], parameters={'name': 'sst'})
+            n.export_append(self.tmp_filename, bands, time=datetime.datetime(2016, 1, day))
+        # same time again and another domain
+        with self.assertRaises(ValueError):
+            n.export_append(self.tmp_filename, bands, time=datetime.datetime(2016, 1, 2))
+        d2 = Domain("+proj=stere +lat_0=90 +lon_0=0 +datum=WGS84 +no_defs",
+                    "-te -100000 -100000 100000 100000 -tr 4000 4000")
+        n2 = Nansat.from_domain(d2, np.zeros(d2.shape()), parameters={'name': 'sst'})
+        with self.assertRaises(ValueError):
+            n2.export_append(self.tmp_filename, bands, time=datetime.datetime(2016, 1, 3))
+
+        nc = Dataset(self.tmp_filename)
+        self.assertTrue(nc.dimensions['time'].isunlimited())
+        np.testing.assert_allclose(nc.variables['time'][:], [42368, 42369])
+        self.assertEqual(nc.variables['sst'].shape, (2, 100, 100))
+        np.testing.assert_allclose(nc.variables['sst'][1][::-1], arrays[1], atol=0.01)
+        nc.close()
+
+    def test_export_append_other_projection(self):
+        d = Domain("+proj=stere +lat_0=90 +lon_0=0 +datum=WGS84 +no_defs",
+                   "-te -100000 -100000 100000 100000 -tr 2000 2000")
+        n = Nansat.from_domain(d, np.zeros(d.shape()), parameters={'name': 'sst'})
+        n.export_append(self.tmp_filename, time=datetime.datetime(2016, 1, 1))
+        # same coordinates but different CRS
+        d2 = Domain("+proj=stere +lat_0=90 +lon_0=45 +datum=WGS84 +no_defs",
+                    "-te -100000 -100000 100000 100000 -tr 2000 2000")
+        n2 = Nansat.from_domain(d2, np.zeros(d2.shape()), parameters={'name': 'sst'})
+        with self.assertRaises(ValueError):
+            n2.export_append(self.tmp_filename, time=datetime.datetime(2016, 1, 2))
+
+    def test_export_append_failed_band(self):
+        d = Domain("+proj=stere +lat_0=90 +lon_0=0 +datum=WGS84 +no_defs",
+                   "-te -100000 -100000 100000 100000 -tr 2000 2000")
+        bands = {'sst': {'type': '>i2', 'scale': 0.01, '_FillValue': -32768}}
+        n = Nansat.from_domain(d, np.zeros(d.shape(), np.float32), parameters={'name': 'sst'})
+        n.export_append(self.tmp_filename, bands, time=datetime.datetime(2016, 1, 1))
+        write_thredds_band = Exporter._write_thredds_band
+
+        def write_and_fail(*args, **kwargs):
+            write_thredds_band(*args, **kwargs)
+            raise IOError('Disk is full')
+
+        with patch.object(Exporter, '_write_thredds_band', autospec=True,
+                          side_effect=write_and_fail):
+            with self.assertRaises(IOError):
+                n.export_append(self.tmp_filename, bands, time=datetime.datetime(2016, 1, 2))
+        nc = Dataset(self.tmp_filename)
+        self.assertTrue(np.ma.is_masked(nc.variables['time'][1]))
+        nc.close()
+
+        # the failed time slice is overwritten
+        array = np.ones(d.shape(), np.float32)
+        n = Nansat.from_domain(d, array, parameters={'name': 'sst'})
+        n.export_append(self.tmp_filename, bands, time=datetime.datetime(2016, 1, 3))
+        nc = Dataset(self.tmp_filename)
+        np.testing.assert_allclose(nc.variables['time'][:], [42368, 42370])
+        np.testing.assert_allclose(nc.variables['sst'][1][::-1], array, atol=0.01)
+        nc.close()
+
+    @unittest.skipUnless(MATPLOTLIB_IS_INSTALLED, 'Matplotlib is required')
+    def test_export_many(self):
+        n = Nansat(self.test_file_arctic, mapper=self.default_mapper, log_level=40)
+        tif_filename = os.path.join(self.tmp_data_path, 'nansat_export_many.tif')
+        png_filename = os.path.join(self.tmp_data_path, 'nansat_export_many.png')
+        hardcopy_bands = VRT.hardcopy_bands
+        scratch_filenames = []
+
+        def hardcopy_bands_to_disk(vrt, *args, **kwargs):
+            hardcopy_bands(vrt, *args, **kwargs)
+            for band_vrt in vrt.band_vrts.values():
+                scratch_filenames.append(band_vrt.filename)
+                scratch_filenames.append(band_vrt.filename.replace('.vrt', '.raw'))
+
+        with patch.object(VRT, 'hardcopy_bands', autospec=True,
+                          side_effect=hardcopy_bands_to_disk) as mock_hardcopy_bands:
+            n.export_many([{'filename': self.tmp_filename},
+                           {'filename': tif_filename, 'driver': 'GTiff'},
+                           {'filename': png_filename, 'method': 'write_figure',
+                            'bands': 'Bristol', 'max_size': 50}], bands=['Bristol'])
+            self.assertEqual(mock_hardcopy_bands.call_count, 1)
+            self.assertEqual(mock_hardcopy_bands.call_args[1]['nomem'], True)
+
+        # scratch files are written on disk and deleted
+        self.assertEqual(len(scratch_filenames), 2)
+        for scratch_filename in scratch_filenames:
+            self.assertFalse(scratch_filename.startswith('/vsimem/'))
+            self.assertFalse(os.path.exists(scratch_filename))
+
+        exported = Nansat(self.tmp_filename, mapper=self.default_mapper)
+        np.testing.assert_allclose(exported['Bristol'], n['Bristol'])
+        np.testing.assert_allclose(gdal.Open(tif_filename).ReadAsArray(), n['Bristol'])
+        self.assertTrue(os.path.exists(png_filename))
+        self.assertLessEqual(max(plt.imread(png_filename).shape[:2]), 50)
+
+    def test_export_many_wrong_method(self):
+        n = Nansat(self.test_file_arctic, mapper=self.default_mapper, log_level=40)
+        with self.assertRaises(ValueError):
+            n.export_many([{'filename': self.tmp_filename, 'method': 'crop'}])
+
     def test_export_netcdf_complex_remove_meta(self):
         n = Nansat(self.test_file_complex, mapper=self.default_mapper)
         self.assertEqual(n.get_metadata('PRODUCT_TYPE'), 'SLC')
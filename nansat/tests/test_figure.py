@@ -133,6 +133,39 @@ class FigureTest(NansatTestBase):
         f.apply_logarithm()
         self.assertTrue(np.allclose(np.ones((1,2,2))*0.31622777, f.array))
 
+    def test_convert_to_image_array(self):
+        np.random.seed(0)
+        for dtype in ['uint8', 'int16', 'int32', 'float32', 'float64']:
+            for logarithm in [True, False]:
+                array = (np.random.randn(3, 200, 300) * 100).astype(dtype)
+                f1 = Figure(array, cmin=[-50, 0, 50.5], cmax=[50, 100, -10], logarithm=logarithm)
+                f1.clip()
+                if logarithm:
+                    f1.apply_logarithm()
+                f1.convert_palettesize()
+                f2 = Figure(array, cmin=[-50, 0, 50.5], cmax=[50, 100, -10], logarithm=logarithm)
+                f2.CONVERT_BLOCK_SIZE = 300 * 7
+                f2.convert_to_image_array()
+
+                self.assertEqual(f2.array.dtype, np.uint8)
+                self.assertEqual(f1.cmin, f2.cmin)
+                np.testing.assert_array_equal(f1.array, f2.array)
+
+    def test_convert_to_image_array_legend(self):
+        f = Figure(np.random.randn(50, 40), legend=True)
+        f.convert_to_image_array()
+
+        self.assertEqual(f.image_array.shape, (1, 55, 40))
+        self.assertEqual(f.array.shape, (1, 50, 40))
+        self.assertTrue((f.image_array[:, 50:, :] == 255).all())
+
+    def test_init_no_copy(self):
+        array = np.ones((1, 2, 2), 'float32')
+        f = Figure(array, copy=False)
+        f.convert_to_image_array()
+
+        self.assertEqual(array[0, 0, 0], 249)
+
     @patch.object(Figure, '__init__', return_value=None)
     def test_make_transparent_color(self, mock1):
         f = Figure()
@@ -1,7 +1,948 @@
-import unittest 
+import os
+import shutil
+import datetime
+import json
+import hashlib
+import tarfile
+import zipfile
+import tempfile
+import unittest
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from mock import Mock, patch
+from netCDF4 import Dataset
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    from inspect import getargspec
+
+from nansat.nsr import NSR
+from nansat.nansat import Nansat, _list_mappers, _load_mapper
+from nansat.exceptions import WrongMapperError
+from nansat.mappers.envisat import Envisat
+from nansat.mappers import aapp
+from nansat.mappers.sentinel1 import read_lut, LUTInterpolator
+from nansat.mappers.opendap import Opendap
+from nansat.mappers import globcolour
+from nansat.mappers.mapper_netcdf_cf import Mapper as NetcdfCF
+from nansat.mappers import downloads
+from nansat.mappers import archives
+from nansat.mappers.signatures import (MAPPER_SIGNATURES, match_signature, select_mappers,
+                                       read_header, get_header_size)
+from nansat.tests import nansat_test_data as ntd
+
+
+class NetcdfCFStandIn(NetcdfCF):
+    """NetCDF-CF mapper with input file only and without VRT"""
+
+    def __init__(self, filename):
+        self.input_filename = filename
+
+    def __del__(self):
+        if self._ds is not None:
+            self._ds.close()
+
 
 class NetCDFCFMapperTests(unittest.TestCase):
 
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'netcdf_cf_times.nc')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_file(self, values, units, var_name='time', standard_name=None):
+        with Dataset(self.filename, 'w') as ds:
+            ds.createDimension(var_name, len(values))
+            var = ds.createVariable(var_name, 'f8', (var_name,))
+            var[:] = values
+            var.units = units
+            if standard_name:
+                var.standard_name = standard_name
+
     def test_init(self):
         pass
 
+    def test_times_seconds(self):
+        self.create_file([0, 1.5, 86400], 'seconds since 2000-01-01 00:00:00')
+        times = NetcdfCFStandIn(self.filename).times()
+
+        self.assertEqual(times.dtype, np.dtype('datetime64[us]'))
+        self.assertEqual(times.tolist(), [datetime.datetime(2000, 1, 1),
+                                          datetime.datetime(2000, 1, 1, 0, 0, 1, 500000),
+                                          datetime.datetime(2000, 1, 2)])
+
+    def test_times_hours_and_days(self):
+        self.create_file([0, 6, 30.5], 'hours since 2000-01-01 00:00:00')
+        times = NetcdfCFStandIn(self.filename).times()
+        self.assertEqual(times.tolist(), [datetime.datetime(2000, 1, 1),
+                                          datetime.datetime(2000, 1, 1, 6),
+                                          datetime.datetime(2000, 1, 2, 6)])
+
+        self.create_file([1, 365], 'days since 1970-01-01', var_name='t',
+                         standard_name='time')
+        times = NetcdfCFStandIn(self.filename).times()
+        self.assertEqual(times.tolist(), [datetime.datetime(1970, 1, 2),
+                                          datetime.datetime(1971, 1, 1)])
+
+    def test_times_same_as_scalar_conversion(self):
+        self.create_file(np.arange(0, 10000, 0.25), 'seconds since 2010-03-01 12:00:00')
+        mapper = NetcdfCFStandIn(self.filename)
+        times = mapper.times()
+
+        self.assertEqual(times[7], mapper._time_count_to_np_datetime64(1.75))
+        self.assertEqual(times[-1], np.datetime64(datetime.datetime(2010, 3, 1, 12) +
+                                                  datetime.timedelta(seconds=9999.75)))
+
+    def test_times_cached(self):
+        self.create_file([0, 1], 'days since 2000-01-01')
+        mapper = NetcdfCFStandIn(self.filename)
+        times1 = mapper.times()
+        ds = mapper.ds
+        mapper._time_counts_to_np_datetime64 = Mock()
+
+        self.assertIs(mapper.times(), times1)
+        self.assertIs(mapper.ds, ds)
+        self.assertFalse(mapper._time_counts_to_np_datetime64.called)
+
+    def test_times_wrong_units(self):
+        self.create_file([0, 1], 'months since 2000-01-01')
+        with self.assertRaises(Exception):
+            NetcdfCFStandIn(self.filename).times()
+
+
+class MapperSignaturesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.gdal_dataset = Mock()
+        self.gdal_dataset.GetDriver.return_value.ShortName = 'GTiff'
+        self.gdal_dataset.GetGeoTransform.return_value = (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+    def test_match_filename(self):
+        signature = {'filename': [r'(^|/)S1[AB][^/]*/?$']}
+        self.assertTrue(match_signature(signature, '/data/S1A_EW_GRDM.SAFE/', None, [], b''))
+        self.assertFalse(match_signature(signature, '/data/S2A_MSIL1C.SAFE', None, [], b''))
+
+    def test_match_metadata(self):
+        signature = {'metadata': [r'^MPH_PRODUCT=ASA_']}
+        self.assertTrue(match_signature(signature, 'file.N1', None,
+                                        ['MPH_PRODUCT=ASA_WSM_1P'], b''))
+        self.assertFalse(match_signature(signature, 'file.N1', None,
+                                         ['MPH_PRODUCT=MER_RR__1P'], b''))
+
+    def test_match_magic(self):
+        signature = {'magic': [(2, b'\x01\x00')]}
+        self.assertTrue(match_signature(signature, 'file', None, [], b'\xff\xff\x01\x00'))
+        self.assertFalse(match_signature(signature, 'file', None, [], b'\xff\xff\x02\x00'))
+        self.assertFalse(match_signature(signature, 'file', None, [], b''))
+
+    def test_match_driver_and_geotransform(self):
+        self.assertTrue(match_signature({'driver': ['GTiff']}, 'file', self.gdal_dataset, [], b''))
+        self.assertFalse(match_signature({'driver': ['GRIB']}, 'file', self.gdal_dataset, [], b''))
+        self.assertTrue(match_signature({'geotransform': [(0.0, 1.0)]}, 'file',
+                                        self.gdal_dataset, [], b''))
+        self.assertFalse(match_signature({'geotransform': [(-0.25, 0.5)]}, 'file',
+                                         self.gdal_dataset, [], b''))
+
+    def test_select_mappers_keeps_order_and_unsigned(self):
+        signatures = {'mapper_a': {'filename': ['nomatch']},
+                      'mapper_b': {'metadata': ['^key=value$']}}
+        candidates = select_mappers(['mapper_c', 'mapper_b', 'mapper_a', 'mapper_generic'],
+                                    'file.tif', None, {'key': 'value'}, signatures)
+        self.assertEqual(candidates, ['mapper_c', 'mapper_b', 'mapper_generic'])
+
+    def test_select_mappers_geotiff(self):
+        filename = os.path.join(ntd.test_data_path, 'stere.tif')
+        candidates = select_mappers(sorted(MAPPER_SIGNATURES), filename, self.gdal_dataset,
+                                    {'AREA_OR_POINT': 'Area'})
+        self.assertEqual(candidates, [])
+
+    def test_read_header(self):
+        filename = os.path.join(ntd.test_data_path, 'stere.tif')
+        self.assertEqual(len(read_header(filename, 4)), 4)
+        self.assertEqual(read_header(ntd.test_data_path, 4), b'')
+        self.assertEqual(read_header('http://example.com/file.nc', 4), b'')
+
+    def test_get_header_size(self):
+        self.assertEqual(get_header_size([{'magic': [(76, b'\x01\x00')]}, {}]), 78)
+        self.assertEqual(get_header_size([{}]), 0)
+
+
+class MapperMetadataOnlyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_safe_dir(self):
+        """Create directory with structure of Sentinel-1 SAFE product (GeoTIFF from test data)"""
+        safe_dir = os.path.join(self.tmp_dir, 'S1A_EW_GRDM_1SDH_20180101T000000.SAFE')
+        stem = 's1a-ew-grd-hh-20180101t000000-20180101t000100-000001-000001-001'
+        for subdir in ['measurement', 'annotation/calibration']:
+            os.makedirs(os.path.join(safe_dir, subdir))
+        shutil.copy(os.path.join(ntd.test_data_path, 'stere.tif'),
+                    os.path.join(safe_dir, 'measurement', stem + '.tiff'))
+        for filename in ['annotation/%s.xml' % stem,
+                         'annotation/calibration/calibration-%s.xml' % stem,
+                         'annotation/calibration/noise-%s.xml' % stem,
+                         'manifest.safe']:
+            with open(os.path.join(safe_dir, filename), 'w') as f:
+                f.write('<xml/>')
+        return safe_dir
+
+    def test_sentinel1_metadata_only(self):
+        mapper_class = _load_mapper('mapper_sentinel1_l1')
+        if isinstance(mapper_class, tuple):
+            self.skipTest('mapper_sentinel1_l1 cannot be imported')
+        safe_dir = self.create_safe_dir()
+        init_empty = lambda mapper, manifest_data, annotation_data: (
+            super(mapper_class, mapper).__init__(273, 265))
+        with patch.multiple(mapper_class, read_annotation=Mock(return_value={}),
+                            read_manifest_data=Mock(return_value={}),
+                            _init_empty=init_empty, read_lut_file=Mock(),
+                            vrts_from_arrays=Mock()):
+            mapper = mapper_class(safe_dir, None, None, metadata_only=True)
+            self.assertFalse(mapper.read_lut_file.called)
+            self.assertFalse(mapper.vrts_from_arrays.called)
+
+        self.assertEqual(mapper.dataset.RasterCount, 1)
+        self.assertEqual(mapper.dataset.GetRasterBand(1).GetMetadataItem('name'), 'DN_HH')
+        self.assertEqual(mapper.band_vrts, {})
+        self.assertIsNone(mapper.luts)
+
+    def test_netcdf_cf_metadata_only(self):
+        filename = os.path.join(self.tmp_dir, 'complex.nc')
+        with Dataset(filename, 'w') as ds:
+            ds.Conventions = 'CF-1.6'
+            ds.createDimension('y', 3)
+            ds.createDimension('x', 4)
+            ds.createVariable('y', 'f4', ('y',))[:] = [60, 50, 40]
+            ds.createVariable('x', 'f4', ('x',))[:] = [0, 10, 20, 30]
+            ds.createVariable('wind_real', 'f4', ('y', 'x'))[:] = 1
+            ds.createVariable('wind_imag', 'f4', ('y', 'x'))[:] = 2
+        n_full = Nansat(filename, mapper='netcdf_cf', log_level=40)
+        n_meta = Nansat(filename, mapper='netcdf_cf', log_level=40, metadata_only=True)
+        names_full = [band['name'] for band in n_full.bands().values()]
+        names_meta = [band['name'] for band in n_meta.bands().values()]
+
+        self.assertIn('wind', names_full)
+        self.assertNotIn('wind', names_meta)
+        self.assertIn('wind_real', names_meta)
+
+    def test_metadata_only_fallback(self):
+        # mappers without lightweight mode create the full set of bands
+        filename = os.path.join(ntd.test_data_path, 'stere.tif')
+        n_full = Nansat(filename, mapper='generic', log_level=40)
+        n_meta = Nansat(filename, mapper='generic', log_level=40, metadata_only=True)
+
+        self.assertEqual(n_meta.bands(), n_full.bands())
+        self.assertEqual(n_meta.vrt.xml.count('<VRTRasterBand'),
+                         n_full.vrt.xml.count('<VRTRasterBand'))
+
+    def test_all_mappers_accept_metadata_only(self):
+        for mapper_name in _list_mappers():
+            mapper_class = _load_mapper(mapper_name)
+            if mapper_class is None or isinstance(mapper_class, tuple):
+                # mapper cannot be imported (e.g. missing dependencies)
+                continue
+            argspec = getargspec(mapper_class.__init__)
+            self.assertTrue('metadata_only' in argspec[0] or argspec[2] is not None,
+                            '%s does not accept metadata_only' % mapper_name)
+
+
+class EnvisatTests(unittest.TestCase):
+
+    def setUp(self):
+        # fake ASAR file with text header and GEOLOCATION GRID ADS of 3 DSRs
+        self.num_dsr, self.dsr_size, self.ds_offset = 3, 521, 10000
+        header = ['MPH_PRODUCT="ASA_WSM_1P"\n',
+                  'DS_NAME="GEOLOCATION GRID ADS        "\n',
+                  'DS_TYPE=A\n',
+                  'FILENAME=\n',
+                  'DS_OFFSET=+%020d<bytes>\n' % self.ds_offset,
+                  'DS_SIZE=+%020d<bytes>\n' % (self.num_dsr * self.dsr_size),
+                  'NUM_DSR=+%010d\n' % self.num_dsr,
+                  'DSR_SIZE=+%010d<bytes>\n' % self.dsr_size]
+        header += ['\n'] * 150
+        self.lats = np.arange(self.num_dsr * 11).reshape(self.num_dsr, 11) * 1000000
+        self.last_lats = self.lats[-1] + 1000000
+        records = np.zeros((self.num_dsr, self.dsr_size), np.uint8)
+        lats_offset = 25 + 11 * 4 * 3
+        last_lats_offset = 25 + 11 * 4 * 5 + 34 + 11 * 4 * 3
+        for i in range(self.num_dsr):
+            records[i, lats_offset:lats_offset + 44] = np.frombuffer(
+                self.lats[i].astype('>i4').tobytes(), np.uint8)
+            records[i, last_lats_offset:last_lats_offset + 44] = np.frombuffer(
+                (self.lats[i] + 1000000).astype('>i4').tobytes(), np.uint8)
+        fd, self.filename = tempfile.mkstemp(suffix='.N1')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(''.join(header).encode().ljust(self.ds_offset))
+            f.write(records.tobytes())
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_get_array_from_ADS(self):
+        envisat = Envisat()
+        envisat.setup_ads_parameters(self.filename, {'MPH_PRODUCT': 'ASA_WSM_1P'})
+        lats = envisat.get_array_from_ADS('first_line_lats')
+
+        self.assertEqual(envisat.dsOffsetDict['NUM_DSR'], self.num_dsr)
+        self.assertEqual(envisat.dsOffsetDict['DS_OFFSET'], self.ds_offset)
+        self.assertEqual(lats.shape, (self.num_dsr + 1, 11))
+        self.assertTrue(np.allclose(lats[:-1], self.lats / 1000000.))
+        self.assertTrue(np.allclose(lats[-1], self.last_lats / 1000000.))
+
+    def test_read_binary_line(self):
+        envisat = Envisat()
+        envisat.setup_ads_parameters(self.filename, {'MPH_PRODUCT': 'ASA_WSM_1P'})
+        values = envisat.read_binary_line(self.ds_offset + 25 + 11 * 4 * 3, '>i', 11)
+
+        self.assertEqual(values, self.lats[0].tolist())
+
+
+class AAPPTests(unittest.TestCase):
+
+    def setUp(self):
+        # fake AVHRR L1B file with header and 4 scanlines (one more than calibrated)
+        self.num_scanlines = 3
+        header = np.zeros(1, aapp.L1B_HEADER_DTYPE)
+        header['avh_h_satid'] = 12
+        header['avh_h_dataformat'] = 3
+        header['avh_h_startdatyr'] = 2010
+        header['avh_h_startdatdy'] = 32
+        header['avh_h_startdattime'] = 3600000
+        header['avh_h_calscnlin'] = self.num_scanlines
+        header['avh_h_radtempcnv'] = [[268855, 0, 1000000],
+                                      [927550, 0, 1000000],
+                                      [833660, 0, 1000000]]
+        scanlines = np.zeros(self.num_scanlines + 1, aapp.L1B_SCANLINE_DTYPE)
+        self.lat = np.arange(self.num_scanlines + 1)[:, None] + np.zeros((1, aapp.TIE_POINTS))
+        self.lon = np.zeros((self.num_scanlines + 1, 1)) + np.arange(aapp.TIE_POINTS)[None]
+        scanlines['avh_pos'][:, :, 0] = self.lat * 10000
+        scanlines['avh_pos'][:, :, 1] = self.lon * 10000
+        scanlines['avh_ang'][:, :, 0] = 4500
+        # satellite zenith angle equals number of the tie point
+        scanlines['avh_ang'][:, :, 1] = np.arange(aapp.TIE_POINTS) * 100
+        scanlines['avh_scnlinbit'] = [0, 1, 0, 1]
+        # radiance = 1 + 0.5 * counts (stored as a2, a1, a0 with power of 10 in filler2)
+        scanlines['avh_calir'][:, :, 0, :] = [0, 5, 10]
+        scanlines['avh_filler2'] = [0, 1, 1]
+        fd, self.filename = tempfile.mkstemp(suffix='.l1b')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(scanlines.tobytes())
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_dtypes(self):
+        self.assertEqual(aapp.L1B_HEADER_DTYPE.itemsize, aapp.L1B_RECORD_LENGTH)
+        self.assertEqual(aapp.L1B_SCANLINE_DTYPE.itemsize, aapp.L1B_RECORD_LENGTH)
+        self.assertEqual(aapp.L1C_SCANLINE_DTYPE.itemsize, aapp.L1C_RECORD_LENGTH)
+        self.assertEqual(aapp.L1B_SCANLINE_DTYPE.fields['avh_pixels'][1], 1264)
+
+    def test_read_l1b(self):
+        aapp_file = aapp.read_l1b(self.filename)
+        lon, lat = aapp_file.get_lonlat()
+        solar_zenith, satellite_zenith, relative_azimuth = aapp_file.get_angles()
+
+        self.assertEqual(aapp_file.num_scanlines, self.num_scanlines)
+        self.assertEqual(aapp_file.get_time(), datetime.datetime(2010, 2, 1, 1))
+        self.assertEqual(aapp_file.get_field_offset('avh_pixels'), 22016 + 1264)
+        self.assertTrue(np.allclose(lon, self.lon[:self.num_scanlines]))
+        self.assertTrue(np.allclose(lat, self.lat[:self.num_scanlines]))
+        self.assertTrue(np.allclose(solar_zenith, 45))
+        self.assertEqual(aapp_file.get_scanline_bits().tolist(), [0, 1, 0])
+
+    def test_get_ir_calibration_coefficients(self):
+        aapp_file = aapp.read_l1b(self.filename)
+        coefs = aapp_file.get_ir_calibration_coefficients()
+
+        self.assertEqual(coefs.shape, (self.num_scanlines, 3, 3))
+        self.assertTrue(np.allclose(coefs, [1, 0.5, 0]))
+
+    def test_calibrate_ir(self):
+        aapp_file = aapp.read_l1b(self.filename)
+        bt = aapp_file.calibrate_ir(np.zeros((self.num_scanlines, 10)) + 100, 1)
+
+        self.assertEqual(bt.shape, (self.num_scanlines, 10))
+        # radiance 51 mW/(m2.sr.cm-1) at 927.55 cm-1 corresponds to about 255 K
+        self.assertTrue(np.allclose(bt, 255, atol=0.1))
+
+    def test_read_l1b_wrong_file(self):
+        with self.assertRaises(WrongMapperError):
+            aapp.read_l1b(os.path.join(ntd.test_data_path, 'gcps.tif'))
+
+    def test_mapper_angles_at_tie_points(self):
+        mapper = _load_mapper('mapper_aapp_l1b')(self.filename, None, None)
+        names = [mapper.dataset.GetRasterBand(i).GetMetadataItem('name')
+                 for i in range(1, mapper.dataset.RasterCount + 1)]
+        band = mapper.dataset.GetRasterBand(names.index('satellite_zenith_angle') + 1)
+        angle = band.ReadAsArray()[0]
+
+        self.assertEqual(angle.shape, (aapp.AVHRR_PIXELS,))
+        tie_point_pixels = aapp.TIE_POINT_OFFSET + np.arange(aapp.TIE_POINTS) * aapp.TIE_POINT_STEP
+        self.assertTrue(np.allclose(angle[tie_point_pixels], np.arange(aapp.TIE_POINTS)))
+        # linear interpolation between and extrapolation outside the tie points
+        self.assertAlmostEqual(angle[aapp.TIE_POINT_OFFSET + 20], 0.5, places=5)
+        self.assertAlmostEqual(angle[0], -aapp.TIE_POINT_OFFSET / float(aapp.TIE_POINT_STEP),
+                               places=5)
+
+
+class Sentinel1LUTTests(unittest.TestCase):
+
+    xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<calibration>
+  <adsHeader><polarisation>HH</polarisation></adsHeader>
+  <calibrationVectorList count="3">
+    <calibrationVector>
+      <azimuthTime>2018-01-01T00:00:00.000000</azimuthTime>
+      <line>0</line>
+      <pixel count="3">0 10 20</pixel>
+      <sigmaNought count="3">1 2 3</sigmaNought>
+      <betaNought count="3">5 5 5</betaNought>
+    </calibrationVector>
+    <calibrationVector>
+      <azimuthTime>2018-01-01T00:00:01.000000</azimuthTime>
+      <line>10</line>
+      <pixel count="3">0 10 20</pixel>
+      <sigmaNought count="3">11 12 13</sigmaNought>
+      <betaNought count="3">5 5 5</betaNought>
+    </calibrationVector>
+    <calibrationVector>
+      <azimuthTime>2018-01-01T00:00:02.000000</azimuthTime>
+      <line>19</line>
+      <pixel count="2">0 20</pixel>
+      <sigmaNought count="2">20 22</sigmaNought>
+      <betaNought count="2">5 5</betaNought>
+    </calibrationVector>
+  </calibrationVectorList>
+</calibration>
+'''
+
+    def test_read_lut(self):
+        data = read_lut(self.xml, 'calibrationVectorList', ['sigmaNought', 'betaNought'])
+
+        self.assertEqual(data['line'].tolist(), [0, 10, 19])
+        self.assertEqual(data['pixel'].tolist(), [0, 10, 20])
+        self.assertEqual(data['sigmaNought'].tolist(), [[1, 2, 3], [11, 12, 13], [20, 21, 22]])
+        self.assertEqual(data['betaNought'].shape, (3, 3))
+
+    def test_lut_interpolator(self):
+        data = read_lut(self.xml, 'calibrationVectorList', ['sigmaNought'])
+        interpolator = LUTInterpolator(data['line'], data['pixel'], data['sigmaNought'])
+        full = interpolator()
+        window = interpolator(5, 3, 10, 4)
+        decimated = interpolator(step=2)
+
+        self.assertEqual(full.shape, (20, 21))
+        self.assertEqual(full[0, 0], 1)
+        self.assertEqual(full[10, 20], 13)
+        self.assertEqual(full[5, 5], 6.5)
+        self.assertTrue(np.allclose(window, full[3:7, 5:15]))
+        self.assertTrue(np.allclose(decimated, full[::2, ::2]))
+
+    def test_lut_interpolator_regular_grid(self):
+        data = read_lut(self.xml, 'calibrationVectorList', ['sigmaNought'])
+        interpolator = LUTInterpolator(data['line'], data['pixel'], data['sigmaNought'])
+        grid = interpolator.get_regular_grid(200, 100)
+        rows = np.linspace(-0.5, 99.5, grid.shape[0])
+        cols = np.linspace(-0.5, 199.5, grid.shape[1])
+
+        # median spacing of the LUT is 10 pixels and 9.5 lines
+        self.assertEqual(grid.shape, (12, 21))
+        self.assertTrue(np.allclose(grid, interpolator.interpolate(rows, cols)))
+        # LUT is linear inside the grid: 1 + line + pixel / 10
+        self.assertTrue(np.allclose(grid[1, 1], 1 + rows[1] + cols[1] / 10.))
+
+
+class GlobcolourTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        globcolour._GRID_INDICES.clear()
+        self.latlonGrid = np.mgrid[80:50:90j, -10:30:120j].astype('float32')
+        # bins in the region and outside it
+        self.row = np.array([3500, 3600, 3700, 3800, 100, 4000])
+        self.col = np.array([4200, 4250, 4300, 4350, 10, 4400])
+        self.values = np.array([1., 2., 3., 4., 5., 6.])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def bins_to_grid_full(self):
+        """Scatter into the full GLOBCOLOUR grid and sample it (as the mapper did before)"""
+        rows, cols = globcolour.GLOBCOLOUR_ROWS, globcolour.GLOBCOLOUR_COLS
+        iBinned = self.col.astype('uint32') + (self.row.astype('uint32') - 1) * cols
+        yRawPro = np.rint(1 + (rows - 1) * (self.latlonGrid[0] + 90) / 180.)
+        lon_step_Mat = 24. * np.cos(np.pi * self.latlonGrid[0] / 180.)
+        xRawPro = np.rint(1 + (self.latlonGrid[1] + 180) * lon_step_Mat)
+        iRawPro = xRawPro.astype('uint32') + (yRawPro.astype('uint32') - 1) * cols
+        varRawPro = np.zeros([rows, cols], 'float32')
+        varRawPro.flat[iBinned] = self.values
+        return varRawPro.flat[iRawPro.flat[:]].reshape(iRawPro.shape)
+
+    def test_bins_to_grid(self):
+        grid_index = globcolour.get_grid_index(self.latlonGrid)
+        # put values into bins used by the grid
+        self.row[:4] = 1 + grid_index[0][[0, 10, 100, -1]] // globcolour.GLOBCOLOUR_COLS
+        self.col[:4] = grid_index[0][[0, 10, 100, -1]] % globcolour.GLOBCOLOUR_COLS
+        gridded = globcolour.bins_to_grid(grid_index, self.row, self.col, self.values)
+
+        self.assertEqual(gridded.shape, (90, 120))
+        self.assertEqual(gridded.dtype, np.float32)
+        self.assertTrue(np.all(gridded == self.bins_to_grid_full()))
+        self.assertEqual(set(np.unique(gridded)), set([0, 1, 2, 3, 4]))
+
+    def test_get_grid_index_cached(self):
+        grid_index1 = globcolour.get_grid_index(self.latlonGrid, self.tmp_dir)
+        globcolour._GRID_INDICES.clear()
+        with patch('numpy.unique') as mock_unique:
+            grid_index2 = globcolour.get_grid_index(self.latlonGrid, self.tmp_dir)
+
+        self.assertFalse(mock_unique.called)
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+        self.assertTrue(np.all(grid_index1[0] == grid_index2[0]))
+        self.assertTrue(np.all(grid_index1[1] == grid_index2[1]))
+        self.assertEqual(grid_index2[2], (90, 120))
+
+
+class OpendapStandIn(Opendap):
+    """Opendap with local netCDF file instead of URL and without VRT"""
+    timeVarName = 'time'
+    xName = 'x'
+    yName = 'y'
+
+    def __init__(self, filename, cachedir):
+        self.filename = filename
+        self.cachedir = cachedir
+
+    def __del__(self):
+        pass
+
+
+class OpendapTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'opendap_standin.nc')
+        self.data = np.arange(2 * 3 * 4).reshape(2, 3, 4)
+        with Dataset(self.filename, 'w') as ds:
+            ds.createDimension('time', 2)
+            ds.createDimension('y', 3)
+            ds.createDimension('x', 4)
+            ds.createVariable('time', 'f8', ('time',))[:] = [10, 11]
+            ds.createVariable('y', 'f4', ('y',))[:] = [60, 50, 40]
+            ds.createVariable('x', 'f4', ('x',))[:] = [0, 10, 20, 30]
+            var = ds.createVariable('sst', 'i2', ('time', 'y', 'x'))
+            var.scale_factor = 0.5
+            var.units = 'K'
+            var[:] = self.data * 0.5
+            ds.time_coverage_resolution = 'P1D'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_get_metadata(self):
+        opendap = OpendapStandIn(self.filename, None)
+        opendap.metadata = opendap.get_metadata()
+
+        self.assertEqual(opendap.get_dataset_time().tolist(), [10, 11])
+        self.assertEqual(opendap.get_shape(), (4, 3))
+        self.assertEqual(opendap.get_geotransform(), (0, 10, 0, 60, 0, -10))
+        self.assertEqual(opendap.get_geospatial_variable_names(), ['sst'])
+        self.assertEqual(opendap.get_time_coverage_resolution(), 86400)
+        self.assertEqual(opendap.metadata['variables']['sst']['attributes']['units'], 'K')
+
+    def test_get_metadata_cached(self):
+        opendap1 = OpendapStandIn(self.filename, self.tmp_dir)
+        metadata1 = opendap1.get_metadata()
+        opendap2 = OpendapStandIn(self.filename, self.tmp_dir)
+        opendap2.read_metadata = Mock()
+        metadata2 = opendap2.get_metadata()
+
+        self.assertTrue(os.path.exists(opendap1.get_cache_filename()))
+        self.assertFalse(opendap2.read_metadata.called)
+        self.assertEqual(metadata1['time'].tolist(), metadata2['time'].tolist())
+        self.assertEqual(metadata1['variables'], metadata2['variables'])
+
+    def test_get_metadata_cache_expired(self):
+        OpendapStandIn(self.filename, self.tmp_dir).get_metadata()
+        opendap = OpendapStandIn(self.filename, self.tmp_dir)
+        opendap.cache_ttl = -1
+        opendap.read_metadata = Mock(return_value={})
+        opendap.get_metadata()
+
+        self.assertTrue(opendap.read_metadata.called)
+
+    def test_get_metadata_cache_json(self):
+        opendap = OpendapStandIn(self.filename, self.tmp_dir)
+        opendap.get_metadata()
+        with open(opendap.get_cache_filename()) as f:
+            metadata = json.load(f)
+
+        self.assertEqual(metadata['x'], {'dtype': '<f4', 'data': [0, 10, 20, 30]})
+        self.assertEqual(metadata['variables']['sst']['attributes']['scale_factor'], 0.5)
+
+    def test_get_cropped_vrt(self):
+        opendap = OpendapStandIn(self.filename, None)
+        opendap.metadata = opendap.get_metadata()
+        opendap.dsVarNames = ['sst']
+        opendap.dsLayerNo = 1
+        get_metaitem = opendap.get_metaitem
+        def get_local_metaitem(url, var_name, layer_no):
+            # read local file with the netCDF driver instead of the DAP server
+            metaitem = get_metaitem(url, var_name, layer_no)
+            metaitem['src']['SourceFilename'] = 'NETCDF:"%s":%s' % (url, var_name)
+            metaitem['src']['SourceBand'] = layer_no + 1
+            return metaitem
+        opendap.get_metaitem = Mock(side_effect=get_local_metaitem)
+        opendap._init_from_dataset_params(4, 3, opendap.get_geotransform(), NSR().wkt)
+        opendap.create_bands([opendap.get_metaitem(self.filename, 'sst', 1)])
+        cropped_vrt = opendap.get_cropped_vrt(2, 1, 2, 2)
+
+        self.assertEqual(cropped_vrt.band_vrts, {})
+        self.assertIn('<SrcRect xOff="2" yOff="1" xSize="2" ySize="2"', cropped_vrt.xml)
+        self.assertEqual(cropped_vrt.dataset.GetRasterBand(1).DataType,
+                         opendap.dataset.GetRasterBand(1).DataType)
+        self.assertEqual(cropped_vrt.dataset.GetRasterBand(1).GetMetadataItem('units'), 'K')
+        self.assertTrue(np.allclose(cropped_vrt.dataset.ReadAsArray(),
+                                    self.data[1, 1:3, 2:4] * 0.5))
+        self.assertIsNone(opendap.get_cropped_vrt(3, 1, 2, 2))
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """Serve files from <files> dict, support single byte range requests"""
+    files = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get('Range')))
+        if self.path not in self.files:
+            self.send_error(404)
+            return
+        content = self.files[self.path]
+        byte_range = self.headers.get('Range')
+        if byte_range is None:
+            self.send_response(200)
+        else:
+            first, last = byte_range.split('=')[1].split('-')
+            last = len(content) - 1 if last == '' else int(last)
+            content = content[int(first):last + 1]
+            self.send_response(206)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_HEAD(self):
+        if self.path not in self.files:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"%s"' % hashlib.sha1(self.files[self.path]).hexdigest())
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class DownloadsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.records = [b'GRIB' + bytes(bytearray([i])) * 10 + b'7777' for i in range(4)]
+        inventory = ('1:0:d=2014050100:UGRD:10 m above ground:anl:\n'
+                     '2:18:d=2014050100:VGRD:10 m above ground:anl:\n'
+                     '3:36:d=2014050100:TMP:2 m above ground:anl:\n'
+                     '4:54:d=2014050100:UGRD:10 m above ground:3 hour fcst:\n')
+        FixtureRequestHandler.files = {'/gfs.grb2': b''.join(cls.records),
+                                       '/gfs.inv': inventory.encode()}
+        cls.server = HTTPServer(('127.0.0.1', 0), FixtureRequestHandler)
+        cls.url = 'http://127.0.0.1:%d/' % cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        FixtureRequestHandler.requests = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_inventory(self):
+        ranges = downloads.read_inventory(self.url + 'gfs.inv', ':(U|V)GRD:10 m ')
+        self.assertEqual(ranges, [(0, 35), (54, None)])
+
+    def test_download(self):
+        filename = downloads.download(self.url + 'gfs.grb2', self.tmp_dir)
+
+        self.assertEqual(os.path.splitext(filename)[1], '.grb2')
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), b''.join(self.records))
+        self.assertEqual(os.listdir(self.tmp_dir).count(os.path.basename(filename)), 1)
+        self.assertFalse(os.path.exists(filename + '.lock'))
+
+    def test_download_cached(self):
+        filename1 = downloads.download(self.url + 'gfs.grb2', self.tmp_dir)
+        filename2 = downloads.download(self.url + 'gfs.grb2', self.tmp_dir)
+
+        self.assertEqual(filename1, filename2)
+        self.assertEqual(len(FixtureRequestHandler.requests), 1)
+
+    def test_download_changed_on_server(self):
+        filename1 = downloads.download(self.url + 'gfs.grb2', self.tmp_dir)
+        content = FixtureRequestHandler.files['/gfs.grb2']
+        FixtureRequestHandler.files['/gfs.grb2'] = content[::-1]
+        try:
+            filename2 = downloads.download(self.url + 'gfs.grb2', self.tmp_dir)
+        finally:
+            FixtureRequestHandler.files['/gfs.grb2'] = content
+
+        self.assertNotEqual(filename1, filename2)
+        with open(filename2, 'rb') as fp:
+            self.assertEqual(fp.read(), content[::-1])
+        self.assertEqual(len(FixtureRequestHandler.requests), 2)
+
+    def test_download_keyed_by_content(self):
+        sha1 = hashlib.sha1(FixtureRequestHandler.files['/gfs.grb2']).hexdigest()
+        filename = downloads.download(self.url + 'gfs.grb2', self.tmp_dir, sha1=sha1)
+
+        self.assertEqual(os.path.basename(filename), sha1 + '.grb2')
+        with open(filename + '.sha1') as fp:
+            self.assertEqual(fp.read(), sha1)
+
+    def test_download_corrupted_cache(self):
+        filename = downloads.download(self.url + 'gfs.grb2', self.tmp_dir)
+        with open(filename, 'wb') as fp:
+            fp.write(b'corrupted')
+        filename = downloads.download(self.url + 'gfs.grb2', self.tmp_dir)
+
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), b''.join(self.records))
+        self.assertEqual(len(FixtureRequestHandler.requests), 2)
+
+    def test_download_with_inventory(self):
+        filename = downloads.download(self.url + 'gfs.grb2', self.tmp_dir,
+                                      inventory_url=self.url + 'gfs.inv',
+                                      pattern=':(U|V)GRD:10 m ')
+
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), self.records[0] + self.records[1] + self.records[3])
+        self.assertIn(('/gfs.grb2', 'bytes=0-35'), FixtureRequestHandler.requests)
+        self.assertIn(('/gfs.grb2', 'bytes=54-'), FixtureRequestHandler.requests)
+
+    def test_download_file_url_with_inventory(self):
+        grib_filename = os.path.join(self.tmp_dir, 'gfs.grb2')
+        inv_filename = os.path.join(self.tmp_dir, 'gfs.inv')
+        with open(grib_filename, 'wb') as fp:
+            fp.write(FixtureRequestHandler.files['/gfs.grb2'])
+        with open(inv_filename, 'wb') as fp:
+            fp.write(FixtureRequestHandler.files['/gfs.inv'])
+        filename = downloads.download('file://' + grib_filename, self.tmp_dir,
+                                      inventory_url='file://' + inv_filename, pattern=':TMP:')
+
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), self.records[2])
+
+    def test_download_wrong_checksum(self):
+        with self.assertRaises(IOError):
+            downloads.download(self.url + 'gfs.grb2', self.tmp_dir, sha1='0' * 40)
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_download_not_found(self):
+        with self.assertRaises(IOError):
+            downloads.download(self.url + 'missing.grb2', self.tmp_dir, backoff=0)
+        # client errors are not retried
+        self.assertEqual(len(FixtureRequestHandler.requests), 1)
+
+    def test_open_url_retry(self):
+        urlopen = downloads.urlopen
+        with patch('nansat.mappers.downloads.time.sleep') as mock_sleep:
+            calls = []
+
+            def flaky_urlopen(*args, **kwargs):
+                calls.append(args)
+                if len(calls) < 3:
+                    raise downloads.URLError('timeout')
+                return urlopen(*args, **kwargs)
+
+            with patch('nansat.mappers.downloads.urlopen', flaky_urlopen):
+                response, partial = downloads.open_url(self.url + 'gfs.inv', backoff=1)
+            response.close()
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([c[0][0] for c in mock_sleep.call_args_list], [1, 2])
+
+    def test_download_first(self):
+        filename = downloads.download_first([{'url': self.url + 'missing.grb2'},
+                                             {'url': self.url + 'gfs.grb2'}], self.tmp_dir)
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(), b''.join(self.records))
+
+    def test_prefetch(self):
+        filenames = downloads.prefetch([[{'url': self.url + 'gfs.grb2'}],
+                                        [{'url': self.url + 'missing.grb2'}],
+                                        [{'url': self.url + 'gfs.inv'}],
+                                        [{'url': self.url + 'gfs.grb2'}]], self.tmp_dir)
+
+        self.assertEqual(filenames[0], filenames[3])
+        self.assertIsNone(filenames[1])
+        self.assertTrue(os.path.exists(filenames[2]))
+        # the same file is not downloaded twice
+        self.assertEqual([r[0] for r in FixtureRequestHandler.requests].count('/gfs.grb2'), 1)
+
+    def test_file_lock_stale(self):
+        filename = os.path.join(self.tmp_dir, 'file')
+        with open(filename + '.lock', 'w'):
+            pass
+        os.utime(filename + '.lock', (0, 0))
+        with downloads.FileLock(filename, stale=1):
+            self.assertTrue(os.path.exists(filename + '.lock'))
+        self.assertFalse(os.path.exists(filename + '.lock'))
+
+    def test_file_lock_timeout(self):
+        filename = os.path.join(self.tmp_dir, 'file')
+        with downloads.FileLock(filename):
+            with self.assertRaises(IOError):
+                downloads.FileLock(filename, timeout=0.2, poll=0.05).acquire()
+
+
+class ArchivesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        archives._ARCHIVE_INDICES.clear()
+        self.members = [('S1A_TEST.SAFE/manifest.safe', b'<manifest/>'),
+                        ('S1A_TEST.SAFE/measurement/s1a-iw-grd-hh.tiff', b'hh' * 1000),
+                        ('S1A_TEST.SAFE/measurement/s1a-iw-grd-hv.tiff', b'hv' * 1000)]
+        for name, content in self.members:
+            filename = os.path.join(self.tmp_dir, name)
+            if not os.path.exists(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'wb') as fp:
+                fp.write(content)
+        self.zip_filename = os.path.join(self.tmp_dir, 'S1A_TEST.zip')
+        with zipfile.ZipFile(self.zip_filename, 'w', zipfile.ZIP_DEFLATED) as zz:
+            for name, content in self.members:
+                zz.write(os.path.join(self.tmp_dir, name), name)
+        self.tar_filenames = {}
+        for ext, mode in [('.tar', 'w'), ('.tar.gz', 'w:gz')]:
+            self.tar_filenames[ext] = os.path.join(self.tmp_dir, 'S1A_TEST' + ext)
+            with tarfile.open(self.tar_filenames[ext], mode) as tar:
+                for name, content in self.members:
+                    tar.add(os.path.join(self.tmp_dir, name), name)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_zip(self):
+        archive = archives.get_archive_index(self.zip_filename)
+
+        self.assertEqual(archive.kind, 'zip')
+        self.assertEqual(archive.names(), [name for name, content in self.members])
+        self.assertEqual(archive.vsi_paths('*measurement/s1*'),
+                         ['/vsizip/%s/%s' % (self.zip_filename, name)
+                          for name, content in self.members[1:]])
+        self.assertEqual(archive.read(self.members[2][0]), self.members[2][1])
+
+    def test_tar(self):
+        archive = archives.get_archive_index(self.tar_filenames['.tar'])
+        offset, size = archive.members[self.members[1][0]]
+        with open(self.tar_filenames['.tar'], 'rb') as fp:
+            fp.seek(offset)
+            content = fp.read(size)
+
+        self.assertEqual(archive.kind, 'tar')
+        self.assertEqual(content, self.members[1][1])
+        self.assertEqual(archive.vsi_path(self.members[1][0]),
+                         '/vsisubfile/%d_%d,%s' % (offset, size, self.tar_filenames['.tar']))
+        self.assertEqual(archive.read(self.members[0][0]), self.members[0][1])
+
+    def test_tar_gz(self):
+        archive = archives.get_archive_index(self.tar_filenames['.tar.gz'])
+
+        self.assertTrue(archive.vsi_path(self.members[1][0]).endswith(
+            ',/vsigzip/' + self.tar_filenames['.tar.gz']))
+        self.assertEqual(archive.read(self.members[2][0]), self.members[2][1])
+
+    def test_tar_gz_extract(self):
+        with patch.dict(os.environ, {'NANSAT_CACHE_DIR': self.tmp_dir}):
+            archive = archives.get_archive_index(self.tar_filenames['.tar.gz'], extract=True)
+
+        self.assertTrue(tarfile.is_tarfile(archive.data_filename))
+        self.assertEqual(os.path.dirname(archive.data_filename), self.tmp_dir)
+        self.assertFalse(archive.gzipped)
+        self.assertTrue(archive.vsi_path(self.members[1][0]).endswith(
+            ',' + archive.data_filename))
+        self.assertEqual(archive.read(self.members[2][0]), self.members[2][1])
+
+    def test_tar_gz_extract_without_cache_dir(self):
+        with patch.dict(os.environ, {'NANSAT_CACHE_DIR': ''}):
+            archive = archives.get_archive_index(self.tar_filenames['.tar.gz'], extract=True)
+            archives._ARCHIVE_INDICES.clear()
+            archive2 = archives.get_archive_index(self.tar_filenames['.tar.gz'], extract=True)
+
+        scratch_filename = archive.data_filename
+        self.assertEqual(os.path.dirname(scratch_filename), tempfile.gettempdir())
+        self.assertEqual(archive2.data_filename, scratch_filename)
+        self.assertIn(scratch_filename, archives._SCRATCH_FILES.values())
+        self.assertEqual(archive.read(self.members[2][0]), self.members[2][1])
+        archives._remove_scratch_files()
+        self.assertFalse(os.path.exists(scratch_filename))
+        self.assertEqual(archives._SCRATCH_FILES, {})
+
+    def test_get_archive_index_cached(self):
+        archive1 = archives.get_archive_index(self.zip_filename)
+        with patch.object(archives.ArchiveIndex, '_scan_zip') as mock_scan_zip:
+            archive2 = archives.get_archive_index(self.zip_filename)
+
+        self.assertIs(archive1, archive2)
+        self.assertFalse(mock_scan_zip.called)
+
+    def test_get_archive_index_cached_on_disk(self):
+        with patch.dict(os.environ, {'NANSAT_CACHE_DIR': self.tmp_dir}):
+            archive1 = archives.get_archive_index(self.tar_filenames['.tar'])
+            archives._ARCHIVE_INDICES.clear()
+            with patch.object(archives.ArchiveIndex, '_scan_tar') as mock_scan_tar:
+                archive2 = archives.get_archive_index(self.tar_filenames['.tar'])
+
+        self.assertFalse(mock_scan_tar.called)
+        self.assertEqual(archive1.members, archive2.members)
+        self.assertEqual(archive1.vsi_paths(), archive2.vsi_paths())
+        cache_files = [f for f in os.listdir(self.tmp_dir) if f.startswith('archive_')]
+        with open(os.path.join(self.tmp_dir, cache_files[0])) as f:
+            self.assertEqual(json.load(f)['kind'], 'tar')
+
+    def test_get_archive_index_bounded(self):
+        with patch.object(archives, 'MAX_ARCHIVE_INDICES', 2):
+            zip_archive = archives.get_archive_index(self.zip_filename)
+            archives.get_archive_index(self.tar_filenames['.tar'])
+            # zip index becomes the most recently used and tar index is removed
+            archives.get_archive_index(self.zip_filename)
+            archives.get_archive_index(self.tar_filenames['.tar.gz'])
+
+        self.assertEqual(len(archives._ARCHIVE_INDICES), 2)
+        self.assertIn(zip_archive, archives._ARCHIVE_INDICES.values())
+        self.assertNotIn(archives._get_key(self.tar_filenames['.tar'], False),
+                         archives._ARCHIVE_INDICES)
+
+    def test_not_archive(self):
+        self.assertIsNone(archives.get_archive_index(
+            os.path.join(self.tmp_dir, self.members[0][0])))
+        self.assertIsNone(archives.get_archive_index(self.tmp_dir))
@@ -18,8 +18,12 @@ import logging
 import unittest
 import warnings
 import datetime
+import json
+import shutil
+import tempfile
 from mock import patch, PropertyMock, Mock, MagicMock, DEFAULT
 import numpy as np
+from netCDF4 import Dataset
 
 try:
     if 'DISPLAY' not in os.environ:
@@ -32,6 +36,11 @@ else:
     MATPLOTLIB_IS_INSTALLED = True
 
 from nansat import Nansat, Domain, NSR
+from nansat import nansat as nansat_module
+from nansat.mappers import mapper_generic
+from nansat.mappers.sentinel1 import LUTInterpolator
+from nansat.vrt import VRT
+from nansat.geolocation import Geolocation
 from nansat.tools import gdal
 from nansat.warnings import NansatFutureWarning
 from nansat.exceptions import NansatGDALError, WrongMapperError, NansatReadError
@@ -490,6 +499,78 @@ class NansatTest(NansatTestBase):
 
         self.assertTrue(os.path.exists(tmpfilename))
 
+    def test_band_stats(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        array = n1[1].astype('float64')
+        array = array[np.isfinite(array)]
+        stats = n1.band_stats(1, percentiles=[0, 50, 100], approx=False)
+        bin_width = (array.max() - array.min()) / float(Nansat.STATS_BINS)
+
+        self.assertEqual(stats['count'], array.size)
+        self.assertEqual(stats['histogram'].sum(), array.size)
+        self.assertAlmostEqual(stats['min'], array.min())
+        self.assertAlmostEqual(stats['max'], array.max())
+        self.assertAlmostEqual(stats['mean'], array.mean())
+        self.assertAlmostEqual(stats['std'], array.std())
+        self.assertAlmostEqual(stats['percentiles'][0], array.min())
+        self.assertAlmostEqual(stats['percentiles'][2], array.max())
+        self.assertTrue(abs(stats['percentiles'][1] - np.median(array)) <= bin_width)
+        self.assertEqual(n1.get_metadata('STATISTICS_APPROXIMATE', 1), 'NO')
+
+    def test_band_stats_blocks(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        stats = n1.band_stats(1, approx=False)
+        n2 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        with patch.object(Nansat, 'STATS_BLOCK_SIZE', n2.shape()[1] * 3):
+            stats_blocks = n2.band_stats(1, approx=False)
+
+        self.assertAlmostEqual(stats['mean'], stats_blocks['mean'])
+        self.assertAlmostEqual(stats['std'], stats_blocks['std'])
+        np.testing.assert_array_equal(stats['histogram'], stats_blocks['histogram'])
+
+    def test_band_stats_cached(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        stats1 = n1.band_stats(1)
+        with patch.object(Nansat, '_compute_band_stats') as mock_compute_band_stats:
+            stats2 = n1.band_stats(1)
+
+        mock_compute_band_stats.assert_not_called()
+        self.assertEqual(stats1['mean'], stats2['mean'])
+        np.testing.assert_array_equal(stats1['histogram'], stats2['histogram'])
+        np.testing.assert_array_equal(stats1['percentiles'], stats2['percentiles'])
+
+    def test_band_stats_cache_invalidated(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        stats1 = n1.band_stats(1, approx=False)
+        n1.crop(0, 0, 10, 10)
+        stats2 = n1.band_stats(1, approx=False)
+
+        self.assertNotEqual(stats1['count'], stats2['count'])
+        self.assertEqual(stats2['count'], 100)
+
+    def test_band_stats_approx(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        with patch.object(Nansat, 'STATS_MAX_SIZE', 10):
+            stats = n1.band_stats(1)
+
+        self.assertLessEqual(stats['count'], 100)
+        self.assertEqual(n1.get_metadata('STATISTICS_APPROXIMATE', 1), 'YES')
+
+    @unittest.skipUnless(MATPLOTLIB_IS_INSTALLED, 'Matplotlib is required')
+    def test_write_figure_clim_band_stats(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_write_figure_band_stats.png')
+        get_band_data = Nansat._get_band_data
+        with patch.object(Nansat, '_get_band_data', autospec=True,
+                          side_effect=get_band_data) as mock_get_band_data:
+            fig = n1.write_figure(tmpfilename, 1, clim='hist', ratio=0.9)
+        percentiles = n1.band_stats(1, percentiles=[5, 95], approx=False)['percentiles']
+
+        # statistics are computed from the figure array, the band is read once
+        self.assertEqual(mock_get_band_data.call_count, 1)
+        self.assertAlmostEqual(fig.color_limits[0][0], percentiles[0])
+        self.assertAlmostEqual(fig.color_limits[1][0], percentiles[1])
+
     def test_write_figure_clim(self):
         n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
         tmpfilename = os.path.join(self.tmp_data_path, 'nansat_write_figure_clim.png')
@@ -512,6 +593,55 @@ class NansatTest(NansatTestBase):
 
         self.assertTrue(os.path.exists(tmpfilename))
 
+    def test_write_figure_max_size(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_write_figure_max_size.png')
+        mask_array = np.zeros(n1.shape(), 'uint8')
+        fig = n1.write_figure(tmpfilename, 1, clim='hist', max_size=50,
+                              mask_array=mask_array, mask_lut={1: [0, 0, 0]})
+
+        self.assertTrue(os.path.exists(tmpfilename))
+        self.assertEqual(max(fig.width, fig.height), 50)
+        self.assertEqual(fig.mask_array.shape, (fig.height, fig.width))
+
+    def test_write_figure_max_size_reads_decimated(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_write_figure_decimated.png')
+        get_band_data = Nansat._get_band_data
+        with patch.object(Nansat, '_get_band_data', autospec=True,
+                          side_effect=get_band_data) as mock_get_band_data:
+            fig = n1.write_figure(tmpfilename, 1, clim='hist', max_size=50)
+
+        self.assertTrue(mock_get_band_data.called)
+        for call_args in mock_get_band_data.call_args_list:
+            self.assertEqual(call_args[1]['buf_x_size'], fig.width)
+            self.assertEqual(call_args[1]['buf_y_size'], fig.height)
+        self.assertNotIn('STATISTICS_KEY', n1.get_metadata(band_id=1))
+
+    def test_write_figure_width(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_write_figure_width.tif')
+        fig = n1.write_figure(tmpfilename, [1, 2, 3], clim='hist', width=40, resample_alg=-1)
+        geo_transform = n1.vrt.dataset.GetGeoTransform()
+        fig_geo_transform = gdal.Open(tmpfilename).GetGeoTransform()
+
+        self.assertEqual(fig.width, 40)
+        self.assertAlmostEqual(fig_geo_transform[1],
+                               geo_transform[1] * n1.shape()[1] / 40.)
+
+    def test_write_figure_wrong_resample_alg(self):
+        n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
+        tmpfilename = os.path.join(self.tmp_data_path, 'nansat_write_figure_resample.png')
+        with self.assertRaises(ValueError):
+            n1.write_figure(tmpfilename, max_size=10, resample_alg=2)
+
+    def test_decimate_array(self):
+        array = np.arange(100).reshape(10, 10)
+        decimated = Nansat._decimate_array(array, 5, 2)
+
+        self.assertEqual(decimated.shape, (2, 5))
+        np.testing.assert_array_equal(decimated[0], [21, 23, 25, 27, 29])
+
     def test_write_geotiffimage(self):
         n1 = Nansat(self.test_file_stere, log_level=40, mapper=self.default_mapper)
         tmpfilename = os.path.join(self.tmp_data_path, 'nansat_write_geotiffimage.tif')
@@ -819,5 +949,281 @@ class NansatTest(NansatTestBase):
         self.assertEqual(type(n), Nansat)
         self.assertEqual(n.mapper, 'netcdf_cf')
 
+    def test_get_mapper_imports_only_candidates(self):
+        with patch('nansat.nansat._load_mapper',
+                   wraps=nansat_module._load_mapper) as mock_load_mapper:
+            n = Nansat(self.test_file_stere, log_level=40)
+        loaded_mappers = [call[0][0] for call in mock_load_mapper.call_args_list]
+        self.assertNotIn('mapper_sentinel1_l1', loaded_mappers)
+        self.assertNotIn('mapper_asar', loaded_mappers)
+        self.assertIn('mapper_generic', loaded_mappers)
+
+    def test_open_profile(self):
+        profile_callback = Mock()
+        n = Nansat(self.test_file_stere, log_level=40, profile_callback=profile_callback)
+        steps = [step[0] for step in n.open_profile]
+        self.assertEqual(steps[:3], ['test_openable', '_get_dataset_metadata', 'select_mappers'])
+        self.assertEqual(steps[-2:], ['create_bands', 'total'])
+        self.assertEqual(n.open_profile[-3][2], 'success')
+        self.assertTrue(all(step[1] >= 0 for step in n.open_profile))
+        self.assertEqual(profile_callback.call_count, len(n.open_profile))
+        profile_callback.assert_called_with(*n.open_profile[-1])
+
+    def test_open_profile_skipped_mapper(self):
+        with patch('nansat.nansat._load_mapper', return_value=None) as mock_load_mapper:
+            n = Nansat(self.test_file_stere, log_level=40)
+        mapper_steps = [step for step in n.open_profile if step[0].startswith('mapper_')]
+
+        self.assertEqual(len(mapper_steps), mock_load_mapper.call_count)
+        self.assertTrue(all(step[2] == 'skipped' for step in mapper_steps))
+
+    def test_open_metadata_only(self):
+        n1 = Nansat(self.test_file_arctic, log_level=40)
+        n2 = Nansat(self.test_file_arctic, log_level=40, metadata_only=True)
+
+        self.assertEqual(n2.mapper, n1.mapper)
+        self.assertEqual(n2.shape(), n1.shape())
+        self.assertEqual(n2.get_border_wkt(), n1.get_border_wkt())
+        self.assertEqual(sorted(n2.get_metadata().keys()), sorted(n1.get_metadata().keys()))
+        self.assertEqual(sorted(n2.bands().keys()), sorted(n1.bands().keys()))
+
+    def test_open_with_cache(self):
+        with patch.dict(os.environ, {'NANSAT_CACHE_DIR': self.tmp_data_path}):
+            n1 = Nansat(self.test_file_stere, log_level=40)
+            with patch.object(Nansat, '_get_mapper') as mock_get_mapper:
+                n2 = Nansat(self.test_file_stere, log_level=40)
+
+        self.assertFalse(mock_get_mapper.called)
+        self.assertIn(('load_cache', 'hit'), [step[::2] for step in n2.open_profile])
+        self.assertEqual(n2.mapper, n1.mapper)
+        self.assertEqual(type(n2.vrt), type(n1.vrt))
+        self.assertEqual(n2.bands(), n1.bands())
+        self.assertEqual(n2.shape(), n1.shape())
+        self.assertTrue(np.allclose(n2[1], n1[1]))
+
+    def test_open_with_cache_not_cacheable(self):
+        with patch.dict(os.environ, {'NANSAT_CACHE_DIR': self.tmp_data_path}):
+            with patch.object(mapper_generic.Mapper, 'CACHEABLE', False):
+                n1 = Nansat(self.test_file_stere, log_level=40, mapper='generic')
+                n2 = Nansat(self.test_file_stere, log_level=40, mapper='generic')
+
+        self.assertIn(('save_cache', 'skipped'), [step[::2] for step in n1.open_profile])
+        self.assertIn(('load_cache', 'miss'), [step[::2] for step in n2.open_profile])
+
+    def cache_round_trip(self, mapper_name, add_state=None):
+        """Save mapper with a band from auxiliary VRT into cache and restore it
+
+        Parameters
+        ----------
+        mapper_name : str
+            name of the mapper (without 'mapper_')
+        add_state : function
+            adds mapper specific state to the mapper
+
+        Returns
+        -------
+        mapper, restored : VRT
+            saved and restored objects of the mapper class
+
+        """
+        mapper_class = nansat_module._load_mapper('mapper_' + mapper_name)
+        if mapper_class is None or isinstance(mapper_class, tuple):
+            self.skipTest('mapper_%s cannot be imported' % mapper_name)
+        self.assertTrue(mapper_class.CACHEABLE)
+        mapper = mapper_class.__new__(mapper_class)
+        VRT.__init__(mapper, 30, 20)
+        mapper.band_vrts['angle'] = VRT.from_array(
+            np.arange(600, dtype=np.float32).reshape(20, 30))
+        mapper.create_band({'SourceFilename': mapper.band_vrts['angle'].filename},
+                           {'name': 'angle'})
+        if add_state is not None:
+            add_state(mapper)
+        cache_filename = os.path.join(self.tmp_data_path, 'nansat_%s.cache' % mapper_name)
+        n1 = Nansat.__new__(Nansat)
+        n1._init_empty(self.test_file_stere, 40)
+        n1.vrt, n1.mapper = mapper, mapper_name
+        n1._save_cache(cache_filename)
+
+        n2 = Nansat.__new__(Nansat)
+        n2._init_empty(self.test_file_stere, 40)
+        restored = n2._load_cache(cache_filename)
+        self.assertIs(type(restored), mapper_class)
+        self.assertEqual(n2.mapper, mapper_name)
+        for key in mapper.band_vrts:
+            self.assertIn(key, restored.band_vrts)
+        np.testing.assert_array_equal(restored.band_vrts['angle'].dataset.ReadAsArray(),
+                                      mapper.band_vrts['angle'].dataset.ReadAsArray())
+        np.testing.assert_array_equal(restored.dataset.ReadAsArray(),
+                                      mapper.dataset.ReadAsArray())
+        return mapper, restored
+
+    def test_cache_round_trip_sentinel1_l1(self):
+        def add_luts(mapper):
+            mapper.luts = {'sigmaNought_HH': LUTInterpolator([0, 7.5, 19], [0, 10, 29],
+                                                             [[1, 2, 3], [4, 5, 6], [7, 8, 9]])}
+            mapper.band_vrts['sigmaNought_HH'] = VRT.from_array(
+                mapper.luts['sigmaNought_HH'].get_regular_grid(30, 20))
+            mapper.create_band(mapper._get_lut_source('sigmaNought_HH'),
+                               {'name': 'sigmaNought_HH'})
+
+        mapper, restored = self.cache_round_trip('sentinel1_l1', add_luts)
+        self.assertEqual(list(restored.luts), ['sigmaNought_HH'])
+        np.testing.assert_array_equal(restored.get_lut('sigmaNought_HH', 3, 2, 10, 5),
+                                      mapper.get_lut('sigmaNought_HH', 3, 2, 10, 5))
+        np.testing.assert_array_equal(
+            restored.band_vrts['sigmaNought_HH'].dataset.ReadAsArray(),
+            mapper.band_vrts['sigmaNought_HH'].dataset.ReadAsArray())
+
+    def test_cache_round_trip_radarsat2(self):
+        self.cache_round_trip('radarsat2')
+
+    def test_cache_round_trip_meris_l1(self):
+        self.cache_round_trip('meris_l1')
+
+    def test_cache_round_trip_meris_l2(self):
+        self.cache_round_trip('meris_l2')
+
+    def test_cache_round_trip_asar(self):
+        def add_geolocation(mapper):
+            lon, lat = np.meshgrid(np.linspace(0, 10, 30), np.linspace(60, 50, 20))
+            mapper._add_geolocation(Geolocation(VRT.from_array(lon), VRT.from_array(lat)))
+
+        mapper, restored = self.cache_round_trip('asar', add_geolocation)
+        lon0, lat0 = mapper.geolocation.get_geolocation_grids()
+        lon1, lat1 = restored.geolocation.get_geolocation_grids()
+        np.testing.assert_array_equal(lon1, lon0)
+        np.testing.assert_array_equal(lat1, lat0)
+
+    def test_cache_round_trip_obpg_l2(self):
+        def add_tps(mapper):
+            mapper.tps = True
+
+        mapper, restored = self.cache_round_trip('obpg_l2', add_tps)
+        self.assertTrue(restored.tps)
+
+    def create_globcolour_files(self):
+        """Create similar (same date) files and return mask of their names"""
+        tmp_dir = tempfile.mkdtemp(dir=self.tmp_data_path)
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        files_mask = os.path.join(tmp_dir, 'L3b_20100101__GLOB_4_AV-MER_*.nc')
+        for name in ['CHL1', 'KD490']:
+            with open(files_mask.replace('*', name), 'w'):
+                pass
+        return files_mask
+
+    def test_cache_round_trip_globcolour_l3b(self):
+        files_mask = self.create_globcolour_files()
+
+        def add_similar_files(mapper):
+            mapper.similar_files_mask = files_mask
+            mapper.band_vrts['lonlat'] = [VRT.from_array(np.ones((20, 30), np.float32)),
+                                          VRT.from_array(np.zeros((20, 30), np.float32))]
+            for band_vrt in mapper.band_vrts['lonlat']:
+                mapper.create_band({'SourceFilename': band_vrt.filename})
+
+        mapper, restored = self.cache_round_trip('globcolour_l3b', add_similar_files)
+        self.assertEqual(len(restored.band_vrts['lonlat']), 2)
+        np.testing.assert_array_equal(restored.band_vrts['lonlat'][0].dataset.ReadAsArray(), 1)
+
+        # new similar file makes the cache outdated
+        with open(files_mask.replace('*', 'CDM'), 'w'):
+            pass
+        n = Nansat.__new__(Nansat)
+        n._init_empty(self.test_file_stere, 40)
+        self.assertIsNone(n._load_cache(
+            os.path.join(self.tmp_data_path, 'nansat_globcolour_l3b.cache')))
+
+    def test_cache_round_trip_globcolour_l3m(self):
+        files_mask = self.create_globcolour_files()
+
+        def add_similar_files(mapper):
+            mapper.similar_files_mask = files_mask
+
+        self.cache_round_trip('globcolour_l3m', add_similar_files)
+
+    def test_cache_filename_array_kwargs(self):
+        n = Nansat.__new__(Nansat)
+        n._init_empty(self.test_file_stere, 40)
+        with patch.dict(os.environ, {'NANSAT_CACHE_DIR': self.tmp_data_path}):
+            grid1 = np.zeros((2, 1000, 1000), np.float32)
+            grid2 = grid1.copy()
+            grid2[0, 500, 500] = 1
+            filename1 = n._get_cache_filename('globcolour_l3b', {'latlonGrid': grid1})
+            filename2 = n._get_cache_filename('globcolour_l3b', {'latlonGrid': grid2})
+
+        self.assertNotEqual(filename1, filename2)
+
+    def test_save_cache_json_header(self):
+        with patch.dict(os.environ, {'NANSAT_CACHE_DIR': self.tmp_data_path}):
+            n = Nansat(self.test_file_stere, log_level=40, mapper='generic')
+        cache_filename = n._get_cache_filename('generic', {})
+        with open(cache_filename, 'rb') as cache_file:
+            header = json.loads(cache_file.readline().decode('utf-8'))
+            content = cache_file.read()
+
+        self.assertEqual(header['mapper'], 'generic')
+        self.assertEqual(len(content), sum(size for name, size in header['vsi_files']))
+
+    def create_multidim_netcdf(self):
+        filename = os.path.join(self.tmp_data_path, 'nansat_multidim.nc')
+        with Dataset(filename, 'w') as ds:
+            ds.Conventions = 'CF-1.6'
+            for dim_name, values in [('time', [0, 1, 2]), ('depth', [0, 10]),
+                                     ('lat', [62, 61, 60, 59]), ('lon', [5, 6, 7, 8, 9])]:
+                ds.createDimension(dim_name, len(values))
+                ds.createVariable(dim_name, 'f4', (dim_name,))[:] = values
+            ds.variables['time'].units = 'days since 2010-01-01'
+            ds.variables['time'].standard_name = 'time'
+            ds.variables['lat'].units = 'degrees_north'
+            ds.variables['lat'].standard_name = 'latitude'
+            ds.variables['lon'].units = 'degrees_east'
+            ds.variables['lon'].standard_name = 'longitude'
+            temp = ds.createVariable('temp', 'f4', ('time', 'depth', 'lat', 'lon'))
+            temp.standard_name = 'sea_water_temperature'
+            temp[:] = (np.arange(3)[:, None, None, None] * 10 +
+                       np.arange(2)[None, :, None, None] + np.zeros((3, 2, 4, 5)))
+            mask = ds.createVariable('mask', 'i1', ('lat', 'lon'))
+            mask.standard_name = 'land_binary_mask'
+            mask[:] = 1
+        return filename
+
+    def test_open_lazy(self):
+        n = Nansat(self.create_multidim_netcdf(), lazy=True, mapper='netcdf_cf')
+
+        # only 2D variable is created
+        self.assertEqual(n.vrt.dataset.RasterCount, 1)
+        self.assertEqual(n.vrt.dimension_layout['temp']['dimensions'], ['time', 'depth'])
+        self.assertEqual(n.vrt.dimension_layout['temp']['shape'], [3, 2])
+
+    def test_select(self):
+        n = Nansat(self.create_multidim_netcdf(), lazy=True, mapper='netcdf_cf')
+        band_numbers = n.select(depth=10)
+
+        # 2D mask (band 1) is kept
+        self.assertEqual(sorted(band_numbers), [1, 2, 3, 4])
+        self.assertEqual([n[band_number][0, 0] for band_number in [2, 3, 4]], [1, 11, 21])
+        # existing bands are reused
+        self.assertEqual(sorted(n.select(time=np.datetime64('2010-01-02'), depth=10)), [1, 3])
+        self.assertEqual(n.vrt.dataset.RasterCount, 4)
+
+    def test_select_no_matching_coordinate(self):
+        n = Nansat(self.create_multidim_netcdf(), lazy=True, mapper='netcdf_cf')
+        with self.assertRaises(ValueError):
+            n.select(depth=5)
+
+    def test_open_lazy_with_netcdf_dim(self):
+        n = Nansat(self.create_multidim_netcdf(), lazy=True, mapper='netcdf_cf',
+                   netcdf_dim={'time': np.datetime64('2010-01-03'), 'depth': [0, 10]},
+                   bands=['sea_water_temperature'])
+
+        self.assertEqual(n.vrt.dataset.RasterCount, 2)
+        self.assertEqual(n[1][0, 0], 20)
+        self.assertEqual(n[2][0, 0], 21)
+
+    def test_select_not_lazy(self):
+        n = Nansat(self.test_file_stere, log_level=40)
+        with self.assertRaises(ValueError):
+            n.select(time=0)
+
 if __name__ == "__main__":
     unittest.main()
@@ -17,6 +17,7 @@ import os
 import unittest
 import datetime
 import warnings
+from mock import MagicMock
 
 try:
     if 'DISPLAY' not in os.environ:
@@ -27,8 +28,12 @@ except ImportError:
 else:
     MATPLOTLIB_IS_INSTALLED = True
 
+import numpy as np
+
 from nansat.warnings import NansatFutureWarning
-from nansat.tools import get_random_color, parse_time
+from nansat.tools import get_random_color, parse_time, gdal
+from nansat.tools import (GCP_DTYPE, gcps_to_array, array_to_gcps, crop_gcps,
+                          read_cropped_gcps)
 from nansat.tools import (OptionError,
                             ProjectionError,
                             GDALError,
@@ -94,3 +99,39 @@ class ToolsTest(unittest.TestCase):
                 raise WrongMapperError
             self.assertEqual(recorded_warnings[0].category, NansatFutureWarning)
 
+
+    def test_gcps_to_array_and_back(self):
+        gcps = [gdal.GCP(10. + i, 60. + i, 0, i * 100., i * 50.) for i in range(5)]
+        gcp_array = gcps_to_array(gcps)
+        self.assertEqual(gcp_array.dtype, GCP_DTYPE)
+        np.testing.assert_allclose(gcp_array['GCPX'], [10, 11, 12, 13, 14])
+        np.testing.assert_allclose(gcp_array['GCPLine'], [0, 50, 100, 150, 200])
+
+        gcps2 = array_to_gcps(gcp_array)
+        self.assertEqual([(g.GCPX, g.GCPY, g.GCPPixel, g.GCPLine) for g in gcps2],
+                         [(g.GCPX, g.GCPY, g.GCPPixel, g.GCPLine) for g in gcps])
+        gcps3 = array_to_gcps(gcp_array.view(np.float64).reshape(5, 5))
+        self.assertEqual(gcps3[-1].GCPPixel, 400)
+        self.assertEqual(gcps3[-1].Id, '5')
+
+    def test_crop_gcps(self):
+        gcps = [gdal.GCP(10. + i, 60. + i, 0, i * 100., i * 50.) for i in range(5)]
+        gcp_array = crop_gcps(gcps_to_array(gcps), 50, 300, 20, 200)
+        np.testing.assert_allclose(gcp_array['GCPPixel'], [50, 150, 250])
+        np.testing.assert_allclose(gcp_array['GCPLine'], [30, 80, 130])
+        np.testing.assert_allclose(gcp_array['GCPX'], [11, 12, 13])
+
+    def test_read_cropped_gcps(self):
+        gcps = [gdal.GCP(10. + i, 60. + i, 0, i * 100., i * 50.) for i in range(5)]
+        gcp_rows = gcps_to_array(gcps).view(np.float64).reshape(5, 5)
+        gcp_variable = MagicMock()
+        gcp_variable.__getitem__.side_effect = gcp_rows.__getitem__
+        gcp_array = read_cropped_gcps(gcp_variable, 50, 300, 20, 200)
+
+        self.assertEqual(gcp_array.dtype, GCP_DTYPE)
+        np.testing.assert_array_equal(gcp_array,
+                                      crop_gcps(gcps_to_array(gcps), 50, 300, 20, 200))
+        # pixel and line columns and rows inside the window are read
+        keys = [c[0][0] for c in gcp_variable.__getitem__.call_args_list]
+        self.assertEqual(keys, [(slice(None), 3), (slice(None), 4), slice(1, 4)])
+        self.assertEqual(len(read_cropped_gcps(gcp_rows, 1000, 10, 0, 10)), 0)
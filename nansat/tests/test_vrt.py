@@ -18,6 +18,10 @@ from mock import patch, PropertyMock, Mock, MagicMock, DEFAULT
 
 import xml.etree.ElementTree as ET
 import warnings
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 import numpy as np
 import gdal
@@ -199,6 +203,20 @@ class VRTTest(NansatTestBase):
         vrt2.create_band({'SourceFilename': vrt1.filename})
         self.assertEqual(vrt2.dataset.RasterCount, 1)
 
+    def test_create_bands(self):
+        self.mock_pti['get_wkv_variable'].return_value = dict(short_name='sigma0')
+        array = gdal.Open(self.test_file_gcps).ReadAsArray()[1, 10:, :]
+        vrt1 = VRT.from_array(array)
+        vrt2 = VRT(x_size=array.shape[1], y_size=array.shape[0])
+        vrt2.create_bands([{'src': {'SourceFilename': vrt1.filename},
+                            'dst': {'wkv': 'sigma0'}} for i in range(3)])
+        self.assertEqual(vrt2.dataset.RasterCount, 3)
+        self.assertEqual(self.mock_pti['get_wkv_variable'].call_count, 1)
+        self.assertEqual([vrt2.dataset.GetRasterBand(i + 1).GetMetadataItem('name')
+                          for i in range(3)], ['sigma0', 'sigma0_0000', 'sigma0_0001'])
+        self.assertEqual(vrt2.dataset.GetRasterBand(3).DataType, gdal.GDT_Byte)
+        self.assertTrue(np.all(vrt2.dataset.GetRasterBand(3).ReadAsArray() == array))
+
     def test_make_source_bands_xml(self):
         array = gdal.Open(self.test_file_gcps).ReadAsArray()[1, 10:, :]
         vrt1 = VRT.from_array(array)
@@ -376,9 +394,12 @@ class VRTTest(NansatTestBase):
         vrt3.create_bands([{'src': {'SourceFilename': vrt1.filename}},
                            {'src': {'SourceFilename': vrt2.filename}}])
 
-        self.assertEqual(vrt1._find_complex_band(), None)
-        self.assertEqual(vrt2._find_complex_band(), 1)
-        self.assertEqual(vrt3._find_complex_band(), 2)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            self.assertEqual(vrt1._find_complex_band(), None)
+            self.assertEqual(vrt2._find_complex_band(), 1)
+            self.assertEqual(vrt3._find_complex_band(), 2)
+            self.assertEqual(w[0].category, NansatFutureWarning)
 
     def test_split_complex_bands(self):
         a = np.random.randn(100,100)
@@ -400,6 +421,33 @@ class VRTTest(NansatTestBase):
         self.assertEqual(vrt4.dataset.GetRasterBand(4).GetMetadataItem(str('name')), 'vrt3_real')
         self.assertEqual(vrt4.dataset.GetRasterBand(5).GetMetadataItem(str('name')), 'vrt3_imag')
 
+    def test_split_complex_bands_values(self):
+        a = np.random.randn(100, 100) + 1j * np.random.randn(100, 100)
+        vrt1 = VRT.from_array(a.astype(np.complex64))
+        vrt2 = VRT.from_gdal_dataset(vrt1.dataset)
+        vrt2.create_bands([{'src': {'SourceFilename': vrt1.filename}, 'dst': {'name': 'c'}}])
+
+        vrt2.split_complex_bands()
+
+        self.assertEqual(vrt2.dataset.GetRasterBand(1).DataType, gdal.GDT_Float32)
+        np.testing.assert_allclose(vrt2.dataset.GetRasterBand(1).ReadAsArray(), a.real, rtol=1e-6)
+        np.testing.assert_allclose(vrt2.dataset.GetRasterBand(2).ReadAsArray(), a.imag, rtol=1e-6)
+
+    @unittest.skipIf(tracemalloc is None, 'tracemalloc is not available')
+    def test_split_complex_bands_memory(self):
+        vrt1 = VRT.from_array(np.ones((2000, 2000), np.complex64))
+        vrt2 = VRT.from_gdal_dataset(vrt1.dataset)
+        vrt2.create_bands([{'src': {'SourceFilename': vrt1.filename}, 'dst': {'name': 'c'}}])
+
+        tracemalloc.start()
+        vrt2.split_complex_bands()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        # complex band is 32 MB, no arrays are read
+        self.assertLess(peak, 4 * 1024 * 1024)
+        self.assertEqual(vrt2.dataset.RasterCount, 2)
+
     def test_create_geolocation_bands(self):
         lon, lat = np.meshgrid(np.linspace(0,5,10), np.linspace(10,20,30))
         vrt = VRT.from_lonlat(lon, lat)
@@ -439,6 +487,49 @@ class VRTTest(NansatTestBase):
         self.assertEqual(band_nodes[1].node('SourceFilename').value, vrt.band_vrts[2].filename)
         self.assertEqual(band_nodes[2].node('SourceFilename').value, vrt.band_vrts[3].filename)
 
+    def test_hardcopy_bands_parallel(self):
+        ds = gdal.Open(self.test_file_gcps)
+        vrt = VRT.copy_dataset(ds)
+        vrt.create_band([{'SourceFilename': vrt.filename, 'SourceBand': 1},
+                         {'SourceFilename': vrt.filename, 'SourceBand': 2}],
+                        {'PixelFunctionType': 'sum', 'dataType': gdal.GDT_Float32})
+        array = vrt.dataset.GetRasterBand(4).ReadAsArray()
+        vrt.hardcopy_bands(processes=2)
+
+        self.assertTrue(np.allclose(vrt.dataset.GetRasterBand(1).ReadAsArray(),
+                                    ds.GetRasterBand(1).ReadAsArray()))
+        self.assertTrue(np.allclose(vrt.dataset.GetRasterBand(4).ReadAsArray(), array))
+        self.assertNotIn('PixelFunctionType', vrt.xml)
+
+    def test_hardcopy_bands_parallel_blocks(self):
+        ds = gdal.Open(self.test_file_gcps)
+        vrt = VRT.copy_dataset(ds)
+        vrt.HARDCOPY_BLOCK_SIZE = ds.RasterXSize * 7
+        vrt.hardcopy_bands(processes=3)
+
+        self.assertTrue(np.allclose(vrt.dataset.ReadAsArray(), ds.ReadAsArray()))
+
+    def test_hardcopy_bands_nomem(self):
+        ds = gdal.Open(self.test_file_gcps)
+        vrt = VRT.copy_dataset(ds)
+        vrt.hardcopy_bands(nomem=True)
+
+        self.assertTrue(np.allclose(vrt.dataset.ReadAsArray(), ds.ReadAsArray()))
+        band_filename = vrt.band_vrts[1].filename
+        self.assertTrue(os.path.exists(band_filename))
+        self.assertTrue(os.path.exists(band_filename.replace('.vrt', '.raw')))
+        vrt.band_vrts[1]._remove_files()
+        self.assertFalse(os.path.exists(band_filename))
+        self.assertFalse(os.path.exists(band_filename.replace('.vrt', '.raw')))
+
+    def test_init_from_blocks(self):
+        array = np.arange(20, dtype=np.int16).reshape(5, 4)
+        vrt = VRT.__new__(VRT)
+        vrt._init_from_blocks([(3, array[3:]), (0, array[:3])], 4, 5)
+
+        self.assertEqual(vrt.dataset.GetRasterBand(1).DataType, gdal.GDT_Int16)
+        self.assertTrue(np.all(vrt.dataset.ReadAsArray() == array))
+
     ### Both of these patches work, so we don't need to mock __init__ in this case...
     #@patch.multiple(VRT, dataset=DEFAULT, __init__ = Mock(return_value=None))
     @patch.object(VRT, 'dataset')
@@ -556,6 +647,39 @@ class VRTTest(NansatTestBase):
         self.assertFalse(data is None)
         self.assertTrue(np.all(data == array))
 
+    def test_get_resampled_vrt(self):
+        array = np.array([[0, 1], [2, 3]], np.float32)
+        vrt1 = VRT.from_array(array)
+        vrt2 = vrt1.get_resampled_vrt(20, 10, 1)
+        data = vrt2.dataset.ReadAsArray()
+        window = vrt2.dataset.ReadAsArray(5, 2, 10, 4)
+
+        self.assertEqual(vrt2.vrt, vrt1)
+        self.assertEqual(data.shape, (10, 20))
+        self.assertAlmostEqual(data[0, 0], 0, 0)
+        self.assertAlmostEqual(data[-1, -1], 3, 0)
+        self.assertTrue(np.all(np.diff(data, axis=1) >= 0))
+        self.assertTrue(np.all(np.diff(data, axis=0) >= 0))
+        self.assertTrue(np.allclose(window, data[2:6, 5:15]))
+
+    def test_get_vsi_files_and_from_vsi_files(self):
+        lon, lat = np.meshgrid(np.linspace(0, 5, 10), np.linspace(10, 20, 30))
+        vrt1 = VRT.from_lonlat(lon, lat)
+        vrt1.create_geolocation_bands()
+        vsi_files = vrt1.get_vsi_files()
+        vrt2 = VRT.from_vsi_files(vsi_files, vrt1.filename)
+
+        self.assertIn(vrt1.filename, vsi_files)
+        self.assertIn(vrt1.geolocation.data['X_DATASET'], vsi_files)
+        self.assertIn(vrt1.geolocation.data['X_DATASET'].replace('.vrt', '.raw'), vsi_files)
+        self.assertNotEqual(vrt2.filename, vrt1.filename)
+        self.assertNotIn(vrt1.filename, vrt2.xml)
+        self.assertEqual(len(vrt2.band_vrts), 2)
+        self.assertEqual(vrt2.geolocation.data['X_DATASET'],
+                         vrt2.dataset.GetMetadata(str('GEOLOCATION'))['X_DATASET'])
+        self.assertTrue(np.allclose(vrt2.dataset.GetRasterBand(1).ReadAsArray(), lon))
+        self.assertTrue(np.allclose(vrt2.dataset.GetRasterBand(2).ReadAsArray(), lat))
+
     def test_property_fileName(self):
         vrt = VRT()
         with warnings.catch_warnings(record=True) as w:
@@ -220,6 +220,99 @@ def haversine(lon1, lat1, lon2, lat2):
     return distance_meters
 
 
+# name of 2D netCDF variable with GCPs (one row per GCP, columns of GCP_DTYPE)
+GCP_VARIABLE = 'GCPs'
+
+# structured array with coordinates of GCPs
+GCP_DTYPE = np.dtype([('GCPX', 'f8'), ('GCPY', 'f8'), ('GCPZ', 'f8'),
+                      ('GCPPixel', 'f8'), ('GCPLine', 'f8')])
+
+
+def gcps_to_array(gcps):
+    """Convert list of GDAL GCPs into structured array
+
+    Parameters
+    ----------
+    gcps : list of gdal.GCP
+
+    Returns
+    -------
+    gcp_array : numpy.ndarray
+        1D structured array with fields GCPX, GCPY, GCPZ, GCPPixel, GCPLine (GCP_DTYPE)
+
+    """
+    return np.array([(gcp.GCPX, gcp.GCPY, gcp.GCPZ, gcp.GCPPixel, gcp.GCPLine)
+                     for gcp in gcps], dtype=GCP_DTYPE)
+
+
+def array_to_gcps(gcp_array):
+    """Convert structured array (GCP_DTYPE) or 2D array (N x 5) into list of GDAL GCPs
+
+    Columns of a 2D array are GCPX, GCPY, GCPZ, GCPPixel, GCPLine. Ids of GCPs are their
+    numbers starting from 1.
+
+    """
+    gcp_array = np.asarray(gcp_array)
+    if gcp_array.dtype.names is None:
+        gcp_array = np.rec.fromarrays(np.asarray(gcp_array, 'f8').T, dtype=GCP_DTYPE)
+    return [gdal.GCP(x, y, z, pixel, line, str(''), str(i + 1))
+            for i, (x, y, z, pixel, line) in enumerate(gcp_array.tolist())]
+
+
+def crop_gcps(gcp_array, x_offset, x_size, y_offset, y_size):
+    """Select GCPs inside a window and shift their pixel/line coordinates to the window
+
+    Parameters
+    ----------
+    gcp_array : numpy.ndarray
+        structured array with GCPs (GCP_DTYPE)
+    x_offset, x_size, y_offset, y_size : int
+        offset and size of the window
+
+    Returns
+    -------
+    gcp_array : numpy.ndarray
+        GCPs strictly inside the window with coordinates relative to the window
+
+    """
+    pixel = gcp_array['GCPPixel'] - x_offset
+    line = gcp_array['GCPLine'] - y_offset
+    inside = (pixel > 0) * (pixel < x_size) * (line > 0) * (line < y_size)
+    gcp_array = gcp_array[inside].copy()
+    gcp_array['GCPPixel'] = pixel[inside]
+    gcp_array['GCPLine'] = line[inside]
+    return gcp_array
+
+
+def read_cropped_gcps(gcp_variable, x_offset, x_size, y_offset, y_size):
+    """Read only GCPs inside a window from 2D variable (one row per GCP)
+
+    Only the GCPPixel and GCPLine columns are read for all GCPs. Other columns are read only
+    for the rows between the first and the last GCP inside the window.
+
+    Parameters
+    ----------
+    gcp_variable : netCDF4.Variable or numpy.ndarray
+        2D variable (N x 5) with columns GCPX, GCPY, GCPZ, GCPPixel, GCPLine
+    x_offset, x_size, y_offset, y_size : int
+        offset and size of the window
+
+    Returns
+    -------
+    gcp_array : numpy.ndarray
+        GCPs strictly inside the window with coordinates relative to the window (GCP_DTYPE)
+
+    """
+    pixel = np.asarray(gcp_variable[:, GCP_DTYPE.names.index('GCPPixel')], 'f8') - x_offset
+    line = np.asarray(gcp_variable[:, GCP_DTYPE.names.index('GCPLine')], 'f8') - y_offset
+    rows = np.flatnonzero((pixel > 0) * (pixel < x_size) * (line > 0) * (line < y_size))
+    if len(rows) == 0:
+        return np.zeros(0, GCP_DTYPE)
+    gcp_rows = np.asarray(gcp_variable[int(rows[0]):int(rows[-1]) + 1], 'f8')
+    gcp_array = np.rec.fromarrays(gcp_rows.T, dtype=GCP_DTYPE).view(np.ndarray)
+    return crop_gcps(gcp_array, x_offset, x_size, y_offset, y_size)
+
+
 def add_logger(logName='', logLevel=None):
     ''' Creates and returns logger with default formatting for Nansat
 
@@ -16,9 +16,14 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
 from __future__ import absolute_import, unicode_literals, division
 import os
+import re
 import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
 from string import Template, ascii_uppercase, digits
 from random import choice
+from timeit import default_timer
+from xml.sax.saxutils import escape, quoteattr
 import warnings
 import pythesint as pti
 
@@ -30,6 +35,7 @@ from nansat.node import Node
 from nansat.nsr import NSR
 from nansat.geolocation import Geolocation
 from nansat.tools import add_logger, numpy_to_gdal_type, gdal_type_to_offset, remove_keys
+from nansat.tools import gcps_to_array, array_to_gcps, crop_gcps
 
 from nansat.exceptions import NansatProjectionError
 from nansat.warnings import NansatFutureWarning
@@ -104,7 +110,7 @@ class VRT(object):
     INIT_SRCMETADATA_WARNING = ('VRT(srcMetadata=...) will be disabled in Nansat 1.1. '
                                 'Use VRT(metadata=...).')
     COMPLEX_SOURCE_XML = Template('''
-            <$SourceType>
+            <$SourceType$Resampling>
                 <SourceFilename relativeToVRT="0">$Dataset</SourceFilename>
                 <SourceBand>$SourceBand</SourceBand>
                 <NODATA>$NODATA</NODATA>
@@ -112,9 +118,33 @@ class VRT(object):
                 <ScaleRatio>$ScaleRatio</ScaleRatio>
                 <LUT>$LUT</LUT>
                 <SrcRect xOff="$xOff" yOff="$yOff" xSize="$xSize" ySize="$ySize"/>
-                <DstRect xOff="0" yOff="0" xSize="$xSize" ySize="$ySize"/>
+                <DstRect xOff="$dstXOff" yOff="$dstYOff" xSize="$dstXSize" ySize="$dstYSize"/>
             </$SourceType> ''')
 
+    # Result of a mapper can be saved in NANSAT_CACHE_DIR and restored from its VRT-files if
+    # the mapper sets CACHEABLE = True. Other state of the mapper (e.g. LUTs) is saved and
+    # restored by VRT._get_cache_state and VRT._set_cache_state
+    CACHEABLE = False
+
+    # names of GDAL resampling methods used in sources of VRT bands
+    RESAMPLING_NAMES = {0: 'near', 1: 'bilinear', 2: 'cubic', 3: 'cubicspline', 4: 'lanczos'}
+
+    # data types of real and imaginary parts of complex bands (as in arrays read by GDAL)
+    COMPLEX_PART_TYPES = {gdal.GDT_CInt16: gdal.GDT_Float32,
+                          gdal.GDT_CInt32: gdal.GDT_Float64,
+                          gdal.GDT_CFloat32: gdal.GDT_Float32,
+                          gdal.GDT_CFloat64: gdal.GDT_Float64}
+
+    # number of pixels in a block of rows evaluated by one thread in hardcopy_bands
+    HARDCOPY_BLOCK_SIZE = 4 * 1024 * 1024
+
+    # prefix of band metadata with cached statistics (e.g. from Nansat.band_stats), not exported
+    STATISTICS_METADATA_PREFIX = 'STATISTICS_'
+
+    # elements of VRTRasterBand which are kept by hardcopy_bands
+    HARDCOPY_BAND_NODES = ['Metadata', 'Description', 'NoDataValue', 'ColorInterp', 'ColorTable',
+                           'UnitType', 'Offset', 'Scale', 'CategoryNames']
+
     RAW_RASTER_BAND_SOURCE_XML = Template('''
             <VRTDataset rasterXSize="$XSize" rasterYSize="$YSize">
               <VRTRasterBand dataType="$DataType"
@@ -142,6 +172,8 @@ class VRT(object):
     driver = None
     band_vrts = None
     tps = None
+    # total time (seconds) spent in VRT.create_band
+    band_creation_time = 0.
 
     @classmethod
     def from_gdal_dataset(cls, gdal_dataset, **kwargs):
@@ -264,6 +296,26 @@ class VRT(object):
         vrt._copy_from_dataset(gdal_dataset, **kwargs)
         return vrt
 
+    @classmethod
+    def from_vsi_files(cls, vsi_files, filename):
+        """Create VRT from contents of VSI files (e.g. saved with VRT.get_vsi_files)
+
+        Parameters
+        ----------
+        vsi_files : dict
+            names (str) and contents (bytes) of the VRT-file and of all VSI files it refers to
+        filename : str
+            name of the main VRT-file in <vsi_files>
+
+        Returns
+        -------
+        vrt : VRT
+
+        """
+        vrt = cls.__new__(cls)
+        vrt._init_from_vsi_files(vsi_files, filename)
+        return vrt
+
     def __init__(self, x_size=1, y_size=1, metadata=None, nomem=False, **kwargs):
         """Init VRT object with all attributes"""
         if isinstance(x_size, gdal.Dataset):
@@ -381,26 +433,48 @@ class VRT(object):
         self - adds all VRT attributes
         self.dataset is updated
 
+        """
+        self._init_from_blocks([(0, array)], array.shape[1], array.shape[0], **kwargs)
+
+    def _init_from_blocks(self, blocks, x_size, y_size, **kwargs):
+        """Init VRT from blocks of rows with dataset wih one band but without georeference.
+
+        Write each block into flat binary file (VSI) as soon as it is available
+        Write VRT file with RawRastesrBand, which points to the binary file
+        Open the VRT file as self.dataset with GDAL
+
+        Parameters
+        ----------
+        blocks : iterable
+            tuples (y_offset, array) with arrays of the same data type and width <x_size>.
+            Blocks may come in any order and together must cover all <y_size> rows.
+        x_size, y_size : int
+            size of the band
+        **kwargs : dict
+            arguments for VRT()
+
         """
         VRT.__init__(self, **kwargs)
-        # create flat binary file (in VSI) from numpy array
-        array_type = array.dtype.name
-        array_shape = array.shape
         binary_file = self.filename.replace('.vrt', '.raw')
         ofile = gdal.VSIFOpenL(str(binary_file), str('wb'))
-        gdal.VSIFWriteL(array.tostring(), len(array.tostring()), 1, ofile)
+        array_type = None
+        for y_offset, array in blocks:
+            if array_type is None:
+                array_type = array.dtype.name
+                gdal.VSIFTruncateL(ofile, array.dtype.itemsize * x_size * y_size)
+            gdal.VSIFSeekL(ofile, array.dtype.itemsize * x_size * y_offset, 0)
+            gdal.VSIFWriteL(array.tostring(), len(array.tostring()), 1, ofile)
         gdal.VSIFCloseL(ofile)
-        array = None
 
         # convert Numpy datatype to gdal datatype and pixel offset
         gdal_data_type = numpy_to_gdal_type[array_type]
         pixel_offset = gdal_type_to_offset[gdal_data_type]
 
         # create XML contents of VRT-file
-        line_offset = str(int(pixel_offset) * array_shape[1])
+        line_offset = str(int(pixel_offset) * x_size)
         contents = self.RAW_RASTER_BAND_SOURCE_XML.substitute(
-            XSize=array_shape[1],
-            YSize=array_shape[0],
+            XSize=x_size,
+            YSize=y_size,
             DataType=gdal_data_type,
             BandNum=1,
             SrcFileName=binary_file,
@@ -465,11 +539,78 @@ class VRT(object):
         # write XMl file contents
         self.dataset.FlushCache()
 
+    def _init_from_vsi_files(self, vsi_files, filename):
+        """Init VRT from contents of VSI files
+
+        All files are written into VSI memory with new random names and references between
+        them are updated. Each auxiliary VRT-file is kept as a VRT object in self.band_vrts
+        with the original file name as key (and is therefore deleted together with self).
+
+        Parameters
+        ----------
+        vsi_files : dict
+            names (str) and contents (bytes) of the VRT-file and of all VSI files it refers to
+        filename : str
+            name of the main VRT-file in <vsi_files>
+
+        Notes
+        --------
+        self - adds all VRT attributes
+        self.dataset - opened from the main VRT-file
+        self.geolocation - created from GEOLOCATION metadata of the main VRT-file
+
+        """
+        # new names for VRT-files and for the accompanying RAW-files
+        new_names = {}
+        for vsi_filename in vsi_files:
+            name = os.path.splitext(vsi_filename)[0]
+            if name not in new_names:
+                new_names[name] = os.path.splitext(VRT._make_filename())[0]
+
+        new_filenames = []
+        for vsi_filename in vsi_files:
+            content = vsi_files[vsi_filename]
+            for name in new_names:
+                content = content.replace(name.encode(), new_names[name].encode())
+            name, ext = os.path.splitext(vsi_filename)
+            new_filenames.append(new_names[name] + ext)
+            gdal.FileFromMemBuffer(str(new_filenames[-1]), content)
+
+        name, ext = os.path.splitext(filename)
+        self.logger = add_logger('Nansat')
+        self.driver = gdal.GetDriverByName(str('VRT'))
+        self.filename = str(new_names[name] + ext)
+        self.band_vrts = dict()
+        self.tps = False
+        self.vrt = None
+        for vsi_filename, new_filename in zip(vsi_files, new_filenames):
+            if new_filename.endswith('.vrt') and new_filename != self.filename:
+                self.band_vrts[vsi_filename] = VRT._from_vsi_file(new_filename)
+        self.dataset = gdal.Open(self.filename)
+        self.geolocation = Geolocation.from_dataset(self.dataset)
+
+    @classmethod
+    def _from_vsi_file(cls, filename):
+        """Create VRT object which owns existing VRT-file <filename>"""
+        vrt = cls.__new__(cls)
+        vrt.logger = add_logger('Nansat')
+        vrt.driver = gdal.GetDriverByName(str('VRT'))
+        vrt.filename = str(filename)
+        vrt.band_vrts = dict()
+        vrt.tps = False
+        vrt.vrt = None
+        vrt.dataset = gdal.Open(vrt.filename)
+        return vrt
+
     def __del__(self):
         """Destructor deletes VRT and RAW files"""
+        self._remove_files()
+
+    def _remove_files(self):
+        """Close dataset and delete VRT and RAW files (in memory or on disk)"""
         self.dataset = None
         gdal.Unlink(self.filename)
-        gdal.Unlink(self.filename.replace('vrt', 'raw'))
+        gdal.Unlink(self.filename.replace('.vrt', '.raw'))
 
     def __repr__(self):
         str_out = os.path.split(self.filename)[1]
@@ -694,21 +835,44 @@ class VRT(object):
         # overwrite XML file with updated size, geotranform, etc
         self.write_xml(node0.rawxml())
 
-    def _create_band_name(self, dst):
-        """Create band name based on destination band dictionary <dst>"""
+    def _create_band_name(self, dst, band_names=None, wkv_cache=None):
+        """Create band name based on destination band dictionary <dst>
+
+        Parameters
+        ----------
+        dst : dict
+            parameters of the created band
+        band_names : set
+            names of existing bands. Names of bands in self.dataset are read if None.
+        wkv_cache : dict
+            WKV metadata already found by PyThesInt {wkv: metadata}. Updated with new WKVs.
+
+        Returns
+        -------
+        band_name : str
+            unique name of the band
+        wkv : dict
+            WKV metadata
+
+        """
         band_name = dst.get('name', None)
 
         # try to get metadata from WKV using PyThesInt if it exists
-        wkv_dst = dst.get('wkv', None)
-        try:
-            wkv_pti = pti.get_wkv_variable(str(wkv_dst))
-        except IndexError:
-            # IndexError is raised when PyThesInt doesn't find the requested WKV.
-            # In that case and empty dict without any metadata is created
-            wkv = {}
+        wkv_dst = str(dst.get('wkv', None))
+        if wkv_cache is not None and wkv_dst in wkv_cache:
+            wkv = dict(wkv_cache[wkv_dst])
         else:
-            # If WKV was found by PyThesInt, a dict with metadata is created
-            wkv = dict(wkv_pti)
+            try:
+                wkv_pti = pti.get_wkv_variable(wkv_dst)
+            except IndexError:
+                # IndexError is raised when PyThesInt doesn't find the requested WKV.
+                # In that case and empty dict without any metadata is created
+                wkv = {}
+            else:
+                # If WKV was found by PyThesInt, a dict with metadata is created
+                wkv = dict(wkv_pti)
+            if wkv_cache is not None:
+                wkv_cache[wkv_dst] = dict(wkv)
 
         if band_name is None:
             band_name = wkv.get('short_name', 'band')
@@ -716,8 +880,9 @@ class VRT(object):
                  band_name += '_' + dst['suffix']
 
         # create list of available bands (to prevent duplicate names)
-        band_names = [self.dataset.GetRasterBand(i + 1).GetMetadataItem(str('name'))
-                        for i in range(self.dataset.RasterCount)]
+        if band_names is None:
+            band_names = [self.dataset.GetRasterBand(i + 1).GetMetadataItem(str('name'))
+                            for i in range(self.dataset.RasterCount)]
 
         # check if name already exist and add '_NNNN'
         dst_band_name = band_name
@@ -730,6 +895,8 @@ class VRT(object):
 
     def _find_complex_band(self):
         """Find complex data bands"""
+        warnings.warn('Method VRT._find_complex_band() will be disabled in Nansat 1.1. '
+                      'Use VRT.split_complex_bands() instead.', NansatFutureWarning)
         # find complex bands
         for i in range(1, self.dataset.RasterCount+1):
             if self.dataset.GetRasterBand(i).DataType in [8, 9, 10, 11]:
@@ -815,34 +982,40 @@ class VRT(object):
         self.delete_bands(rm_bands)
 
     def split_complex_bands(self):
-        """Recursevly find complex bands and relace by real and imag components"""
-        rm_metadata= ['dataType', 'PixelFunctionType']
+        """Replace complex bands by bands with real and imaginary parts
 
-        i = self._find_complex_band()
-        if i is None:
+        Real and imaginary parts are derived bands (pixel functions 'real' and 'imag') which
+        read the complex bands from a copy of the VRT, so data is not read into memory until
+        export. Bands with parts are added at the end and complex bands are deleted.
+
+        """
+        rm_metadata = ['dataType', 'PixelFunctionType', 'SourceTransferType']
+        complex_bands = [i for i in range(1, self.dataset.RasterCount + 1)
+                         if self.dataset.GetRasterBand(i).DataType in self.COMPLEX_PART_TYPES]
+        if len(complex_bands) == 0:
             return
 
-        band = self.dataset.GetRasterBand(i)
-        band_array = band.ReadAsArray()
-        band_metadata_orig = remove_keys(band.GetMetadata(), rm_metadata)
-        band_name_orig = band_metadata_orig.get('name', 'complex_%003d'%i)
-        # Copy metadata, modify 'name' and create VRTs for real and imag parts of each band
+        src_vrt = self.copy()
+        self.band_vrts[src_vrt.filename] = src_vrt
         band_description = []
-        for part in ['real', 'imag']:
-            band_metadata = band_metadata_orig.copy()
-            band_name = band_name_orig + '_' + part
-            band_metadata['name'] = band_name
-            self.band_vrts[band_name] = VRT.from_array(eval('band_array.' + part))
-            band_description.append({'src': {
-                     'SourceFilename': self.band_vrts[band_name].filename,
-                     'SourceBand':  1},
-                     'dst': band_metadata})
-        # create bands with parts
+        for i in complex_bands:
+            band = self.dataset.GetRasterBand(i)
+            band_metadata_orig = remove_keys(band.GetMetadata(), rm_metadata)
+            band_name_orig = band_metadata_orig.get('name', 'complex_%003d' % i)
+            # Copy metadata, modify 'name' and add pixel function for real and imag parts
+            for part in ['real', 'imag']:
+                band_metadata = band_metadata_orig.copy()
+                band_metadata['name'] = band_name_orig + '_' + part
+                band_metadata['PixelFunctionType'] = part
+                band_metadata['SourceTransferType'] = gdal.GetDataTypeName(band.DataType)
+                band_metadata['dataType'] = self.COMPLEX_PART_TYPES[band.DataType]
+                band_description.append({'src': {'SourceFilename': src_vrt.filename,
+                                                 'SourceBand': i,
+                                                 'DataType': band.DataType},
+                                         'dst': band_metadata})
+        # create bands with parts and delete the complex bands
         self.create_bands(band_description)
-        # delete the complex band
-        self.delete_band(i)
-        # find and split more complex bands
-        self.split_complex_bands()
+        self.delete_bands(complex_bands)
 
     def create_geolocation_bands(self):
         """Create bands from Geolocation"""
@@ -860,10 +1033,12 @@ class VRT(object):
         self.dataset.FlushCache()
 
     def fix_band_metadata(self, rm_metadata):
-        """Add NETCDF_VARNAME and remove <rm_metadata> in metadata for each band"""
+        """Add NETCDF_VARNAME, remove <rm_metadata> and cached statistics in metadata of bands"""
         for iBand in range(self.dataset.RasterCount):
             band = self.dataset.GetRasterBand(iBand + 1)
             metadata = remove_keys(band.GetMetadata(), rm_metadata)
+            metadata = dict([(key, metadata[key]) for key in metadata
+                             if not key.startswith(self.STATISTICS_METADATA_PREFIX)])
             if 'name' in metadata:
                 metadata['NETCDF_VARNAME'] = metadata['name']
             band.SetMetadata(metadata)
@@ -880,16 +1055,68 @@ class VRT(object):
         self.dataset.SetMetadata(metadata_escaped)
         self.dataset.FlushCache()
 
-    def hardcopy_bands(self):
-        """Make 'hardcopy' of bands: evaluate array from band and put into original band"""
-        bands = range(1, self.dataset.RasterCount+1)
-        for i in bands:
-            self.band_vrts[i] = VRT.from_array(self.dataset.GetRasterBand(i).ReadAsArray())
+    def hardcopy_bands(self, processes=1, nomem=False):
+        """Make 'hardcopy' of bands: evaluate array from band and put into original band
+
+        Parameters
+        ----------
+        processes : int
+            number of blocks of rows evaluated in parallel. Each thread opens the VRT file
+            separately, so pixel functions and warping of different blocks run concurrently.
+        nomem : bool
+            write band files into the temporary directory on disk instead of memory (VSI)
+
+        Notes
+        -----
+        Sources, pixel functions and scaling of each band are replaced by a simple source
+        pointing to the evaluated array. Metadata of bands is kept. Bands are evaluated one
+        after another and each block is written into the band file as soon as it is ready,
+        so only the blocks being evaluated are kept in memory in addition to the band files.
+
+        """
+        self.dataset.FlushCache()
+        x_size, y_size = self.dataset.RasterXSize, self.dataset.RasterYSize
+        bands = list(range(1, self.dataset.RasterCount + 1))
+        if processes <= 1:
+            for i in bands:
+                self.band_vrts[i] = VRT.from_array(self.dataset.GetRasterBand(i).ReadAsArray(),
+                                                   nomem=nomem)
+        else:
+            block_rows = max(1, self.HARDCOPY_BLOCK_SIZE // x_size)
+            thread_data = threading.local()
+
+            def _read_block(band_block):
+                """Read block of rows from VRT opened separately in each thread"""
+                band_num, y_offset = band_block
+                if getattr(thread_data, 'dataset', None) is None:
+                    thread_data.dataset = gdal.Open(self.filename)
+                band = thread_data.dataset.GetRasterBand(band_num)
+                return y_offset, band.ReadAsArray(0, y_offset, x_size,
+                                                  min(block_rows, y_size - y_offset))
+
+            pool = ThreadPool(processes)
+            try:
+                for i in bands:
+                    blocks = pool.imap_unordered(
+                        _read_block, [(i, y_offset) for y_offset in range(0, y_size, block_rows)])
+                    self.band_vrts[i] = VRT.__new__(VRT)
+                    self.band_vrts[i]._init_from_blocks(blocks, x_size, y_size, nomem=nomem)
+            finally:
+                pool.close()
+                pool.join()
 
         node0 = Node.create(str(self.xml))
         for i, iNode1 in enumerate(node0.nodeList('VRTRasterBand')):
-            iNode1.node('SourceFilename').value = self.band_vrts[i+1].filename
-            iNode1.node('SourceBand').value = str(1)
+            band_vrt = self.band_vrts[i + 1]
+            iNode1.children = [child for child in iNode1.children
+                               if child.tag in self.HARDCOPY_BAND_NODES]
+            source = Node('SimpleSource')
+            source += Node('SourceFilename', value=band_vrt.filename, relativeToVRT='0')
+            source += Node('SourceBand', value='1')
+            iNode1 += source
+            iNode1.attributes = {
+                'band': str(i + 1),
+                'dataType': gdal.GetDataTypeName(band_vrt.dataset.GetRasterBand(1).DataType)}
         self.write_xml(node0.rawxml())
 
     def prepare_export_gtiff(self, options):
@@ -990,19 +1217,111 @@ class VRT(object):
 
         Notes
         ---------
-        Adds bands to the self.dataset based on info in metaDict
+        Adds bands to the self.dataset based on info in metaDict.
+        XML of all bands is generated in one string and written into the VRT file at once:
+        WKVs are looked up in PyThesInt once per WKV, each source file is opened once and
+        uniqueness of band names is checked against a running set of names. Raw bands
+        (SourceBand=0) are added with VRT.create_band().
 
         See Also
         ---------
         VRT.create_band()
 
         """
+        start_time = default_timer()
+        band_names = set(self.dataset.GetRasterBand(i + 1).GetMetadataItem(str('name'))
+                         for i in range(self.dataset.RasterCount))
+        wkv_cache = {}
+        src_datasets = {}
+        bands_xml = []
         for band_dict in metadata_dict:
             src = band_dict['src']
             dst = band_dict.get('dst', None)
-            self.create_band(src, dst)
+            if type(src) == dict:
+                srcs = [src]
+            elif type(src) in [list, tuple]:
+                srcs = src
+            else:
+                raise ValueError('Wrong src type (%s)! Should be dict or list/tuple of dict'
+                                 % type(src))
+            if dst is None:
+                dst = {}
+
+            if len(srcs) == 1 and srcs[0].get('SourceBand', 1) == 0:
+                # raw band: write bands created so far and add this one with GDAL
+                self._write_bands_xml(bands_xml)
+                bands_xml = []
+                self.band_creation_time += default_timer() - start_time
+                band_names.add(self.create_band(src, dst))
+                start_time = default_timer()
+                continue
+
+            srcs = [VRT._make_source_bands_xml(src, src_datasets) for src in srcs]
+            dst['dataType'] = VRT._get_dst_band_data_type(srcs, dst)
+            dst['name'], wkv = self._create_band_name(dst, band_names, wkv_cache)
+            band_names.add(dst['name'])
+            dst['SourceFilename'] = srcs[0]['SourceFilename']
+            dst['SourceBand'] = str(srcs[0]['SourceBand'])
+            bands_xml.append(VRT._make_band_xml(
+                self.dataset.RasterCount + len(bands_xml) + 1, srcs, dst, wkv))
             self.logger.debug('Creating band - OK!')
+
+        self._write_bands_xml(bands_xml)
         self.dataset.FlushCache()
+        self.band_creation_time += default_timer() - start_time
+
+    def _write_bands_xml(self, bands_xml):
+        """Add XML of several bands (list of <VRTRasterBand> strings) to the VRT file"""
+        if not bands_xml:
+            return
+        vrt_xml = self.xml
+        end = vrt_xml.rfind('</VRTDataset>')
+        self.write_xml(vrt_xml[:end] + ''.join(bands_xml) + vrt_xml[end:])
+
+    @staticmethod
+    def _make_band_xml(band_num, srcs, dst, wkv):
+        """Generate XML of VRTRasterBand (as created by VRT.create_band)
+
+        Parameters
+        ----------
+        band_num : int
+            number of the band in the dataset
+        srcs : list of dict
+            parameters of sources with XML (output from VRT._make_source_bands_xml)
+        dst : dict
+            parameters of the band (with dataType and name)
+        wkv : dict
+            WKV metadata (overwritten by metadata from <dst>)
+
+        Returns
+        -------
+        xml : str
+
+        """
+        metadata = dict(wkv)
+        metadata.update(dst)
+        metadata_xml = ''
+        for key in metadata:
+            try:
+                metadata_xml += '\n    <MDI key=%s>%s</MDI>' % (quoteattr(str(key)),
+                                                               escape(str(metadata[key])))
+            except UnicodeEncodeError:
+                warnings.warn('Cannot add %s to metadata' % key)
+
+        options = VRT._set_add_band_options(srcs, dst)
+        sub_class = ''
+        derived_xml = ''
+        for option in options:
+            key, value = option.split('=', 1)
+            if key == 'subClass':
+                sub_class = ' subClass="%s"' % value
+            else:
+                derived_xml += '\n  <%s>%s</%s>' % (key, escape(value), key)
+
+        return ('\n<VRTRasterBand dataType="%s" band="%d"%s>\n  <Metadata>%s\n  </Metadata>'
+                '%s%s\n</VRTRasterBand>\n' % (
+                    gdal.GetDataTypeName(int(dst['dataType'])), band_num, sub_class,
+                    metadata_xml, derived_xml, ''.join([src['XML'] for src in srcs])))
 
     def create_band(self, src, dst=None):
         """ Add band to self.dataset:
@@ -1030,6 +1349,13 @@ class VRT(object):
             ByteOrder (RawVRT)
             xSize
             ySize
+            xOff
+            yOff
+            dstXSize (size of destination window, if different from xSize)
+            dstYSize
+            dstXOff (offset of destination window, may be fractional or negative)
+            dstYOff
+            resampling (GDAL resampling if source and destination sizes differ)
         dst : dict with parameters of the created band
             name
             dataType
@@ -1063,6 +1389,7 @@ class VRT(object):
                          {'PixelFunctionType': 'NameOfPixelFunction'})
 
         """
+        start_time = default_timer()
         self.logger.debug('INPUTS: %s, %s " ' % (str(src), str(dst)))
         # Make sure src is list, ready for loop
         if type(src) == dict:
@@ -1106,6 +1433,7 @@ class VRT(object):
         dst['SourceBand'] = str(srcs[0]['SourceBand'])
         dst_raster_band = VRT._put_metadata(dst_raster_band, dst)
 
+        self.band_creation_time += default_timer() - start_time
         # return name of the created band
         return dst['name']
 
@@ -1251,7 +1579,7 @@ class VRT(object):
 
         return warped_vrt
 
-    def copyproj(self, filename):
+    def copyproj(self, filename, x_factor=1, y_factor=1):
         """ Copy geoloctation data from given VRT to a figure file
 
         Useful for adding geolocation information to figure
@@ -1262,12 +1590,23 @@ class VRT(object):
         -----------
         filename : string
             Name of file to which the geolocation data shall be written
+        x_factor, y_factor : float
+            ratio of width and height of the figure to the size of the VRT (for decimated
+            figures)
 
         """
         figDataset = gdal.Open(filename, gdal.GA_Update)
-        figDataset.SetGeoTransform(self.dataset.GetGeoTransform())
+        geo_transform = list(self.dataset.GetGeoTransform())
+        geo_transform[1] /= float(x_factor)
+        geo_transform[4] /= float(x_factor)
+        geo_transform[2] /= float(y_factor)
+        geo_transform[5] /= float(y_factor)
+        figDataset.SetGeoTransform(geo_transform)
         figDataset.SetProjection(self.dataset.GetProjection())
         gcps = self.dataset.GetGCPs()
+        for gcp in gcps:
+            gcp.GCPPixel *= x_factor
+            gcp.GCPLine *= y_factor
         if len(gcps) != 0:
             figDataset.SetGCPs(gcps, self.dataset.GetGCPProjection())
         figDataset = None  # Close and write output file
@@ -1399,6 +1738,26 @@ class VRT(object):
         # return restored sub-VRT
         return self.vrt.get_sub_vrt(steps)
 
+    def get_cropped_vrt(self, x_offset, y_offset, x_size, y_size):
+        """Create VRT with data subset read directly from the source (e.g. a server)
+
+        Mappers which can read a subset of data more efficiently than GDAL reads it from the
+        full size bands (e.g. OPeNDAP mappers) override this method. Nansat.crop uses the
+        returned VRT if it is not None.
+
+        Parameters
+        ----------
+        x_offset, y_offset, x_size, y_size : int
+            offset and size of the subset
+
+        Returns
+        -------
+        cropped_vrt : VRT or None
+            None if subsetting is not supported
+
+        """
+        return None
+
     def get_super_vrt(self):
         """Create vrt with subVRT
 
@@ -1535,6 +1894,43 @@ class VRT(object):
 
         return projection
 
+    def get_resampled_vrt(self, x_size, y_size, resample_alg=1):
+        """ Resample all bands to new size without creating warped VRT
+
+        Each band of the returned VRT has a single source which refers to the band of self and
+        has destination window of the new size. The resampling is done by GDAL on reading,
+        only for the requested window. As in get_resized_vrt, the centers of the first and
+        the last pixels of self are stretched to the edges of the new raster. This is much
+        faster than get_resized_vrt, which is useful for bands that are rarely read (e.g.
+        full size bands from coarse grids of angles).
+
+        Parameters
+        -----------
+        x_size, y_size : int
+            new size of the VRT object
+        resample_alg : int
+            0 - nearest, 1 - bilinear, 2 - cubic, 3 - cubicspline, 4 - lanczos
+
+        Returns
+        --------
+        resampled_vrt : VRT object with reference to self in resampled_vrt.vrt
+
+        """
+        resampled_vrt = VRT(x_size=x_size, y_size=y_size)
+        for i in range(self.dataset.RasterCount):
+            resampled_vrt.create_band({'SourceFilename': self.filename,
+                                       'SourceBand': i + 1,
+                                       'xOff': 0.5,
+                                       'yOff': 0.5,
+                                       'xSize': max(self.dataset.RasterXSize - 1, 1),
+                                       'ySize': max(self.dataset.RasterYSize - 1, 1),
+                                       'dstXSize': x_size,
+                                       'dstYSize': y_size,
+                                       'resampling': self.RESAMPLING_NAMES[resample_alg]})
+        resampled_vrt.dataset.FlushCache()
+        resampled_vrt.vrt = self
+        return resampled_vrt
+
     def get_resized_vrt(self, x_size, y_size, resample_alg=1):
 
         """ Resize VRT
@@ -1653,22 +2049,27 @@ class VRT(object):
         # write modified XML
         self.write_xml(node0.rawxml())
 
-    def shift_cropped_gcps(self, x_offset, x_size, y_offset, y_size):
-        """Modify GCPs to fit the size/offset of cropped image"""
-        gcps = self.dataset.GetGCPs()
-        if len(gcps) == 0:
-            return
+    def shift_cropped_gcps(self, x_offset, x_size, y_offset, y_size, gcp_array=None):
+        """Modify GCPs to fit the size/offset of cropped image
 
-        dst_gcps = []
-        i = 0
-        # keep current GCPs
-        for igcp in gcps:
-            if (0 < igcp.GCPPixel - x_offset < x_size and 0 < igcp.GCPLine - y_offset < y_size):
-                i += 1
-                dst_gcps.append(gdal.GCP(igcp.GCPX, igcp.GCPY, 0,
-                                         igcp.GCPPixel - x_offset,
-                                         igcp.GCPLine - y_offset, str(''), str(i)))
-        n_gcps = i
+        Parameters
+        ----------
+        x_offset, x_size, y_offset, y_size : int
+            offset and size of the cropped image
+        gcp_array : numpy.ndarray
+            GCPs inside the window read from the source, relative to the window (GCP_DTYPE).
+            If None, the current GCPs inside the window are kept.
+
+        """
+        if gcp_array is None:
+            gcps = self.dataset.GetGCPs()
+            if len(gcps) == 0:
+                return
+            # keep current GCPs inside the window
+            gcp_array = crop_gcps(gcps_to_array(gcps), x_offset, x_size, y_offset, y_size)
+        gcp_array['GCPZ'] = 0
+        dst_gcps = array_to_gcps(gcp_array)
+        n_gcps = len(dst_gcps)
         if n_gcps < 100:
             # create new 100 GPCs (10 x 10 regular matrix)
             pix_array, lin_array = np.mgrid[0:x_size:10j, 0:y_size:10j]
@@ -1717,13 +2118,106 @@ class VRT(object):
         return str(vsi_file_content.decode())
 
     @staticmethod
-    def _make_source_bands_xml(src_in):
+    def _read_vsi_bytes(filename):
+        """Read contents of VSI file <filename:str> as bytes or return None if it does not exist"""
+        vsi_file = gdal.VSIFOpenL(str(filename), str('rb'))
+        if vsi_file is None:
+            return None
+        gdal.VSIFSeekL(vsi_file, 0, 2)
+        vsi_file_size = gdal.VSIFTellL(vsi_file)
+        gdal.VSIFSeekL(vsi_file, 0, 0)
+        vsi_file_content = gdal.VSIFReadL(vsi_file_size, 1, vsi_file)
+        gdal.VSIFCloseL(vsi_file)
+        return vsi_file_content
+
+    def get_vsi_files(self):
+        """Get contents of self.filename and of all VSI files it refers to (recursively)
+
+        Returns
+        -------
+        vsi_files : dict
+            names (str) and contents (bytes) of VSI files. Can be used in VRT.from_vsi_files
+
+        """
+        self.dataset.FlushCache()
+        vsi_files = {}
+        filenames = [self.filename]
+        while len(filenames) > 0:
+            filename = filenames.pop()
+            if filename in vsi_files:
+                continue
+            content = VRT._read_vsi_bytes(filename)
+            if content is None:
+                continue
+            vsi_files[filename] = content
+            if filename.endswith('.vrt'):
+                filenames += re.findall(r'/vsimem/[^<>"\s]+', content.decode())
+        return vsi_files
+
+    def _get_cache_state(self):
+        """Get state of the VRT which is not kept in the VRT-files (for Nansat cache)
+
+        Mappers which keep other attributes (e.g. LUTs) add them to the state.
+
+        Returns
+        -------
+        state : dict
+            JSON serializable state. Key 'band_vrts' has keys of self.band_vrts with file names
+            of the auxiliary VRTs (or lists of file names).
+
+        """
+        band_vrts = []
+        for key in self.band_vrts:
+            if isinstance(self.band_vrts[key], list):
+                band_vrts.append([key, [band_vrt.filename for band_vrt in self.band_vrts[key]]])
+            else:
+                band_vrts.append([key, self.band_vrts[key].filename])
+        return {'band_vrts': band_vrts}
+
+    def _set_cache_state(self, state):
+        """Restore state saved by VRT._get_cache_state in VRT created by VRT.from_vsi_files
+
+        Auxiliary VRTs (see VRT._init_from_vsi_files) get their original keys in
+        self.band_vrts.
+
+        """
+        restored_vrts = dict(self.band_vrts)
+        for key, filenames in state['band_vrts']:
+            names = filenames if isinstance(filenames, list) else [filenames]
+            # VRTs which are not referenced from the main VRT-file were not cached
+            if not all(name in restored_vrts for name in names):
+                continue
+            for name in names:
+                self.band_vrts.pop(name, None)
+            if isinstance(filenames, list):
+                self.band_vrts[key] = [restored_vrts[name] for name in names]
+            else:
+                self.band_vrts[key] = restored_vrts[filenames]
+
+    @staticmethod
+    def _check_cache_state(state):
+        """Check that state saved by VRT._get_cache_state is still valid
+
+        Raises
+        ------
+        ValueError
+            if the cached result of the mapper is outdated (e.g. other files read by the mapper
+            have changed)
+
+        """
+        pass
+
+    @staticmethod
+    def _make_source_bands_xml(src_in, src_datasets=None):
         """Check parameters of band source, set defaults and generate XML for VRT
 
         Parameters
         -------
             src_in : dict
                 dict with band source parameters (SourceFilename, SourceBand, etc)
+            src_datasets : dict
+                already opened source files {SourceFilename: gdal.Dataset}. Updated with
+                newly opened files.
         Returns
         -------
             src : dict
@@ -1741,15 +2235,19 @@ class VRT(object):
                'ScaleOffset': 0.0}
         src.update(src_in)
 
-        # find DataType of source (if not given in src)
-        if src['SourceBand'] > 0 and 'DataType' not in src:
-            raster_band = gdal.Open(src['SourceFilename']).GetRasterBand(src['SourceBand'])
-            src['DataType'] = raster_band.DataType
-
-        if 'xSize' not in src or 'ySize' not in src:
-            ds = gdal.Open(src['SourceFilename'])
-            src['xSize'] = ds.RasterXSize
-            src['ySize'] = ds.RasterYSize
+        # find DataType and size of source (if not given in src), open source only once
+        if ((src['SourceBand'] > 0 and 'DataType' not in src) or
+                'xSize' not in src or 'ySize' not in src):
+            if src_datasets is None:
+                src_datasets = {}
+            if src['SourceFilename'] not in src_datasets:
+                src_datasets[src['SourceFilename']] = gdal.Open(src['SourceFilename'])
+            ds = src_datasets[src['SourceFilename']]
+            if src['SourceBand'] > 0 and 'DataType' not in src:
+                src['DataType'] = ds.GetRasterBand(src['SourceBand']).DataType
+            if 'xSize' not in src or 'ySize' not in src:
+                src['xSize'] = ds.RasterXSize
+                src['ySize'] = ds.RasterYSize
 
         # create XML for each source
         src['XML'] = VRT.COMPLEX_SOURCE_XML.substitute(
@@ -1763,7 +2261,12 @@ class VRT(object):
             xSize=src['xSize'],
             ySize=src['ySize'],
             xOff=src.get('xOff', 0),
-            yOff=src.get('yOff', 0),)
+            yOff=src.get('yOff', 0),
+            dstXOff=src.get('dstXOff', 0),
+            dstYOff=src.get('dstYOff', 0),
+            dstXSize=src.get('dstXSize', src['xSize']),
+            dstYSize=src.get('dstYSize', src['ySize']),
+            Resampling=(' resampling="%s"' % src['resampling'] if 'resampling' in src else ''),)
 
         return src
 